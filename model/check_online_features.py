@@ -0,0 +1,273 @@
+#! /usr/bin/env python3
+"""
+Checks that the online features computed by flow_features.FlowFeatureState
+match the features that parse_dumbbell.py computes from complete packet traces.
+
+Either checks existing simulations, which parse_dumbbell.py must already have
+parsed, or, with --synthetic, generates small synthetic simulations, parses
+them, and checks them. The synthetic simulations are self-contained and are
+designed to exercise loss events, TSecr matching, and every window size.
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+from os import path
+import random
+import tempfile
+
+import numpy as np
+import scapy.layers.inet
+import scapy.layers.ppp
+import scapy.utils
+
+import flow_features
+import parse_dumbbell
+import utils
+
+
+# The relative tolerance with which to compare features. Windowed averages are
+# computed using running sums, so they may differ in the last few bits.
+RTOL = 1e-9
+# The synthetic simulations.
+#
+# The name of each synthetic simulation, which encodes its parameters (see
+# utils.Sim). There is one unfair flow and no other traffic.
+SYN_NAME = "100Mbps-50us-100p-1unfair-1fair-50,50us-1380B-1s"
+# The number of synthetic simulations, each with a different random seed.
+SYN_SIMS = 2
+# The number of data packets that the sender sends.
+SYN_PKTS = 5000
+# Range of the time between consecutive data packets at the sender (us).
+SYN_INTERARR_us = (15, 35)
+# One-way delay (us), plus a random range of jitter on the forward path (us).
+SYN_OWD_us = 50
+SYN_JITTER_us = (0, 100)
+# Range of the number of packets between loss events. Loss events are spaced
+# many RTTs apart, so that each one starts a new loss interval.
+SYN_LOSS_GAP_PKTS = (100, 300)
+# The maximum number of consecutive packets that a loss event drops.
+SYN_MAX_BURST_PKTS = 3
+# The probability that the sender retransmits a lost packet instead of
+# sending a new one, if there are lost packets (percent).
+SYN_RETX_PRC = 50
+# The granularity of the TSval clocks (us). Coarser than the interarrival time,
+# so that consecutive ACKs share TSvals.
+SYN_TSVAL_us = 100
+# The source IP addresses of data packets and of ACKs (see
+# utils.parse_packets()).
+SYN_DATA_IP = "10.0.0.1"
+SYN_ACK_IP = "20.0.0.1"
+# The size of each packet's headers (bytes).
+SYN_HDR_B = 52
+# The pcap link type of PPP.
+PPP_LINKTYPE = 9
+
+
+def process_one(sim_dir, parsed_dir, coverage=False):
+    """
+    Process a single simulation. Returns the number of packets checked and the
+    names of the features that differ. If coverage is True, then also verifies
+    that the simulation exercises the features' corner cases.
+    """
+    sim = utils.Sim(sim_dir)
+    dat = np.load(path.join(parsed_dir, f"{sim.name}.npz"))
+    num_pkts = 0
+    bad_fets = set()
+    for unfair_idx in range(sim.unfair_flws):
+        recv_pcap_flp = utils.get_recv_pcap_flp(sim_dir, unfair_idx)
+        state = flow_features.FlowFeatureState(sim.payload_B)
+        pkts = utils.parse_packets_all(recv_pcap_flp, sim.payload_B)
+        fets = flow_features.replay(
+            pkts["data"], pkts["ack"], sim.payload_B, state)
+        expected = dat[str(unfair_idx + 1)]
+        assert fets.shape[0] == expected.shape[0], \
+            (f"Expected {expected.shape[0]} packets, but found {fets.shape[0]} "
+             f"in: {recv_pcap_flp}")
+        if coverage:
+            check_coverage(state, fets)
+        num_pkts += fets.shape[0]
+        for fet_idx, fet in enumerate(flow_features.NAMES):
+            if fet in flow_features.SENDER_FETS:
+                continue
+            if not np.allclose(
+                    fets[:, fet_idx], expected[fet], rtol=RTOL, atol=0):
+                bad_fets.add(fet)
+    return num_pkts, bad_fets
+
+
+def check_coverage(state, fets):
+    """
+    Verifies that a flow exercised the corner cases of the online features,
+    given the flow's final FlowFeatureState and its features.
+    """
+    arr_times_us = fets[:, flow_features.NAMES.index("arrival time us")]
+    rtts_us = fets[:, flow_features.NAMES.index(
+        parse_dumbbell.make_ewma_metric("RTT estimate us", alpha=1.))]
+    # Every packet after the first matched the TSecr of an ACK, and the
+    # matches produced different RTT estimates.
+    assert (rtts_us[1:] != -1).all(), "Some packets have no RTT estimate."
+    assert np.unique(rtts_us[1:]).shape[0] > 1, "The RTT never changes."
+    # Even the largest window slid forward.
+    assert (arr_times_us[-1] - arr_times_us[0] >
+            parse_dumbbell.WINDOWS[-1] * state.min_rtt_us), \
+        "The flow is shorter than the largest window."
+    # Every window accumulated as many loss intervals as it keeps (see
+    # flow_features.NUM_LOSS_INTERVALS).
+    for win, win_state in zip(parse_dumbbell.WINDOWS, state.win_state):
+        intervals = win_state["loss_event_intervals"]
+        assert len(intervals) == intervals.maxlen, \
+            (f"Window {win} has {len(intervals)} loss intervals, but keeps "
+             f"{intervals.maxlen}.")
+
+
+def write_pcap(flp, pkts):
+    """
+    Writes packets to a PPP pcap file, capturing only their headers. pkts
+    contains tuples of the form:
+        (timestamp us, source IP, seq, TSval, TSecr, wire length)
+    """
+    wrt = scapy.utils.RawPcapWriter(flp, linktype=PPP_LINKTYPE)
+    try:
+        wrt.write_header(None)
+        for time_us, src, seq, tsval, tsecr, wirelen in pkts:
+            pkt = bytes(
+                scapy.layers.ppp.PPP() / scapy.layers.inet.IP(src=src) /
+                scapy.layers.inet.TCP(
+                    seq=seq, options=[("Timestamp", (tsval, tsecr))]))
+            wrt.write_packet(
+                pkt, sec=time_us // 10**6, usec=time_us % 10**6,
+                caplen=len(pkt), wirelen=wirelen)
+    finally:
+        wrt.close()
+
+
+def gen_sim(sim_dir, seed):
+    """
+    Writes the packet traces of a synthetic simulation to sim_dir, whose name
+    must be SYN_NAME. The sender sends SYN_PKTS data packets, some of which are
+    lost in bursts and some of which are retransmissions. The receiver ACKs
+    every data packet immediately, and each data packet echoes the newest
+    TSval that has reached the sender. Returns the number of loss events.
+    """
+    rng = random.Random(seed)
+    sim = utils.Sim(sim_dir)
+    data_B = int(sim.payload_B) + SYN_HDR_B
+    # Packets are tuples of the form:
+    #     (timestamp us, source IP, seq, TSval, TSecr, wire length)
+    sent = []
+    router = []
+    recv = [(0, SYN_ACK_IP, 0, 0, 0, SYN_HDR_B)]
+    # The (arrival time us, TSval) of each ACK that has not reached the sender.
+    acks = collections.deque([(SYN_OWD_us, 0)])
+    tsecr = 0
+    time_us = 1000
+    last_arr_us = 0
+    next_seq = 0
+    # Sequence numbers that were lost and not yet retransmitted.
+    lost = []
+    num_loss_events = 0
+    next_loss_idx = rng.randint(*SYN_LOSS_GAP_PKTS)
+    burst = 0
+    for pkt_idx in range(SYN_PKTS):
+        time_us += rng.randint(*SYN_INTERARR_us)
+        while acks and acks[0][0] <= time_us:
+            tsecr = acks.popleft()[1]
+        if lost and rng.random() < SYN_RETX_PRC / 100:
+            seq = lost.pop(0)
+        else:
+            seq = next_seq
+            next_seq += int(sim.payload_B)
+        tsval = time_us // SYN_TSVAL_us
+        sent.append((time_us, SYN_DATA_IP, seq, tsval, tsecr, data_B))
+        if pkt_idx == next_loss_idx:
+            burst = rng.randint(1, SYN_MAX_BURST_PKTS)
+            num_loss_events += 1
+            next_loss_idx += burst + rng.randint(*SYN_LOSS_GAP_PKTS)
+        if burst:
+            burst -= 1
+            lost.append(seq)
+            continue
+        arr_us = max(
+            last_arr_us + 1,
+            time_us + SYN_OWD_us + rng.randint(*SYN_JITTER_us))
+        last_arr_us = arr_us
+        router.append(
+            (time_us + SYN_OWD_us // 2, SYN_DATA_IP, seq, tsval, tsecr, data_B))
+        recv.append((arr_us, SYN_DATA_IP, seq, tsval, tsecr, data_B))
+        ack_tsval = arr_us // SYN_TSVAL_us
+        recv.append((arr_us, SYN_ACK_IP, 0, ack_tsval, tsval, SYN_HDR_B))
+        acks.append((arr_us + SYN_OWD_us, ack_tsval))
+
+    os.makedirs(sim_dir)
+    write_pcap(path.join(sim_dir, f"{sim.name}-1-0.pcap"), sorted(router))
+    write_pcap(path.join(sim_dir, f"{sim.name}-2-0.pcap"), sent)
+    write_pcap(utils.get_recv_pcap_flp(sim_dir, 0), recv)
+    return num_loss_events
+
+
+def process_synthetic(seed):
+    """
+    Generates, parses, and checks one synthetic simulation. Returns the same
+    as process_one().
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sim_dir = path.join(tmp_dir, SYN_NAME)
+        num_loss_events = gen_sim(sim_dir, seed)
+        # Each window size must discard old loss intervals.
+        assert num_loss_events > 2 * (flow_features.NUM_LOSS_INTERVALS + 1), \
+            f"Too few loss events: {num_loss_events}"
+        parsed_dir = path.join(tmp_dir, "parsed")
+        os.makedirs(parsed_dir)
+        parse_dumbbell.parse_pcap(sim_dir, parsed_dir)
+        return process_one(sim_dir, parsed_dir, coverage=True)
+
+
+def main():
+    """ This program's entrypoint. """
+    # Parse command line arguments.
+    psr = argparse.ArgumentParser(
+        ("Checks that the features computed online by flow_features.py match "
+         "the output of parse_dumbbell.py."))
+    psr.add_argument(
+        "--exp-dir",
+        help=("The directory in which the experiment results are stored "
+              "(required unless using \"--synthetic\")."), type=str)
+    psr.add_argument(
+        "--parsed-dir",
+        help=("The directory in which parse_dumbbell.py stored its output "
+              "(required unless using \"--synthetic\")."), type=str)
+    psr.add_argument(
+        "--synthetic", action="store_true",
+        help=("Check synthetic simulations instead of existing ones. Does not "
+              "require any existing output."))
+    args = psr.parse_args()
+    if args.synthetic:
+        sims = [f"synthetic {seed}" for seed in range(SYN_SIMS)]
+        fnc = process_synthetic
+        fnc_args = [(seed,) for seed in range(SYN_SIMS)]
+    else:
+        assert args.exp_dir is not None and args.parsed_dir is not None, \
+            "\"--exp-dir\" and \"--parsed-dir\" are required."
+        exp_dir = args.exp_dir
+        sims = [path.join(exp_dir, sim) for sim in sorted(os.listdir(exp_dir))
+                if path.isdir(path.join(exp_dir, sim))]
+        fnc = process_one
+        fnc_args = [(sim_dir, args.parsed_dir) for sim_dir in sims]
+    print(f"Found {len(sims)} simulations.")
+
+    with multiprocessing.Pool() as pol:
+        res = pol.starmap(fnc, fnc_args)
+
+    num_pkts = sum(num_pkts for num_pkts, _ in res)
+    print(f"Checked {num_pkts} packets.")
+    mismatches = [
+        (sim, bad_fets) for sim, (_, bad_fets) in zip(sims, res) if bad_fets]
+    for sim, bad_fets in mismatches:
+        print(f"    Simulation {sim} has mismatched features: "
+              f"{sorted(bad_fets)}")
+    print(f"{len(sims) - len(mismatches)}/{len(sims)} simulations match.")
+
+if __name__ == "__main__":
+    main()
@@ -87,20 +87,44 @@ def add_training(psr, psr_verify=lambda args: args):
         max_iter = args.max_iter
         assert max_iter > 0, \
             f"\"max-iter\" must be greater than 0, but is: {max_iter}"
+        seq_len = args.seq_len
+        assert seq_len > 0, \
+            f"\"seq-len\" must be greater than 0, but is: {seq_len}"
+        num_workers = args.num_workers
+        assert num_workers >= 0, \
+            f"\"num-workers\" cannot be negative, but is: {num_workers}"
         folds = args.folds
         assert folds >= 2, f"\"folds\" must be at least 2, but is: {folds}"
         keep_prc = args.keep_percent
         assert 0 < keep_prc <= 100, \
             ("\"keep-percent\" must be in the range (0, 100], but is: "
              f"{keep_prc}")
+        assert (args.data_dir is None) != (args.split_dir is None), \
+            "Exactly one of \"data-dir\" and \"split-dir\" must be specified."
+        assert not (args.lazy_windows and args.split_dir is not None), \
+            "\"lazy-windows\" cannot be used with \"split-dir\"."
         return args
 
     psr, psr_verify = add_num_sims(*add_common(psr, psr_verify))
     psr.add_argument(
         "--data-dir",
         help=("The path to a directory containing the"
-              "training/validation/testing data (required)."),
-        required=True, type=str)
+              "training/validation/testing data."),
+        type=str)
+    psr.add_argument(
+        "--split-dir",
+        help=("The path to a directory containing training, validation, and "
+              "test split files created by prepare_data.py. Train from these "
+              "files directly instead of from \"data-dir\", reading them in "
+              "chunks as needed. Supports only PyTorch models that use one "
+              "packet per example."),
+        type=str)
+    psr.add_argument(
+        "--lazy-windows", action="store_true",
+        help=("For PyTorch models that divide simulations into windows, create "
+              "each window when it is used instead of creating all windows "
+              "up front. Reduces memory usage to the size of the "
+              "simulations' packets."))
     psr.add_argument(
         "--keep-percent", default=defaults.DEFAULTS["keep_percent"],
         help="The percent of each simulation's datapoints to keep.", type=float)
@@ -115,12 +139,24 @@ def add_training(psr, psr_verify=lambda args: args):
     psr.add_argument(
         "--num-gpus", default=defaults.DEFAULTS["num_gpus"],
         help="The number of GPUs to use.", type=int)
+    psr.add_argument(
+        "--num-workers", default=defaults.DEFAULTS["num_workers"],
+        help=("The number of worker processes that load batches for PyTorch "
+              "models. If 0, then batches are loaded by the main process."),
+        type=int)
     psr.add_argument(
         "--train-batch", default=defaults.DEFAULTS["train_batch"],
         help="The batch size to use during training.", type=int)
     psr.add_argument(
         "--test-batch", default=defaults.DEFAULTS["test_batch"],
         help="The batch size to use during validation and testing.", type=int)
+    psr.add_argument(
+        "--seq-len", default=defaults.DEFAULTS["seq_len"],
+        help=("If the model is an LSTM, then train on consecutive sequences "
+              "of this many packets from each simulation, carrying the hidden "
+              "state over from one sequence to the next. The batch sizes are "
+              "the number of simulations in each batch. Ignored otherwise."),
+        type=int)
     psr.add_argument(
         "--learning-rate", default=defaults.DEFAULTS["learning_rate"],
         help="Learning rate for SGD training.", type=float)
@@ -7,6 +7,8 @@ import models
 # Parameter defaults.
 DEFAULTS = {
     "data_dir": ".",
+    "split_dir": None,
+    "lazy_windows": False,
     "warmup_percent": 0,
     "keep_percent": 100,
     "num_sims": sys.maxsize,
@@ -15,8 +17,10 @@ DEFAULTS = {
     "features": [],
     "epochs": 100,
     "num_gpus": 0,
+    "num_workers": 0,
     "train_batch": sys.maxsize,
     "test_batch": sys.maxsize,
+    "seq_len": 100,
     "learning_rate": 0.001,
     "momentum": 0.09,
     "kernel": "linear",
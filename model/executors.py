@@ -0,0 +1,399 @@
+#! /usr/bin/env python3
+"""
+Pluggable backends for running many independent tasks, e.g., simulations or
+pcap parsing jobs. Every backend implements starmap(), which has the same
+semantics as multiprocessing.Pool.starmap().
+
+Three backends are available:
+    LocalExecutor: Runs tasks on this machine, using a multiprocessing.Pool.
+    FsQueueExecutor: Runs tasks on many machines that share a directory. The
+        submitting process writes one file per task into the shared directory.
+        Workers on any machine (started by running this file) claim tasks by
+        creating lease files and write back their results. There is no central
+        service.
+    FakeExecutor: Runs tasks in-process, in order. Used for testing.
+"""
+
+import argparse
+import multiprocessing
+import os
+from os import path
+import pickle
+import secrets
+import shutil
+import socket
+import threading
+import time
+import traceback
+
+
+# How long a worker may hold a task without renewing its lease (seconds).
+# Leases that are older than this are assumed to belong to dead workers and
+# may be taken over.
+LEASE_S = 120
+# How often to check the work queue for new tasks or finished results
+# (seconds).
+POLL_S = 2
+# Names of the subdirectories of a job directory.
+TASKS_DIR = "tasks"
+LEASES_DIR = "leases"
+RESULTS_DIR = "results"
+# Name of the file that marks a job as fully enqueued.
+READY_FLN = "ready"
+
+
+class Executor:
+    """ Base class for all executors. """
+
+    # Whether tasks may run on a different machine than the caller. If so,
+    # then task arguments should not contain machine-specific state.
+    remote = False
+
+    def starmap(self, fnc, args_lst):
+        """
+        Calls fnc(*args) for each args in args_lst and returns a list of the
+        results, in the same order as args_lst.
+        """
+        raise Exception(
+            "Attempting to call \"starmap()\" on the Executor base class "
+            "itself.")
+
+
+class LocalExecutor(Executor):
+    """ Runs tasks on this machine. """
+
+    def __init__(self, sync=False, processes=None):
+        """
+        If sync is True, then tasks are run serially in this process.
+        Otherwise, tasks are run by a pool of processes workers (by default,
+        one per core).
+        """
+        self.sync = sync
+        self.processes = processes
+
+    def starmap(self, fnc, args_lst):
+        if self.sync:
+            return [fnc(*args) for args in args_lst]
+        with multiprocessing.Pool(processes=self.processes) as pol:
+            return pol.starmap(fnc, args_lst)
+
+
+class FakeExecutor(Executor):
+    """
+    Runs tasks in this process, in order. Every task is round-tripped through
+    pickle, like it would be by the other backends, so that unpicklable
+    arguments or results are detected. Records each call in self.calls.
+    """
+
+    def __init__(self):
+        # List of (function, arguments) pairs, one for each task.
+        self.calls = []
+
+    def starmap(self, fnc, args_lst):
+        check_importable(fnc)
+        ress = []
+        for args in args_lst:
+            fnc_, args = pickle.loads(pickle.dumps((fnc, tuple(args))))
+            self.calls.append((fnc_, args))
+            ress.append(pickle.loads(pickle.dumps(fnc_(*args))))
+        return ress
+
+
+class FsQueueExecutor(Executor):
+    """
+    Distributes tasks through a directory that is shared by many machines
+    (e.g., over NFS). Each call to starmap() creates a job directory:
+        <queue_dir>/<job>/tasks/<idx>.pickle: The function and arguments.
+        <queue_dir>/<job>/leases/<idx>: Exists while a worker runs the task.
+            Contains the holder's token (see new_token()). The lease's
+            modification time is renewed periodically.
+        <queue_dir>/<job>/results/<idx>.pickle: The task's result.
+    The caller also works on its own job, then waits for workers on other
+    machines to finish the remaining tasks.
+    """
+
+    remote = True
+
+    def __init__(self, queue_dir, processes=None, lease_s=LEASE_S):
+        """
+        queue_dir: The shared directory.
+        processes: The number of local worker processes to run while waiting
+            for results. By default, one per core.
+        lease_s: See LEASE_S.
+        """
+        self.queue_dir = queue_dir
+        self.processes = processes
+        self.lease_s = lease_s
+        if not path.isdir(queue_dir):
+            os.makedirs(queue_dir)
+
+    def starmap(self, fnc, args_lst):
+        check_importable(fnc)
+        job_dir = path.join(
+            self.queue_dir,
+            f"{socket.gethostname()}-{os.getpid()}-{time.time_ns()}")
+        num_tasks = enqueue(job_dir, fnc, args_lst)
+        print(f"Enqueued {num_tasks} tasks: {job_dir}")
+
+        # Work on this job locally. Other machines may be working on it too.
+        processes = (
+            os.cpu_count() if self.processes is None else self.processes)
+        with multiprocessing.Pool(processes=processes) as pol:
+            pol.starmap(
+                work_job, [(job_dir, self.lease_s)] * min(processes, num_tasks))
+
+        # Wait for the tasks that other machines are still working on.
+        ress = collect(job_dir, num_tasks, self.lease_s)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return ress
+
+
+def check_importable(fnc):
+    """
+    Verifies that fnc can be unpickled by a worker process that did not run
+    the caller's script. Functions are pickled by reference, so a function
+    that is defined in the script that is being run (i.e., in module
+    "__main__") refers to the worker's own "__main__" module instead.
+    """
+    assert fnc.__module__ != "__main__", \
+        (f"Function \"{fnc.__qualname__}\" is defined in \"__main__\", so "
+         "workers cannot import it. Import it from its module instead (e.g., "
+         "\"import <module>\" and pass \"<module>.<function>\").")
+
+
+def write_atomic(flp, obj):
+    """
+    Pickles obj to flp. Readers never observe a partially-written file,
+    because the file is written under a temporary name and then renamed.
+    """
+    tmp_flp = f"{flp}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp_flp, "wb") as fil:
+        pickle.dump(obj, fil)
+    os.replace(tmp_flp, flp)
+
+
+def enqueue(job_dir, fnc, args_lst):
+    """ Writes one task file for each args in args_lst. Returns the count. """
+    for sub_dir in [TASKS_DIR, LEASES_DIR, RESULTS_DIR]:
+        os.makedirs(path.join(job_dir, sub_dir))
+    num_tasks = 0
+    for idx, args in enumerate(args_lst):
+        write_atomic(
+            path.join(job_dir, TASKS_DIR, f"{idx}.pickle"), (fnc, tuple(args)))
+        num_tasks += 1
+    # Workers ignore jobs that are not ready.
+    write_atomic(path.join(job_dir, READY_FLN), num_tasks)
+    return num_tasks
+
+
+def new_token():
+    """ Returns a token that uniquely identifies a lease holder. """
+    return f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(8)}"
+
+
+def read_lease(lease_flp):
+    """
+    Returns the token of a lease's holder, or None if the lease does not
+    exist.
+    """
+    try:
+        with open(lease_flp, "r") as fil:
+            return fil.read()
+    except FileNotFoundError:
+        return None
+
+
+def try_lease(job_dir, idx, lease_s):
+    """
+    Attempts to acquire the lease for a task. Returns this worker's token if
+    successful, or None otherwise. Takes over leases that have not been
+    renewed for lease_s seconds.
+    """
+    lease_flp = path.join(job_dir, LEASES_DIR, str(idx))
+    tok = new_token()
+    try:
+        # O_EXCL guarantees that only one worker can create the lease.
+        fd = os.open(lease_flp, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        pass
+    else:
+        try:
+            os.write(fd, tok.encode())
+        finally:
+            os.close(fd)
+        return tok
+    try:
+        if time.time() - os.stat(lease_flp).st_mtime < lease_s:
+            return None
+        # The lease has expired. Only one worker can successfully rename
+        # it, and that worker may then retry creating it.
+        stale_flp = f"{lease_flp}.{tok}.stale"
+        os.rename(lease_flp, stale_flp)
+    except FileNotFoundError:
+        # Another worker finished with or took over the lease first.
+        return None
+    # Between checking the lease and renaming it, another worker may have
+    # taken it over, or its holder may have renewed it. If so, then the
+    # renamed lease is fresh and must be put back.
+    if time.time() - os.stat(stale_flp).st_mtime < lease_s:
+        try:
+            os.link(stale_flp, lease_flp)
+        except FileExistsError:
+            # Yet another worker has created a new lease.
+            pass
+        os.remove(stale_flp)
+        return None
+    os.remove(stale_flp)
+    print(f"Taking over expired lease: {lease_flp}")
+    return try_lease(job_dir, idx, lease_s)
+
+
+def renew_lease(lease_flp, tok, lease_s, stop):
+    """
+    Periodically renews a lease until stop is set or until the lease no
+    longer belongs to the holder with token tok.
+    """
+    while not stop.wait(lease_s / 4):
+        if read_lease(lease_flp) != tok:
+            print(f"Lost lease: {lease_flp}")
+            return
+        try:
+            os.utime(lease_flp)
+        except FileNotFoundError:
+            return
+
+
+def run_task(job_dir, idx, lease_s, tok):
+    """
+    Runs a task whose lease is held by this worker, with token tok. Returns
+    True if the task ran, or False if its result already exists.
+    """
+    tsk_flp = path.join(job_dir, TASKS_DIR, f"{idx}.pickle")
+    res_flp = path.join(job_dir, RESULTS_DIR, f"{idx}.pickle")
+    lease_flp = path.join(job_dir, LEASES_DIR, str(idx))
+    stop = threading.Event()
+    renewer = threading.Thread(
+        target=renew_lease, args=(lease_flp, tok, lease_s, stop), daemon=True)
+    renewer.start()
+    try:
+        # The result may have been written while we were acquiring the
+        # lease.
+        if path.exists(res_flp):
+            return False
+        try:
+            with open(tsk_flp, "rb") as fil:
+                fnc, args = pickle.load(fil)
+            res = (True, fnc(*args))
+        except Exception:  # pylint: disable=broad-except
+            # Send the exception back to the caller instead of killing the
+            # worker.
+            traceback.print_exc()
+            res = (False, traceback.format_exc())
+        write_atomic(res_flp, res)
+        return True
+    finally:
+        stop.set()
+        renewer.join()
+        # Do not remove a lease that another worker has taken over.
+        if read_lease(lease_flp) == tok:
+            try:
+                os.remove(lease_flp)
+            except FileNotFoundError:
+                pass
+
+
+def work_job(job_dir, lease_s=LEASE_S):
+    """
+    Runs tasks from a single job until none are left to claim. Returns the
+    number of tasks run.
+    """
+    try:
+        with open(path.join(job_dir, READY_FLN), "rb") as fil:
+            num_tasks = pickle.load(fil)
+    except FileNotFoundError:
+        # The job is not ready yet or has already been removed.
+        return 0
+    num_run = 0
+    for idx in range(num_tasks):
+        try:
+            if path.exists(path.join(job_dir, RESULTS_DIR, f"{idx}.pickle")):
+                continue
+            tok = try_lease(job_dir, idx, lease_s)
+            if tok is None:
+                continue
+            # Only count tasks that actually ran.
+            num_run += run_task(job_dir, idx, lease_s, tok)
+        except FileNotFoundError:
+            # The job was removed.
+            break
+    return num_run
+
+
+def collect(job_dir, num_tasks, lease_s=LEASE_S):
+    """
+    Waits for all of a job's results and returns them in order. While
+    waiting, runs any tasks whose leases expire.
+    """
+    ress = [None] * num_tasks
+    remaining = set(range(num_tasks))
+    while remaining:
+        for idx in sorted(remaining):
+            res_flp = path.join(job_dir, RESULTS_DIR, f"{idx}.pickle")
+            if not path.exists(res_flp):
+                continue
+            with open(res_flp, "rb") as fil:
+                success, res = pickle.load(fil)
+            if not success:
+                raise Exception(f"Task {idx} of {job_dir} failed:\n{res}")
+            ress[idx] = res
+            remaining.remove(idx)
+        if remaining:
+            # Pick up tasks abandoned by dead workers.
+            if not work_job(job_dir, lease_s):
+                time.sleep(POLL_S)
+    return ress
+
+
+def work(queue_dir, lease_s=LEASE_S, exit_when_idle=False):
+    """ Runs tasks from all jobs in queue_dir. """
+    while True:
+        num_run = sum(
+            work_job(path.join(queue_dir, job), lease_s)
+            for job in sorted(os.listdir(queue_dir)))
+        if not num_run:
+            if exit_when_idle:
+                return
+            time.sleep(POLL_S)
+
+
+def main():
+    """ This program's entrypoint. """
+    psr = argparse.ArgumentParser(
+        description="Runs tasks from a shared work queue directory.")
+    psr.add_argument(
+        "--queue-dir", help="The shared work queue directory (required).",
+        required=True, type=str)
+    psr.add_argument(
+        "--processes", default=os.cpu_count(),
+        help="The number of worker processes to run on this machine.",
+        type=int)
+    psr.add_argument(
+        "--lease-s", default=LEASE_S,
+        help="Leases that have not been renewed in this long are taken over.",
+        type=float)
+    psr.add_argument(
+        "--exit-when-idle", action="store_true",
+        help="Exit when there are no tasks left to claim.")
+    args = psr.parse_args()
+    queue_dir = args.queue_dir
+    assert path.isdir(queue_dir), \
+        f"Queue directory does not exist: {queue_dir}"
+    print(f"Working on: {queue_dir}")
+    with multiprocessing.Pool(processes=args.processes) as pol:
+        pol.starmap(
+            work,
+            [(queue_dir, args.lease_s, args.exit_when_idle)] * args.processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#! /usr/bin/env python3
+"""
+Exports a trained sklearn linear model (e.g., from models.SvmSklearnWrapper or
+models.LrSklearnWrapper, optionally wrapped in RFE) to a compact model file
+that linear_scorer.py loads without sklearn.
+
+Scaling is affine, so it is folded into the model's weights and biases. The
+exported model operates on unscaled features. Imputation replaces unknown
+values and therefore cannot be folded, so the imputation values are stored
+alongside the weights. Features whose weights are all 0 (e.g., features that
+RFE eliminated or columns that scale to a constant) are dropped.
+"""
+
+import argparse
+import json
+from os import path
+import pickle
+
+import numpy as np
+from sklearn import feature_selection
+from sklearn import linear_model
+from sklearn import svm
+
+import defaults
+import linear_scorer
+import models
+import scaling
+import utils
+
+
+# The number of random rows on which to compare the exported model with the
+# original model.
+NUM_CHECK_ROWS = 100_000
+# The fraction of random values that are unknown.
+CHECK_UNKNOWN_FRAC = 0.1
+
+
+def get_weights(net, num_fets):
+    """
+    Returns the weights (one row per decision function, one column per input
+    feature), biases, and classes of the sklearn model net, which has num_fets
+    input features.
+    """
+    support = np.ones((num_fets,), dtype=bool)
+    if isinstance(net, feature_selection.RFE):
+        # Includes RFECV. The underlying estimator only sees the features
+        # that were selected.
+        support = net.support_
+        net = net.estimator_
+    if not isinstance(net, (svm.LinearSVC, linear_model.LogisticRegression)):
+        raise Exception(f"Unsupported model type: {type(net).__name__}")
+    assert support.shape == (num_fets,), \
+        f"Expected {num_fets} features, but the model has {support.shape[0]}."
+    coef = np.zeros((net.coef_.shape[0], num_fets), dtype=float)
+    coef[:, support] = net.coef_
+    return coef, np.asarray(net.intercept_, dtype=float), net.classes_
+
+
+def export(net, fets, scl_prms, imp_prms, standardize):
+    """
+    Returns a linear_scorer.LinearScorer that is equivalent to applying the
+    sklearn model net to features fets that have been imputed with imp_prms
+    (which may be None) and scaled with scl_prms.
+    """
+    num_fets = len(fets)
+    coef, intercept, classes = get_weights(net, num_fets)
+    # Express scaling as scaled = raw * mul + add, using the same code as
+    # training so that degenerate columns are handled identically.
+    add = scaling.transform(
+        np.zeros((1, num_fets), dtype=float), scl_prms, standardize)[0]
+    mul = scaling.transform(
+        np.ones((1, num_fets), dtype=float), scl_prms, standardize)[0] - add
+    intercept = intercept + coef @ add
+    coef = coef * mul
+    if imp_prms is None:
+        imp_prms = np.full((num_fets,), np.nan)
+    keep = (coef != 0).any(axis=0)
+    return linear_scorer.LinearScorer(
+        [fet for fet, kept in zip(fets, keep) if kept], coef[:, keep],
+        intercept, imp_prms[keep], classes)
+
+
+def check(net, scr, fets, scl_prms, imp_prms, standardize, seed=0):
+    """
+    Compares the predictions of the original model and the exported model on
+    random features that are distributed according to the scaling parameters.
+    Returns the fraction of predictions that match.
+    """
+    rng = np.random.default_rng(seed)
+    num_fets = len(fets)
+    if standardize:
+        dat = scl_prms[:, 0] + scl_prms[:, 1] * rng.standard_normal(
+            (NUM_CHECK_ROWS, num_fets))
+    else:
+        dat = rng.uniform(
+            scl_prms[:, 0], scl_prms[:, 1], (NUM_CHECK_ROWS, num_fets))
+    dat[rng.random(dat.shape) < CHECK_UNKNOWN_FRAC] = linear_scorer.UNKNOWN
+    fet_idxs = [fets.index(fet) for fet in scr.fets]
+    exp = scr.predict(dat[:, fet_idxs])
+    if imp_prms is not None:
+        scaling.impute(dat, imp_prms, linear_scorer.UNKNOWN)
+    return (net.predict(scaling.transform(dat, scl_prms, standardize)) ==
+            exp).mean()
+
+
+def main():
+    """ This program's entrypoint. """
+    # Parse command line arguments.
+    psr = argparse.ArgumentParser(
+        description="Exports a trained linear model for linear_scorer.py.")
+    psr.add_argument(
+        "--model", help="The path to a trained model file (.pickle).",
+        required=True, type=str)
+    psr.add_argument(
+        "--scale-params", help="The path to the input scaling parameters.",
+        required=True, type=str)
+    psr.add_argument(
+        "--standardize", action="store_true",
+        help="The model was trained on standardized data.")
+    psr.add_argument(
+        "--features", nargs="+",
+        help=("The model's input features, in order. By default, determined "
+              "by the model type encoded in the model filename."),
+        type=str)
+    psr.add_argument(
+        "--out",
+        help=("The path to the exported model file. By default, the model "
+              "path with the extension \".npz\"."),
+        type=str)
+    args = psr.parse_args()
+    mdl_flp = args.model
+    scl_prms_flp = args.scale_params
+    assert path.exists(mdl_flp), f"Model file does not exist: {mdl_flp}"
+    assert mdl_flp.endswith("pickle"), \
+        f"Only sklearn models can be exported: {mdl_flp}"
+    assert path.exists(scl_prms_flp), \
+        f"Scale parameters file does not exist: {scl_prms_flp}"
+    out_flp = args.out
+    if out_flp is None:
+        out_flp = f"{path.splitext(mdl_flp)[0]}.npz"
+
+    fets = args.features
+    if fets is None:
+        # Convert the model filename to an arguments dictionary, and extract
+        # the "model" key.
+        fets = models.MODELS[utils.str_to_args(
+            path.basename(mdl_flp),
+            order=sorted(defaults.DEFAULTS.keys()))["model"]].in_spc
+    fets = list(fets)
+    with open(mdl_flp, "rb") as fil:
+        net = pickle.load(fil)
+    with open(scl_prms_flp, "r") as fil:
+        scl_prms = np.array(json.load(fil), dtype=float)
+    assert scl_prms.shape == (len(fets), 2), \
+        (f"Expected scaling parameters of shape ({len(fets)}, 2), but found: "
+         f"{scl_prms.shape}")
+    imp_prms_flp = utils.get_impute_prms_flp(scl_prms_flp)
+    if path.exists(imp_prms_flp):
+        imp_prms = utils.load_impute_prms(imp_prms_flp)
+    else:
+        print(f"Warning: Imputation values not found: {imp_prms_flp}")
+        imp_prms = None
+
+    scr = export(net, fets, scl_prms, imp_prms, args.standardize)
+    print(f"Kept {len(scr.fets)}/{len(fets)} features.")
+    print("Predictions that match the original model: "
+          f"{check(net, scr, fets, scl_prms, imp_prms, args.standardize):.2%}")
+    linear_scorer.save(out_flp, scr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+Computes the receiver-side features of parse_dumbbell.py online, one packet at
+a time, so that a receiver can classify a flow while it is running. The
+features of a packet are identical to those that parse_dumbbell.parse_pcap()
+records for that packet, except for features that require the sender's or the
+bottleneck router's packet traces (see SENDER_FETS), which are always -1
+(unknown).
+
+    FlowFeatureState: The feature state of a single flow.
+"""
+
+import collections
+import itertools
+import math
+
+import numpy as np
+
+import parse_dumbbell
+import utils
+
+
+# The names of the features, in the order in which they are returned.
+NAMES = [name for name, _ in parse_dumbbell.DTYPE]
+# The EWMA and windowed metrics, in the order in which they are returned.
+EWMA_METRICS = [metric for metric, _ in parse_dumbbell.EWMAS]
+WIN_METRICS = [metric for metric, _ in parse_dumbbell.WINDOWED]
+# Metrics that a receiver cannot compute on its own.
+SENDER_METRICS = {
+    "RTT true us", "RTT true ratio", "average RTT true us",
+    "average RTT true ratio", "loss rate true", "queue occupancy"}
+# The features based on SENDER_METRICS. These are always -1 (unknown).
+SENDER_FETS = (
+    {parse_dumbbell.make_ewma_metric(metric, alpha)
+     for metric, alpha in itertools.product(EWMA_METRICS, parse_dumbbell.ALPHAS)
+     if metric in SENDER_METRICS} |
+    {parse_dumbbell.make_win_metric(metric, win)
+     for metric, win in itertools.product(WIN_METRICS, parse_dumbbell.WINDOWS)
+     if metric in SENDER_METRICS})
+# The rows of the EWMA metrics that other metrics depend on.
+RTT_ESTIMATE_ROW = EWMA_METRICS.index("RTT estimate us")
+RTT_RATIO_ROW = EWMA_METRICS.index("RTT estimate ratio")
+EWMA_TPUT_ROW = EWMA_METRICS.index("throughput p/s")
+EWMA_MATHIS_ROW = EWMA_METRICS.index("mathis model throughput p/s")
+EWMA_LABEL_ROW = EWMA_METRICS.index("mathis model label")
+# The alpha values of the EWMA metrics.
+ALPHAS = np.array(parse_dumbbell.ALPHAS)
+# The column of the EWMAs with alpha = 1, which track the latest value.
+ALPHA_1_COL = parse_dumbbell.ALPHAS.index(1.)
+# The number of loss event intervals over which the loss event rate is
+# averaged.
+NUM_LOSS_INTERVALS = 8
+
+
+class FlowFeatureState:
+    """
+    Tracks the state that the features of a flow carry across packets. Each
+    packet costs O(1) amortized time. Memory is bounded by the number of
+    packets that arrive within the largest window (parse_dumbbell.WINDOWS[-1]
+    minimum RTTs) and by the number of ACKs that are outstanding at any time.
+
+    The RTT is estimated using the TCP timestamp option: a data packet whose
+    TSecr matches the TSval of an ACK that this receiver sent earlier yields an
+    RTT sample. Therefore, ack() must be called for every ACK, in order with
+    the calls to update().
+    """
+
+    def __init__(self, payload_B):
+        """ payload_B: The flow's packet payload size, in bytes. """
+        self.payload_B = payload_B
+        # The number of packets received so far.
+        self.num_pkts = 0
+        # Maps the TSval of each outstanding ACK to the time at which the
+        # first ACK with that TSval was sent. acks_order holds these TSvals
+        # in the order in which they were sent.
+        self.acks = {}
+        self.acks_order = collections.deque()
+
+        # Regular metrics. "min RTT us" is stored as an integer, like
+        # parse_pcap() does.
+        self.min_rtt_us = -1
+        self.arr_prev_us = -1
+        # Loss rate estimation.
+        self.prev_seq = 0
+        self.highest_seq = 0
+        self.pkt_loss_total_estimate = 0
+        # The EWMA metrics, with one row per metric and one column per alpha.
+        self.ewmas = np.full((len(EWMA_METRICS), len(ALPHAS)), -1.)
+
+        # The arrival time, RTT estimate, and RTT ratio of every packet since
+        # the start of the largest window. pkts[0] is packet number
+        # pkts_base.
+        self.pkts = []
+        self.pkts_base = 0
+        # State that the windowed metrics need to track across packets, with
+        # one entry per window.
+        self.win_state = [{
+            # The index at which this window starts.
+            "window_start_idx": 0,
+            # The sum and number of known RTT estimates and RTT ratios in
+            # this window, for the "average RTT estimate" metrics.
+            "rtt_estimate_sum": 0.,
+            "rtt_ratio_sum": 0.,
+            "rtt_count": 0,
+            # The "loss event rate". Only the most recent intervals affect
+            # the loss event rate, so only those are kept.
+            "loss_interval_weights": parse_dumbbell.make_interval_weight(
+                NUM_LOSS_INTERVALS),
+            "loss_event_intervals": collections.deque(
+                maxlen=min(win, NUM_LOSS_INTERVALS + 1)),
+            "current_loss_event_start_idx": 0,
+            "current_loss_event_start_time": 0,
+            # For "loss rate estimate".
+            "loss_queue_estimate": collections.deque()
+        } for win in parse_dumbbell.WINDOWS]
+
+    def ack(self, tsval, time_us):
+        """ Records that this receiver sent an ACK with the given TSval. """
+        if tsval not in self.acks:
+            self.acks[tsval] = time_us
+            self.acks_order.append(tsval)
+
+    def __match_ack(self, tsecr):
+        """
+        Returns the time at which the ACK whose TSval is tsecr was sent, or
+        None if there is no such ACK. ACKs that were sent before a matching ACK
+        are discarded, since later packets cannot match them.
+        """
+        ack_us = self.acks.get(tsecr)
+        if ack_us is not None:
+            while self.acks_order[0] != tsecr:
+                del self.acks[self.acks_order.popleft()]
+        return ack_us
+
+    def update(self, seq, arrival_us, tsval, tsecr):
+        """
+        Records the arrival of a data packet and returns its features, as a 1D
+        float array in the order of NAMES. seq is the packet's sequence number
+        and tsval and tsecr are its TCP timestamp option. tsval is not used by
+        any of the features.
+        """
+        j = self.num_pkts
+        # Regular metrics.
+        if j > 0:
+            ack_us = self.__match_ack(tsecr)
+            if ack_us is None:
+                # There is no matching ACK, so use the previous RTT estimate.
+                rtt_estimate_us = self.ewmas[
+                    RTT_ESTIMATE_ROW, ALPHA_1_COL].item()
+            else:
+                rtt_estimate_us = arrival_us - ack_us
+            min_rtt_us = utils.safe_min(self.min_rtt_us, rtt_estimate_us)
+            rtt_estimate_ratio = utils.safe_div(rtt_estimate_us, min_rtt_us)
+            recv_time_prev = self.arr_prev_us
+            interarr_time_us = arrival_us - recv_time_prev
+        else:
+            rtt_estimate_us = -1
+            rtt_estimate_ratio = -1
+            min_rtt_us = -1
+            recv_time_prev = -1
+            interarr_time_us = -1
+
+        # Receiver-side loss rate estimation. See parse_pcap().
+        pkt_loss_cur_estimate = math.ceil(
+            0 if seq == self.prev_seq + self.payload_B
+            else (
+                ((seq - self.highest_seq - self.payload_B) / self.payload_B)
+                if seq > self.highest_seq + self.payload_B
+                else (
+                    1
+                    if (seq < self.prev_seq and
+                        self.prev_seq != self.highest_seq)
+                    else 0)))
+        self.pkt_loss_total_estimate += pkt_loss_cur_estimate
+        pkt_loss_total_estimate = self.pkt_loss_total_estimate
+        self.prev_seq = seq
+        self.highest_seq = max(self.highest_seq, seq)
+        loss_rate_estimate = pkt_loss_total_estimate / j if j > 0 else -1
+
+        # EWMA metrics. Update every alpha at once.
+        new = dict.fromkeys(EWMA_METRICS, -1)
+        new["interarrival time us"] = interarr_time_us
+        new["throughput p/s"] = utils.safe_div(
+            1, utils.safe_div(interarr_time_us, 1e6))
+        new["RTT estimate us"] = rtt_estimate_us
+        new["RTT estimate ratio"] = rtt_estimate_ratio
+        new["loss rate estimate"] = pkt_loss_cur_estimate / (
+            pkt_loss_cur_estimate + 1)
+        new["mathis model throughput p/s"] = (
+            -1 if loss_rate_estimate <= 0 else
+            utils.safe_div(
+                parse_dumbbell.MATHIS_C,
+                utils.safe_div(
+                    utils.safe_mul(
+                        min_rtt_us, utils.safe_sqrt(loss_rate_estimate)),
+                    1e6)))
+        new = np.array([new[metric] for metric in EWMA_METRICS])[:, np.newaxis]
+        prev = self.ewmas
+        ewmas = np.where(prev == -1, new, ALPHAS * new + (1 - ALPHAS) * prev)
+        tput = ewmas[EWMA_TPUT_ROW]
+        tput_mathis = ewmas[EWMA_MATHIS_ROW]
+        ewmas[EWMA_LABEL_ROW] = np.where(
+            (tput == -1) | (tput_mathis == -1), -1, tput > tput_mathis)
+        self.ewmas = ewmas
+
+        # Windowed metrics, with one row per window and one column per metric.
+        wins = np.full((len(parse_dumbbell.WINDOWS), len(WIN_METRICS)), -1.)
+        rtt_estimate_us = ewmas[RTT_ESTIMATE_ROW, ALPHA_1_COL].item()
+        rtt_ratio = ewmas[RTT_RATIO_ROW, ALPHA_1_COL].item()
+        self.pkts.append((arrival_us, rtt_estimate_us, rtt_ratio))
+        pkts = self.pkts
+        pkts_base = self.pkts_base
+        for win_idx, (win, state) in enumerate(
+                zip(parse_dumbbell.WINDOWS, self.win_state)):
+            if rtt_estimate_us != -1:
+                state["rtt_estimate_sum"] += rtt_estimate_us
+                state["rtt_ratio_sum"] += rtt_ratio
+                state["rtt_count"] += 1
+            # If we have not been able to estimate the min RTT yet, then we
+            # cannot compute any of the windowed metrics.
+            if min_rtt_us == -1:
+                continue
+            win_size_us = win * min_rtt_us
+
+            # Move the start of the window forward, removing packets from the
+            # running sums.
+            win_start_idx = state["window_start_idx"]
+            while arrival_us - pkts[win_start_idx - pkts_base][0] > win_size_us:
+                _, old_estimate_us, old_ratio = pkts[win_start_idx - pkts_base]
+                if old_estimate_us != -1:
+                    state["rtt_estimate_sum"] -= old_estimate_us
+                    state["rtt_ratio_sum"] -= old_ratio
+                    state["rtt_count"] -= 1
+                win_start_idx += 1
+            state["window_start_idx"] = win_start_idx
+            if state["rtt_count"] == 0:
+                # Avoid accumulating rounding errors.
+                state["rtt_estimate_sum"] = 0.
+                state["rtt_ratio_sum"] = 0.
+
+            new = dict.fromkeys(WIN_METRICS, -1)
+            avg_interarr_time_us = (
+                (arrival_us - pkts[win_start_idx - pkts_base][0]) /
+                (j - win_start_idx + 1))
+            new["average interarrival time us"] = avg_interarr_time_us
+            new["average throughput p/s"] = utils.safe_div(
+                1, utils.safe_div(avg_interarr_time_us, 1e6))
+            if state["rtt_count"] > 0:
+                new["average RTT estimate us"] = (
+                    state["rtt_estimate_sum"] / state["rtt_count"])
+                new["average RTT estimate ratio"] = (
+                    state["rtt_ratio_sum"] / state["rtt_count"])
+            new["loss event rate"] = self.__loss_event_rate(
+                state, new["average RTT estimate us"], pkt_loss_cur_estimate,
+                arrival_us, recv_time_prev)
+            new["1/sqrt loss event rate"] = utils.safe_div(
+                1, utils.safe_sqrt(new["loss event rate"]))
+            state["loss_queue_estimate"], new["loss rate estimate"] = (
+                parse_dumbbell.loss_rate(
+                    state["loss_queue_estimate"], win_start_idx,
+                    pkt_loss_cur_estimate, arrival_us, recv_time_prev,
+                    win_size_us, j))
+            new["mathis model throughput p/s"] = utils.safe_div(
+                parse_dumbbell.MATHIS_C,
+                utils.safe_div(
+                    utils.safe_mul(
+                        min_rtt_us, utils.safe_sqrt(loss_rate_estimate)),
+                    1e6))
+            new["mathis model label"] = utils.safe_mathis_label(
+                new["average throughput p/s"],
+                new["mathis model throughput p/s"])
+            wins[win_idx] = [new[metric] for metric in WIN_METRICS]
+
+        # Forget packets that have left every window. Do so only once at least
+        # half of the stored packets can be forgotten, so that the cost of
+        # shifting the remaining packets is amortized.
+        drop = min(state["window_start_idx"]
+                   for state in self.win_state) - pkts_base
+        if drop > len(pkts) // 2:
+            del pkts[:drop]
+            self.pkts_base += drop
+
+        self.num_pkts += 1
+        self.arr_prev_us = arrival_us
+        # Like parse_pcap(), store the min RTT as an integer.
+        self.min_rtt_us = int(min_rtt_us)
+        return np.concatenate((
+            [int(seq), int(arrival_us), self.min_rtt_us], ewmas.ravel(),
+            wins.T.ravel()))
+
+    def __loss_event_rate(self, state, rtt_estimate_us, pkt_loss_cur_estimate,
+                          recv_time_cur, recv_time_prev):
+        """
+        Updates a window's loss event state and returns its loss event rate.
+        See parse_pcap().
+        """
+        if rtt_estimate_us == -1:
+            # The RTT estimate is -1 (unknown), so we cannot compute the loss
+            # event rate.
+            return -1
+        j = self.num_pkts
+        pkt_loss_total_estimate = self.pkt_loss_total_estimate
+        cur_start_idx = state["current_loss_event_start_idx"]
+        cur_start_time = state["current_loss_event_start_time"]
+        if pkt_loss_cur_estimate > 0:
+            # There was a loss since the last packet.
+            #
+            # The index of the first packet in the current loss event.
+            new_start_idx = (
+                j + pkt_loss_total_estimate - pkt_loss_cur_estimate)
+            if cur_start_idx == 0:
+                # This is the first loss event.
+                cur_start_idx = 1
+                cur_start_time = 0
+                new = 1 / j
+            else:
+                # This is not the first loss event. See if any of the
+                # newly-lost packets start a new loss event.
+                loss_interval = ((recv_time_cur - recv_time_prev) /
+                                 (pkt_loss_cur_estimate + 1))
+                for k in range(pkt_loss_cur_estimate):
+                    loss_time = recv_time_prev + (k + 1) * loss_interval
+                    if loss_time - cur_start_time >= rtt_estimate_us:
+                        # The deque discards the oldest interval, if
+                        # necessary.
+                        state["loss_event_intervals"].appendleft(
+                            new_start_idx - cur_start_idx)
+                        cur_start_idx = new_start_idx
+                        cur_start_time = loss_time
+                    new_start_idx += 1
+                new = parse_dumbbell.compute_weighted_average(
+                    j + pkt_loss_total_estimate - cur_start_idx,
+                    state["loss_event_intervals"],
+                    state["loss_interval_weights"])
+        elif pkt_loss_total_estimate > 0:
+            # There have been no losses since the last packet, but the total
+            # loss is nonzero. Increase the size of the current loss event.
+            new = parse_dumbbell.compute_weighted_average(
+                j + pkt_loss_total_estimate - cur_start_idx,
+                state["loss_event_intervals"], state["loss_interval_weights"])
+        else:
+            # There have never been any losses, so the loss event rate is 0.
+            new = 0
+        state["current_loss_event_start_idx"] = cur_start_idx
+        state["current_loss_event_start_time"] = cur_start_time
+        return new
+
+
+def replay(data_pkts, ack_pkts, payload_B, state=None):
+    """
+    Computes the features of every data packet of a flow, given the flow's
+    data packets and ACKs as received and sent by the receiver (see
+    utils.parse_packets()). Returns a 2D float array with one row per data
+    packet, in the order of NAMES. If state is not None, then it is the
+    FlowFeatureState to use, which allows the caller to inspect it afterwards.
+    """
+    if state is None:
+        state = FlowFeatureState(payload_B)
+    fets = np.empty((len(data_pkts), len(NAMES)), dtype=float)
+    ack_idx = 0
+    for pkt_idx, (seq, _, arrival_us, (tsval, tsecr)) in enumerate(data_pkts):
+        # Process the ACKs that were sent before this packet arrived.
+        while ack_idx < len(ack_pkts) and ack_pkts[ack_idx][2] <= arrival_us:
+            state.ack(ack_pkts[ack_idx][3][0], ack_pkts[ack_idx][2])
+            ack_idx += 1
+        fets[pkt_idx] = state.update(seq, arrival_us, tsval, tsecr)
+    return fets
+
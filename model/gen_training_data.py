@@ -10,6 +10,7 @@ import time
 
 import cl_args
 import defaults
+import executors
 import sim
 
 
@@ -65,6 +66,18 @@ def main():
     psr.add_argument(
         "--log-dst", default=EMAIL_DST,
         help="The email address to which updates will be sent.", type=str)
+    psr.add_argument(
+        "--capture-profile", choices=sim.CAPTURE_PROFILES, default="full",
+        help=("How to store packet traces. See sim.CAPTURE_PROFILES. "
+              "\"compact\" reduces only the size of the stored traces, not "
+              "the simulations' write I/O."),
+        type=str)
+    psr.add_argument(
+        "--queue-dir",
+        help=("Distribute simulations through this work queue directory, "
+              "which must be shared with workers started using executors.py. "
+              "The output directory must be shared as well."),
+        type=str)
     psr, psr_verify = cl_args.add_out(psr)
     args = psr_verify(psr.parse_args())
     # The ID of the experiment.
@@ -100,11 +113,14 @@ def main():
              "enable_mitigation": "false",
              "duration_s": DUR_s,
              "pcap": "true" if PCAP else "false",
+             "capture_profile": args.capture_profile,
              "out_dir": sim_dir}
             for bw_Mbps, dly_us, que_p, flws in itertools.product(
                 BWS_Mbps, DELAYS_us, QUEUE_p, OTHER_FLOWS)]
     sim.sim(eid, cnfs, out_dir, log_par=LOGGER, log_dst=args.log_dst,
-            dry_run=DRY_RUN, sync=defaults.SYNC)
+            dry_run=DRY_RUN, sync=defaults.SYNC,
+            executor=(None if args.queue_dir is None
+                      else executors.FsQueueExecutor(args.queue_dir)))
 
     log.info("Results in: %s", out_dir)
     log.critical("Finished.")
@@ -0,0 +1,88 @@
+"""
+Classifies packets using a linear model exported by export_linear.py. Depends
+only on NumPy, so that loading a model does not import sklearn or Torch.
+
+Scaling is folded into the model's weights and biases, so each batch requires
+one pass to impute unknown values and one matrix product.
+"""
+
+import numpy as np
+
+
+# The value that denotes an unknown feature.
+UNKNOWN = -1
+
+
+class LinearScorer:
+    """ A linear classifier that operates on unscaled features. """
+
+    def __init__(self, fets, coef, intercept, imp, classes):
+        """
+        fets: The names of the input features, in order.
+        coef: A 2D float array with one row of weights for each decision
+            function. Binary models have one decision function, and multiclass
+            models have one per class.
+        intercept: The bias of each decision function.
+        imp: The imputation value of each feature, or NaN for features whose
+            unknown values are left unchanged.
+        classes: The class labels.
+        """
+        self.fets = [str(fet) for fet in fets]
+        num_fets = len(self.fets)
+        coef = np.asarray(coef, dtype=float)
+        assert coef.ndim == 2 and coef.shape[1] == num_fets, \
+            (f"Expected weights of shape (N, {num_fets}), but found: "
+             f"{coef.shape}")
+        self.classes = np.asarray(classes)
+        assert (coef.shape[0] == 1 and self.classes.shape[0] == 2) or \
+            coef.shape[0] == self.classes.shape[0], \
+            (f"{coef.shape[0]} decision functions do not match "
+             f"{self.classes.shape[0]} classes.")
+        # Transposed and contiguous, so that scoring a batch is a single
+        # matrix product.
+        self.coef = np.ascontiguousarray(coef.T)
+        self.intercept = np.asarray(intercept, dtype=float)
+        self.imp = np.asarray(imp, dtype=float)
+        assert self.imp.shape == (num_fets,), \
+            (f"Expected {num_fets} imputation values, but found: "
+             f"{self.imp.shape}")
+        self.imp_valid = ~np.isnan(self.imp)
+
+    def decision_function(self, fets):
+        """
+        Returns the scores of the 2D float array fets, which contains one row
+        of unscaled input features for each packet. Unknown values are imputed
+        in place.
+        """
+        np.copyto(fets, self.imp, where=(fets == UNKNOWN) & self.imp_valid)
+        return fets @ self.coef + self.intercept
+
+    def predict(self, fets):
+        """ Returns the class of each row of fets (see decision_function()). """
+        scores = self.decision_function(fets)
+        if scores.shape[1] == 1:
+            return self.classes[(scores[:, 0] > 0).astype(int)]
+        return self.classes[np.argmax(scores, axis=1)]
+
+    def classify(self, flws, fets):
+        """
+        Classifies a batch of packets. See
+        service.SklearnClassifier.classify().
+        """
+        return self.predict(fets)
+
+
+def save(flp, scr):
+    """ Saves a LinearScorer. """
+    print(f"Saving linear model: {flp}")
+    np.savez(
+        flp, fets=np.array(scr.fets, dtype=str), coef=scr.coef.T,
+        intercept=scr.intercept, imp=scr.imp, classes=scr.classes)
+
+
+def load(flp):
+    """ Loads a LinearScorer saved by save(). """
+    with np.load(flp) as dat:
+        return LinearScorer(
+            dat["fets"].tolist(), dat["coef"], dat["intercept"], dat["imp"],
+            dat["classes"])
@@ -1,12 +1,12 @@
 """ Models. """
 
 import copy
-import functools
 import math
 import os
 from os import path
 import random
 from statistics import mean
+from typing import Tuple
 
 from matplotlib import pyplot
 import numpy as np
@@ -16,7 +16,52 @@ from sklearn import linear_model
 from sklearn import svm
 import torch
 
+import utils
+
 SMOOTHING_THRESHOLD = 0.4
+# Thresholds on a flow's relative difference from its fair share of the queue,
+# (fair - actual) / fair, that separate the fairness classes.
+# Between fair and unfair.
+TSH_FAIR = 0.1
+# Between unfair and very unfair.
+TSH_UNFAIR = 0.4
+# The class thresholds for each supported number of classes, of the form:
+#     (thresholds at or below 0, thresholds above 0)
+# A difference that equals a threshold at or below 0 falls in the class above
+# it, and a difference that equals a threshold above 0 falls in the class below
+# it. Class 0 is the least share of the queue.
+CLASS_TSHS = {
+    2: ([0.], []),
+    3: ([-TSH_FAIR], [TSH_FAIR]),
+    5: ([-TSH_UNFAIR, -TSH_FAIR], [TSH_FAIR, TSH_UNFAIR])
+}
+
+
+def percent_to_class(prc, fair, num_clss):
+    """
+    Converts queue occupancy percents to fairness classes using the thresholds
+    in CLASS_TSHS. prc and fair are arrays (or scalars) of the actual and fair
+    queue occupancies.
+    """
+    tshs_neg, tshs_pos = CLASS_TSHS[num_clss]
+    dif = (fair - prc) / fair
+    return num_clss - 1 - (
+        np.digitize(dif, tshs_neg) + np.digitize(dif, tshs_pos, right=True))
+
+
+def convert_to_class(sim, dat_out, num_clss):
+    """
+    Converts a simulation's output features, which consist of a single queue
+    occupancy column, to fairness classes. Returns a structured array with a
+    single column named "class".
+    """
+    # Verify that the output features consist of exactly one column.
+    assert len(dat_out.dtype.names) == 1, "Should be only one column."
+    clss_str = np.empty((dat_out.shape[0],), dtype=[("class", "int")])
+    clss_str["class"] = percent_to_class(
+        dat_out[dat_out.dtype.names[0]],
+        1. / (sim.unfair_flws + sim.fair_flws), num_clss)
+    return clss_str
 
 
 class PytorchModelWrapper:
@@ -74,6 +119,17 @@ class PytorchModelWrapper:
         """ Performs an arbitrary transformation on the data. """
         return dat_in, dat_out, list(range(len(dat_in.dtype.names)))
 
+    def num_modified_fets(self):
+        """ Returns the number of input features after modify_data(). """
+        return len(self.in_spc)
+
+    def num_modified_rows(self, sim, num_pkts):
+        """
+        Returns the number of rows that modify_data() produces for simulation
+        sim, which contains num_pkts packets, when sequential is False.
+        """
+        return num_pkts
+
     def check_output(self, out, target):
         """
         Returns the number of examples from out that were classified correctly,
@@ -129,86 +185,74 @@ class BinaryModelWrapper(PytorchModelWrapper):
             assert "arrival time us" in self.in_spc, \
                 ("When bucketizing packets, \"arrival time us\" must be a "
                  "feature.")
-        # Determine layer dimensions. If we are bucketizing packets
-        # based on arrival time, then there will be one input feature
-        # for every bucket (self.win) plus one input feature for every
-        # entry in self.in_spc *except* for "arrival time us". If we are
-        # not bucketizing packets, then there will be one input
-        # feature for each entry in self.in_spc for each packet
-        # (self.win).
-        self.num_ins = (
+
+    @staticmethod
+    def convert_to_class(sim, dat_out):
+        # Compare each queue occupancy percent with the fair percent.
+        return convert_to_class(sim, dat_out, num_clss=2)
+
+    def num_modified_fets(self):
+        # Computed from the current self.in_spc, which callers may override
+        # after construction (e.g., train.py's "--features"). If we are
+        # bucketizing packets based on arrival time, then there will be one
+        # input feature for every bucket (self.win) plus one input feature for
+        # every entry in self.in_spc *except* for "arrival time us". If we are
+        # not bucketizing packets, then there will be one input feature for
+        # each entry in self.in_spc for each packet (self.win).
+        return (
             self.win + len(self.in_spc) - 1 if self.rtt_buckets else (
                 len(self.in_spc) * self.win if self.windows else
                 len(self.in_spc)))
 
-    @staticmethod
-    def convert_to_class(sim, dat_out):
-        # Verify that the output features consist of exactly one column.
-        assert len(dat_out.dtype.names) == 1, "Should be only one column."
-        # Map a conversion function across all entries. Note that
-        # here an entry is an entire row, since each row is a
-        # single tuple value.
-        clss = np.vectorize(
-            functools.partial(
-                # Compare each queue occupancy percent with the fair
-                # percent. prc[0] assumes a single column.
-                lambda prc, fair: prc[0] > fair,
-                fair=1. / (sim.unfair_flws + sim.fair_flws)),
-            # Convert to integers.
-            otypes=[int])(dat_out)
-        clss_str = np.empty((clss.shape[0],), dtype=[("class", "int")])
-        clss_str["class"] = clss
-        return clss_str
+    def num_modified_rows(self, sim, num_pkts):
+        if self.rtt_buckets:
+            return 10 * math.floor(sim.dur_s * 1e6 / self.__bucket_dur_us(sim))
+        if self.windows:
+            return math.ceil(num_pkts / self.win)
+        return num_pkts
 
     @staticmethod
-    def __bucketize(dat_in, dat_in_start_idx, dat_in_end_idx, dat_in_new,
-                    dat_in_new_idx, dur_us, num_buckets):
+    def __bucket_dur_us(sim):
+        """ Returns the duration of the window that is bucketized. """
+        # 100x the min RTT (as determined by the simulation parameters).
+        return 100 * 2 * (sim.edge_delays[0] * 2 + sim.btl_delay_us)
+
+    def __bucket_end_idxs(self, sim, arr_times, sequential):
         """
-        Uses dat_in["arrival time us"] to divide the arriving packets from
-        the range [dat_in_start_idx, dat_in_end_idx] into num_buckets
-        intervals. Each interval has duration dur_us / num_buckets.
-        Stores the resulting histogram in dat_in_new, at the row
-        indicated by dat_in_new_idx. Also updates dat_in_new with the
-        values of the other (i.e., non-bucket) features. Returns
-        nothing.
+        Selects the windows to bucketize. Returns the index of the last packet
+        in each window and the duration of the windows (us).
         """
-        fets = dat_in.dtype.names
-        assert "arrival time us" in fets, f"Missing \"arrival time us\": {fets}"
-        arr_times = dat_in[
-            "arrival time us"][dat_in_start_idx:dat_in_end_idx + 1]
+        dur_us = self.__bucket_dur_us(sim)
+        # Determine the safe starting index: the first packet (other than the
+        # first packet) that arrived at least dur_us after the first packet. Do
+        # not pick indices between 0 and start_idx to make sure that all
+        # windows ending on the chosen index fit within the simulation.
         num_pkts = arr_times.shape[0]
-        assert num_pkts > 0, "Need more than 0 packets!"
-
-        # We are turning the arrival times into buckets, but there are
-        # other features that must be preserved.
-        other_fets = [col for col in dat_in.dtype.descr
-                      if col[0] != "arrival time us" and col[0] != ""]
-        # The duration of each interval.
-        interval_us = dur_us / num_buckets
-        # The arrival time of the first packet, and therefore the
-        # start of the first interval.
-        start_time_us = arr_times[0]
-        # Convert the arrival times to interval indices and loop over them.
-        for interval_idx in np.floor(
-                (arr_times - start_time_us) / interval_us).astype(int):
-            if interval_idx == num_buckets:
-                print(f"Warning: Interval is {interval_idx} when it should be "
-                      f"in the range [0, {num_buckets}]. Fixing interval...")
-                interval_idx -= 1
-            assert 0 <= interval_idx < num_buckets, \
-                (f"Invalid idx ({interval_idx}) for the number of buckets "
-                 f"({num_buckets})!")
-            dat_in_new[dat_in_new_idx][interval_idx] += 1
-        # Set the values of the other features based on the last packet in this
-        # window.
-        for fet, _ in other_fets:
-            dat_in_new[fet][dat_in_new_idx] = dat_in[fet][dat_in_end_idx]
+        start_idx = (
+            max(1, np.searchsorted(
+                arr_times, arr_times[0] + dur_us, side="left"))
+            if num_pkts else 0)
+        assert 0 <= start_idx < num_pkts, f"Invalid start index: {start_idx}"
 
-        # Check that the bucket features reflect all of the packets.
-        bucketed_pkts = sum(dat_in_new[dat_in_new_idx].tolist()[:num_buckets])
-        assert bucketed_pkts == num_pkts, \
-            (f"Error building counts! Bucketed {bucketed_pkts} of {num_pkts} "
-             "packets!")
+        if sequential:
+            # Select all valid windows, in order.
+            pkt_idxs = np.arange(start_idx, num_pkts)
+        else:
+            # The number of windows is the number of times the window
+            # durations fits within the simulation.
+            num_wins = 10 * math.floor(sim.dur_s * 1e6 / dur_us)
+            # Select random intervals from this simulation to create the
+            # new input data. pkt_idx is the index of the last packet in
+            # each window.
+            pkt_idxs = np.array(
+                random.choices(range(start_idx, num_pkts), k=num_wins),
+                dtype=int)
+        # Verify that no window begins with the first packet, which would mean
+        # that the window might have been truncated.
+        assert (utils.win_start_idxs(arr_times, pkt_idxs, dur_us) > 0).all(), \
+            ("Problem finding beginning of window! Are there insufficient "
+             "packets?")
+        return pkt_idxs, dur_us
 
     def __create_buckets(self, sim, dat_in, dat_out, dat_out_raw,
                          dat_out_oracle, sequential):
@@ -223,70 +267,28 @@ class BinaryModelWrapper(PytorchModelWrapper):
         fets = dat_in.dtype.names
         assert "arrival time us" in fets, f"Missing \"arrival time us\": {fets}"
         arr_times = dat_in["arrival time us"]
-
-        # 100x the min RTT (as determined by the simulation parameters).
-        dur_us = 100 * 2 * (sim.edge_delays[0] * 2 + sim.btl_delay_us)
-        # Determine the safe starting index. Do not pick indices
-        # between 0 and start_idx to make sure that all windows ending
-        # on the chosen index fit within the simulation.
-        first_arr_time = None
-        start_idx = None
-        for idx, arr_time in enumerate(arr_times):
-            if first_arr_time is None:
-                first_arr_time = arr_time
-                continue
-            if arr_time - first_arr_time >= dur_us:
-                start_idx = idx
-                break
-        num_pkts = dat_in.shape[0]
-        assert start_idx is not None and 0 <= start_idx < num_pkts, \
-            f"Invalid start index: {start_idx}"
-
-        if sequential:
-            # Select all valid windows, in order.
-            num_wins = num_pkts - start_idx
-            pkt_idxs = list(range(start_idx, num_pkts))
-        else:
-            # The number of windows is the number of times the window
-            # durations fits within the simulation.
-            num_wins = 10 * math.floor(sim.dur_s * 1e6 / dur_us)
-            # Select random intervals from this simulation to create the
-            # new input data. win_idx is the index into
-            # dat_in_new. pkt_idx is the index of the last packet in this
-            # window.
-            pkt_idxs = random.choices(range(start_idx, num_pkts), k=num_wins)
+        pkt_idxs, dur_us = self.__bucket_end_idxs(sim, arr_times, sequential)
+        num_wins = pkt_idxs.shape[0]
         # Records the number of packets that arrived during each
         # interval. This is a structured numpy array where each column
         # is named based on its bucket index. We add extra columns for
         # the non--arrival time features.
+        names, scl_grps = utils.bucket_fets(fets, self.win)
+        other_fets = [col for col in dat_in.dtype.descr
+                      if col[0] != "arrival time us" and col[0] != ""]
         dat_in_new = np.zeros(
             (num_wins,),
-            dtype=([(f"bucket_{bkt}", "float") for bkt in range(self.win)] +
-                   [col for col in dat_in.dtype.descr
-                    if col[0] != "arrival time us" and col[0] != ""]))
-
-        for win_idx, pkt_idx in enumerate(pkt_idxs):
-            # Find the first packet in this window (whose index will
-            # be win_start_idx).
-            cur_arr_time = arr_times[pkt_idx]
-            win_start_idx = None
-            # Move backwards from the last packet in the window until
-            # we find a packet whose arrival time is more that dur_us
-            # in the past.
-            for arr_time_idx in range(pkt_idx, -1, -1):
-                if cur_arr_time - arr_times[arr_time_idx] > dur_us:
-                    # This packet is the first packet that is too far
-                    # in the past, so we will start the window on the
-                    # next packet.
-                    win_start_idx = arr_time_idx + 1
-                    break
-            assert (
-                win_start_idx is not None and 0 <= win_start_idx <= pkt_idx), \
-                ("Problem finding beginning of window! Are there insufficient "
-                 "packets?")
-            self.__bucketize(
-                dat_in, win_start_idx, pkt_idx, dat_in_new, win_idx, dur_us,
-                self.win)
+            dtype=[(name, "float") for name in names[:self.win]] + other_fets)
+
+        cnts = utils.bucketize(
+            arr_times, utils.win_start_idxs(arr_times, pkt_idxs, dur_us),
+            pkt_idxs, dur_us, self.win)
+        for bkt, name in enumerate(names[:self.win]):
+            dat_in_new[name] = cnts[:, bkt]
+        # Set the values of the other features based on the last packet in
+        # each window.
+        for fet, _ in other_fets:
+            dat_in_new[fet] = dat_in[fet][pkt_idxs]
 
         # Verify that we selected at least as many windows as we intended to.
         num_selected_wins = len(dat_in_new)
@@ -301,12 +303,26 @@ class BinaryModelWrapper(PytorchModelWrapper):
             np.take(dat_out, pkt_idxs),
             np.take(dat_out_raw, pkt_idxs),
             np.take(dat_out_oracle, pkt_idxs),
-            # The buckets all share a scaling group. Each other
-            # feature is part of its own group.
-            [0] * self.win +
-            list(range(1, len(dat_in_new.dtype.names) - self.win + 1)))
+            scl_grps)
 
-    def __create_windows(self, dat_in, dat_out, sequential):
+    def __window_end_idxs(self, num_pkts, sequential):
+        """
+        Selects windows of self.win packets. Returns the index of the last
+        packet in each window.
+        """
+        if sequential:
+            # Select all valid windows, in order.
+            return np.arange(self.win, num_pkts)
+        # Select random intervals from this simulation to create the new input
+        # data. Do not pick indices between 0 and self.win to make sure that
+        # all windows ending on the chosen index fit within the simulation.
+        return np.array(
+            random.choices(
+                range(self.win, num_pkts), k=math.ceil(num_pkts / self.win)),
+            dtype=int)
+
+    def __create_windows(self, dat_in, dat_out, dat_out_raw, dat_out_oracle,
+                         sequential):
         """
         Divides dat_in into windows of self.win packets. Flattens the
         features of the packets in a window. The output value for each
@@ -314,33 +330,22 @@ class BinaryModelWrapper(PytorchModelWrapper):
         """
         print("Creating windows...")
         num_pkts = dat_in.shape[0]
-        num_wins = math.ceil(num_pkts / self.win)
-        fets = [(name, typ) for name, typ in dat_in.dtype.descr if name != ""]
-        # Select random intervals from this simulation to create the
-        # new input data. Do not pick indices between 0 and self.win
-        # to make sure that all windows ending on the chosen index fit
-        # within the simulation.
-        pkt_idxs = random.choices(range(self.win, num_pkts), k=num_wins)
+        pkt_idxs = self.__window_end_idxs(num_pkts, sequential)
+        num_wins = pkt_idxs.shape[0]
         # The new data format consists of self.win copies of the
         # existing input features. All copies of a particular feature
         # share the same scaling group.
-        scl_grps, dtype = zip(
-            *[(scl_grp, (f"{name}_{idx}", typ))
-              for idx in range(self.win)
-              for scl_grp, (name, typ) in enumerate(fets)])
-        scl_grps = np.array(scl_grps)
-        dat_in_new = np.zeros((num_wins,), dtype=list(dtype))
-
-        for win_idx, end_idx in enumerate(pkt_idxs):
-            # This could be done on a single line with a range select
-            # and a generator, but this version is preferable because
-            # it removes intermediate data copies and guarantees that
-            # the resulting row is properly ordered.
-            for fet_idx, pkt_idx in enumerate(
-                    range(end_idx - self.win + 1, end_idx + 1)):
-                for name, _ in fets:
-                    dat_in_new[f"{name}_{fet_idx}"][win_idx] = (
-                        dat_in[pkt_idx][name])
+        names, scl_grps = utils.window_fets(dat_in.dtype.names, self.win)
+        # Select the windows from a view of all windows, then flatten each
+        # window's packets. The packets in each window are in order, and
+        # each packet's features are in order.
+        dat_in_2d = utils.unstructured_view(dat_in)
+        dat_in_new = utils.as_structured(
+            utils.windows_view(
+                utils.clean(dat_in) if dat_in_2d is None else dat_in_2d,
+                self.win)[pkt_idxs - self.win + 1].reshape(
+                    (num_wins, len(names))),
+            names)
 
         # Verify that we selected at least as many windows as we intended to.
         num_selected_wins = len(dat_in_new)
@@ -350,7 +355,37 @@ class BinaryModelWrapper(PytorchModelWrapper):
         # As an output feature, select only the final ground truth
         # value. I.e., the final ground truth value for this window
         # becomes the ground truth for the entire window.
-        return dat_in_new, np.take(dat_out, pkt_idxs), scl_grps
+        return (
+            dat_in_new,
+            np.take(dat_out, pkt_idxs),
+            np.take(dat_out_raw, pkt_idxs),
+            np.take(dat_out_oracle, pkt_idxs),
+            scl_grps)
+
+    def select_windows(self, sim, dat_in, sequential=False):
+        """
+        Selects the same windows as modify_data(), but does not create them.
+        Returns the index of the last packet in each window and the duration of
+        the windows (us), or None if the windows have a fixed number of packets
+        instead. Used to create windows lazily (see utils.LazyWindowDataset).
+        """
+        assert self.rtt_buckets or self.windows, \
+            f"Model \"{self.name}\" does not divide packets into windows."
+        if self.rtt_buckets:
+            return self.__bucket_end_idxs(
+                sim, dat_in["arrival time us"], sequential)
+        return self.__window_end_idxs(dat_in.shape[0], sequential), None
+
+    def get_scl_grps(self, fets):
+        """
+        Returns the scaling group of each of the input features fets, for
+        models that use one packet per example (i.e., that use neither RTT
+        buckets nor windows).
+        """
+        assert not self.rtt_buckets and not self.windows, \
+            f"Model \"{self.name}\" does not use one packet per example."
+        # Each feature is part of its own scaling group.
+        return list(range(len(fets)))
 
     def modify_data(self, sim, dat_in, dat_out, dat_out_raw, dat_out_oracle,
                     sequential):
@@ -362,11 +397,11 @@ class BinaryModelWrapper(PytorchModelWrapper):
             self.__create_buckets(
                 sim, dat_in, dat_out, dat_out_raw, dat_out_oracle, sequential)
             if self.rtt_buckets else (
-                self.__create_windows(dat_in, dat_out, sequential)
+                self.__create_windows(
+                    dat_in, dat_out, dat_out_raw, dat_out_oracle, sequential)
                 if self.windows else (
                     dat_in, dat_out, dat_out_raw, dat_out_oracle,
-                    # Each feature is part of its own scaling group.
-                    list(range(len(dat_in.dtype.names))))))
+                    self.get_scl_grps(dat_in.dtype.names))))
         return dat_in, dat_out, dat_out_raw, dat_out_oracle, scl_grps
 
 
@@ -384,7 +419,7 @@ class BinaryDnnWrapper(BinaryModelWrapper):
     params = ["lr", "momentum"]
 
     def new(self):
-        self.net = BinaryDnn(self.num_ins, self.num_clss)
+        self.net = BinaryDnn(self.num_modified_fets(), self.num_clss)
         return self.net
 
 
@@ -429,7 +464,7 @@ class SvmWrapper(BinaryModelWrapper):
     params = ["lr", "momentum"]
 
     def new(self):
-        self.net = Svm(self.num_ins)
+        self.net = Svm(self.num_modified_fets())
         return self.net
 
     def modify_data(self, sim, dat_in, dat_out, dat_out_raw, dat_out_oracle,
@@ -768,40 +803,7 @@ class SvmSklearnWrapper(SvmWrapper):
         assert SvmSklearnWrapper.num_clss == 3, \
             ("Only 2 or 3 classes are supported, not: "
              f"{SvmSklearnWrapper.num_clss}")
-        assert len(dat_out.dtype.names) == 1, "Should be only one column."
-
-        def percent_to_class(prc, fair):
-            """ Convert a queue occupancy percent to a fairness class. """
-            assert len(prc) == 1, "Should be only one column."
-            prc = prc[0]
-
-            # Threshold between fair and unfair.
-            tsh_fair = 0.1
-
-            dif = (fair - prc) / fair
-            if dif < -1 * tsh_fair:
-                # We are much higher than fair.
-                cls = 2
-            elif -1 * tsh_fair <= dif <= tsh_fair:
-                # We are fair.
-                cls = 1
-            elif tsh_fair < dif:
-                # We are much lower than fair.
-                cls = 0
-            else:
-                assert False, "This should never happen."
-            return cls
-
-        # Map a conversion function across all entries. Note that here
-        # an entry is an entire row, since each row is a single tuple
-        # value.
-        clss = np.vectorize(
-            functools.partial(
-                percent_to_class, fair=1. / (sim.unfair_flws + sim.fair_flws)),
-            otypes=[int])(dat_out)
-        clss_str = np.empty((clss.shape[0],), dtype=[("class", "int")])
-        clss_str["class"] = clss
-        return clss_str
+        return convert_to_class(sim, dat_out, SvmSklearnWrapper.num_clss)
 
 
     def __evaluate(self, preds, labels, raw, fair, sort_by_unfairness=False,
@@ -1159,6 +1161,8 @@ class LstmWrapper(PytorchModelWrapper):
         self.out_dim = out_dim
 
     def new(self):
+        # The input features may have been changed since __init__().
+        self.in_dim = len(self.in_spc)
         self.net = Lstm(self.in_dim, self.hid_dim, self.num_lyrs, self.out_dim)
         return self.net
 
@@ -1169,48 +1173,7 @@ class LstmWrapper(PytorchModelWrapper):
 
     @staticmethod
     def convert_to_class(sim, dat_out):
-        assert len(dat_out.dtype.names) == 1, "Should be only one column."
-
-        def percent_to_class(prc, fair):
-            """ Convert a queue occupancy percent to a fairness class. """
-            assert len(prc) == 1, "Should be only one column."
-            prc = prc[0]
-
-            # Threshold between fair and unfair.
-            tsh_fair = 0.1
-            # Threshold between unfair and very unfair.
-            tsh_unfair = 0.4
-
-            dif = (fair - prc) / fair
-            if dif < -1 * tsh_unfair:
-                # We are much higher than fair.
-                cls = 4
-            elif -1 * tsh_unfair <= dif < -1 * tsh_fair:
-                # We are not that much higher than fair.
-                cls = 3
-            elif -1 * tsh_fair <= dif <= tsh_fair:
-                # We are fair.
-                cls = 2
-            elif tsh_fair < dif <= tsh_unfair:
-                # We are not that much lower than fair.
-                cls = 1
-            elif tsh_unfair < dif:
-                # We are much lower than fair.
-                cls = 0
-            else:
-                assert False, "This should never happen."
-            return cls
-
-        # Map a conversion function across all entries. Note that here
-        # an entry is an entire row, since each row is a single tuple
-        # value.
-        clss = np.vectorize(
-            functools.partial(
-                percent_to_class, fair=1. / (sim.unfair_flws + sim.fair_flws)),
-            otypes=[int])(dat_out)
-        clss_str = np.empty((clss.shape[0],), dtype=[("class", "int")])
-        clss_str["class"] = clss
-        return clss_str
+        return convert_to_class(sim, dat_out, LstmWrapper.num_clss)
 
 
 class Lstm(torch.nn.Module):
@@ -1219,13 +1182,16 @@ class Lstm(torch.nn.Module):
     def __init__(self, in_dim, hid_dim, num_lyrs, out_dim):
         super(Lstm, self).__init__()
         self.hid_dim = hid_dim
-        self.lstm = torch.nn.LSTM(in_dim, self.hid_dim)
+        self.lstm = torch.nn.LSTM(in_dim, self.hid_dim, num_lyrs)
         self.fc = torch.nn.Linear(self.hid_dim, out_dim)
         self.sg = torch.nn.Sigmoid()
         print(f"Lstm - in_dim: {in_dim}, hid_dim: {self.hid_dim}, "
               f"num_lyrs: {num_lyrs}, out_dim: {out_dim}")
 
-    def forward(self, x, hidden):
+    def forward(self, x, hidden: Tuple[torch.Tensor, torch.Tensor]
+                ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        # Annotate the hidden state so that this module can be compiled to
+        # Torch Script, which assumes that unannotated arguments are tensors.
         # The LSTM itself, which also takes as input the previous hidden state.
         out, hidden = self.lstm(x, hidden)
         # Select the last piece as the LSTM output.
@@ -5,7 +5,6 @@ import argparse
 import collections
 import itertools
 import math
-import multiprocessing
 import os
 from os import path
 import random
@@ -15,6 +14,8 @@ import numpy as np
 
 import cl_args
 import defaults
+import executors
+import parse_dumbbell
 import utils
 
 
@@ -172,15 +173,12 @@ def parse_pcap(sim_dir, out_dir):
         sent_pkts = utils.parse_packets(
             path.join(sim_dir, f"{sim.name}-{unfair_idx + 2}-0.pcap"),
             sim.payload_B, direction="data")
-        recv_pcap_flp = path.join(
-            sim_dir,
-            (f"{sim.name}-{unfair_idx + 2 + sim.unfair_flws + sim.fair_flws}-0"
-             ".pcap"))
-        recv_pkts = utils.parse_packets(
-            recv_pcap_flp, sim.payload_B, direction="data")
-        # Ack packets for RTT calculation
-        ack_pkts = utils.parse_packets(
-            recv_pcap_flp, sim.payload_B, direction="ack")
+        recv_pcap_flp = utils.get_recv_pcap_flp(sim_dir, unfair_idx)
+        # Parse the data packets and the ack packets (for RTT calculation) in
+        # a single pass.
+        recv_all_pkts = utils.parse_packets_all(recv_pcap_flp, sim.payload_B)
+        recv_pkts = recv_all_pkts["data"]
+        ack_pkts = recv_all_pkts["ack"]
 
         # State that the windowed metrics need to track across packets.
         win_state = {win: {
@@ -839,15 +837,22 @@ def main():
     psr.add_argument(
         "--random-order", action="store_true",
         help="Parse the simulations in a random order.")
+    psr.add_argument(
+        "--queue-dir",
+        help=("Distribute parsing through this work queue directory, which "
+              "must be shared with workers started using executors.py."),
+        type=str)
     psr, psr_verify = cl_args.add_out(psr)
     args = psr_verify(psr.parse_args())
     exp_dir = args.exp_dir
     out_dir = args.out_dir
 
-    # Find all simulations.
+    # Find all simulations. Each simulation is a directory, so skip other
+    # entries (e.g., a run ledger).
     pcaps = [
         (path.join(exp_dir, sim), out_dir)
-        for sim in sorted(os.listdir(exp_dir))]
+        for sim in sorted(os.listdir(exp_dir))
+        if path.isdir(path.join(exp_dir, sim))]
     if args.random_order:
         # Set the random seed so that multiple instances of this
         # script see the same random order.
@@ -856,12 +861,14 @@ def main():
 
     print(f"Num files: {len(pcaps)}")
     tim_srt_s = time.time()
-    if defaults.SYNC:
-        for pcap in pcaps:
-            parse_pcap(*pcap)
+    if args.queue_dir is None:
+        executor = executors.LocalExecutor(defaults.SYNC)
     else:
-        with multiprocessing.Pool() as pol:
-            pol.starmap(parse_pcap, pcaps)
+        executor = executors.FsQueueExecutor(args.queue_dir)
+    # When this file is run as a script, parse_pcap() belongs to module
+    # "__main__", which workers cannot import. Use this module's importable
+    # name instead.
+    executor.starmap(parse_dumbbell.parse_pcap, pcaps)
     print(f"Done parsing - time: {time.time() - tim_srt_s:.2f} seconds")
 
 
@@ -5,6 +5,7 @@ creates unified training, validation, and test sets.
 """
 
 import argparse
+import json
 import math
 import os
 from os import path
@@ -14,13 +15,15 @@ import random
 import numpy as np
 
 import cl_args
+import scaling
 import utils
 
 
 class Split:
     """ Represents either the training, validation, or test split. """
 
-    def __init__(self, name, prc, flp, dtype, num_pkts_tot, shuffle):
+    def __init__(self, name, prc, out_dir, dtype, num_pkts_tot, shuffle,
+                 stats=None):
         self.name = name
         print(f"Initializing split \"{self.name}\"...")
         self.frac = prc / 100
@@ -37,20 +40,30 @@ class Split:
         # Features values that cannot be computed are replaced
         # with -1. When reading the splits later, we can detect
         # incomplete feature values by looking for -1s.
-        self.dat = np.memmap(flp, dtype, mode="w+", shape=(num_pkts,))
+        dat_flp, num_flws_flp = utils.get_split_flps(out_dir, name)
+        self.dat = np.memmap(dat_flp, dtype, mode="w+", shape=(num_pkts,))
+        # The total number of flows in each packet's simulation. Unused
+        # entries remain 0.
+        self.num_flws = np.memmap(
+            num_flws_flp, utils.SPLIT_NUM_FLWS_DTYPE, mode="w+",
+            shape=(num_pkts,))
 
         # The next available index in self.dat. Used if self.shuffle == False.
         self.idx = 0
         # List of all available indices in this split. This set is
         # reduced as the split is populated.
         self.dat_available_idxs = set(range(num_pkts))
+        # If not None, a scaling.OnlineStats that is updated with every packet
+        # that is added to this split.
+        self.stats = stats
 
 
-    def take(self, sim_dat, sim_available_idxs):
+    def take(self, sim_dat, sim_available_idxs, num_flws):
         """
         Takes this Split's specified fraction of data from sim_dat,
         choosing from sim_available_idxs. Removes the chosen indices from
-        sim_available_idxs and returns the modified version.
+        sim_available_idxs and returns the modified version. num_flws is the
+        total number of flows in sim_dat's simulation.
         """
         assert not self.finished, "Trying to call a method on a finished Split."
         num_sim_pkts = sim_dat.shape[0]
@@ -66,6 +79,9 @@ class Split:
         # Randomly select the packets to pull into this split.
         sim_new_idxs = random.sample(sim_available_idxs, num_new)
         sim_available_idxs -= set(sim_new_idxs)
+        sim_new = sim_dat[sim_new_idxs]
+        if self.stats is not None:
+            self.stats.update(utils.clean(sim_new))
 
         if self.shuffle:
             num_slots_remaining = len(self.dat_available_idxs)
@@ -74,7 +90,8 @@ class Split:
                  f"there are only {num_slots_remaining} packet slots "
                  "available!")
             dat_new_idxs = random.sample(self.dat_available_idxs, num_new)
-            self.dat[dat_new_idxs] = sim_dat[sim_new_idxs]
+            self.dat[dat_new_idxs] = sim_new
+            self.num_flws[dat_new_idxs] = num_flws
         else:
             start_idx = self.idx
             self.idx = self.idx + num_new
@@ -82,7 +99,8 @@ class Split:
                 (f"Index {self.idx} into \"{self.name}\" split does not fit "
                  f"within shape {self.dat.shape}")
             dat_new_idxs = range(start_idx, self.idx)
-            self.dat[start_idx:self.idx] = sim_dat[sim_new_idxs]
+            self.dat[start_idx:self.idx] = sim_new
+            self.num_flws[start_idx:self.idx] = num_flws
         self.dat_available_idxs -= set(dat_new_idxs)
         return sim_available_idxs
 
@@ -105,32 +123,46 @@ def survey(sim_flps, warmup_frac):
     print(f"Surveying {num_sims} simulations...")
     assert sim_flps, "Must provide at least one simulation."
 
-    # Extract the header from each simulation. Reshape to remove a
-    # middle dimension of size 1.
-    headers = np.array(
-        [utils.get_npz_headers(flp) for flp in sim_flps]).reshape((num_sims, 3))
+    # Extract the header from each simulation. Each simulation contains a
+    # single array.
+    headers = [utils.get_npz_headers(flp) for flp in sim_flps]
+    assert all(len(hdrs) == 1 for hdrs in headers), \
+        "Each simulation must contain exactly one array!"
+    headers = [hdrs[0] for hdrs in headers]
     # Count the total number of packets by looking at the header shapes.
     save_frac = 1 - warmup_frac
-    num_pkts = sum(math.ceil(shape[0] * save_frac) for shape in headers[:, 1])
+    num_pkts = sum(
+        math.ceil(shape[0] * save_frac) for _, shape, _ in headers)
     # Extract the dtype and verify that all dtypes are the same.
     dtype = headers[0][2]
-    assert (headers[1:][:, 2] == dtype).all(), \
+    assert all(hdr_dtype == dtype for _, _, hdr_dtype in headers[1:]), \
         "Not all simulations agree on dtype!"
     return num_pkts, dtype
 
 
-def merge(sim_flps, out_dir, num_pkts, dtype, split_prcs, warmup_frac):
+def merge(sim_flps, out_dir, num_pkts, dtype, split_prcs, warmup_frac,
+          standardize=False):
     """
     Merges the provided simulations into training, validation, and
     test splits as defined by the percents in split_prcs. Stores the
     resulting files in out_dir. The simulations contain a total of
-    num_pkts packets and have the provided dtype.
+    num_pkts packets and have the provided dtype, which is also stored in
+    out_dir (see utils.load_split()). Also stores the scaling
+    parameters of the training split in out_dir, with each feature in its own
+    scaling group (see train.scale_fets()). The scaling parameters are computed
+    while the training split is assembled, so the splits never need to fit in
+    memory. Likewise for the imputation values of the training split. The
+    underlying per-column statistics are stored too, along with standardize
+    (see utils.save_split_stats()), so that training can derive the scaling
+    parameters of any scaling groups.
     """
     print("Preparing split files...")
+    # Statistics of the training split. -1 means that a value is unknown.
+    stats = scaling.OnlineStats(len(dtype.names), unknown=-1)
     splits = {
         name: Split(
-            name, prc, path.join(out_dir, f"{name}.npy"), dtype, num_pkts,
-            shuffle=name == "train")
+            name, prc, out_dir, dtype, num_pkts,
+            shuffle=name == "train", stats=stats if name == "train" else None)
         for name, prc in split_prcs.items()}
     # Keep track of the number of packets that do not get selected for
     # any of the splits.
@@ -138,8 +170,8 @@ def merge(sim_flps, out_dir, num_pkts, dtype, split_prcs, warmup_frac):
     num_sims = len(sim_flps)
     for idx, sim_flp in enumerate(sim_flps):
         # Load the simulation.
-        dat = utils.load_sim(
-            sim_flp, msg=f"{idx + 1:{f'0{len(str(num_sims))}'}}/{num_sims}")[1]
+        sim, dat = utils.load_sim(
+            sim_flp, msg=f"{idx + 1:{f'0{len(str(num_sims))}'}}/{num_sims}")
         if dat is None:
             continue
         # Remove a percentage of packets from the beginning of the
@@ -150,7 +182,8 @@ def merge(sim_flps, out_dir, num_pkts, dtype, split_prcs, warmup_frac):
         all_idxs = set(range(dat.shape[0]))
         # For each split, take a fraction of the simulation packets.
         for split in splits.values():
-            all_idxs = split.take(dat, all_idxs)
+            all_idxs = split.take(
+                dat, all_idxs, sim.unfair_flws + sim.fair_flws)
         # Record how many packets are not being moved to one of the
         # merged files.
         pkts_forgotten += len(all_idxs)
@@ -160,6 +193,18 @@ def merge(sim_flps, out_dir, num_pkts, dtype, split_prcs, warmup_frac):
 
     for split in splits.values():
         split.finish()
+    utils.save_split_dtype(out_dir, dtype)
+
+    # Save the scaling parameters, one for each feature in dtype order.
+    scl_prms_flp = path.join(out_dir, "scale_params.json")
+    print(f"Saving scaling parameters: {scl_prms_flp}")
+    with open(scl_prms_flp, "w") as fil:
+        json.dump(
+            stats.params(range(len(dtype.names)), standardize).tolist(), fil)
+    # Save the imputation values alongside the scaling parameters.
+    utils.save_impute_prms(
+        utils.get_impute_prms_flp(scl_prms_flp), stats.impute_params())
+    utils.save_split_stats(out_dir, stats, standardize)
 
     # Delete the splits to force their data to be written to
     # disk. Note that this is not needed for correctness. Since the
@@ -191,8 +236,7 @@ def main():
     psr.add_argument(
         "--test-split", default=30, help="Test data fraction",
         required=False, type=float)
-    psr, psr_verify = cl_args.add_out(
-        *cl_args.add_warmup(*cl_args.add_num_sims(psr)))
+    psr, psr_verify = cl_args.add_common(*cl_args.add_num_sims(psr))
     args = psr_verify(psr.parse_args())
 
     split_prcs = {
@@ -221,7 +265,9 @@ def main():
         "\n    ".join(sorted(fets)))
 
     # Create the merged training, validation, and test files.
-    merge(sim_flps, args.out_dir, num_pkts, dtype, split_prcs, warmup_frac)
+    merge(
+        sim_flps, args.out_dir, num_pkts, dtype, split_prcs, warmup_frac,
+        args.standardize)
     print(f"Finished - time: {time.time() - tim_srt_s:.2f} seconds")
     return 0
 
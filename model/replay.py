@@ -0,0 +1,206 @@
+#! /usr/bin/env python3
+"""
+Replays the receiver packet traces of simulations as a stream of packet
+records, in order to load-test receiver-side inference (e.g., service.py)
+offline. Many flows are interleaved by multiplexing several simulations, and
+optionally several copies of each simulation, in timestamp order. Records are
+emitted in real time, at a multiple of real time, or as fast as possible.
+
+Records have the format that service.py expects:
+    (flow ID, direction, seq, timestamp us, TSval, TSecr)
+Each flow's ID is of the form "<simulation name>/<unfair flow index>", followed
+by "/<copy index>" if there are multiple copies of each simulation.
+"""
+
+import argparse
+import asyncio
+import heapq
+import time
+
+import utils
+
+
+# The number of records to emit before yielding to other tasks, when replaying
+# as fast as possible.
+CHUNK_RECS = 64
+# When pacing, how far ahead of schedule the replay may get before it sleeps
+# (s). Sleeping for shorter periods is inaccurate and expensive.
+PACE_SLACK_S = 1e-3
+# The offset between the timestamps of consecutive copies of a simulation (us).
+COPY_STAGGER_us = 1000
+# The default interval between statistics reports (s).
+REPORT_S = 1
+
+
+def load_flow(sim_dir, unfair_idx):
+    """
+    Returns the records of an unfair flow of a simulation, as seen at the
+    receiver, in timestamp order. ACKs precede data packets that have the same
+    timestamp.
+    """
+    sim = utils.Sim(sim_dir)
+    recv_pcap_flp = utils.get_recv_pcap_flp(sim_dir, unfair_idx)
+    flw = f"{sim.name}/{unfair_idx}"
+    return sorted(
+        ((flw, direction, seq, time_us, tsval, tsecr)
+         for direction, pkts in utils.parse_packets_all(
+             recv_pcap_flp, sim.payload_B).items()
+         for seq, _, time_us, (tsval, tsecr) in pkts),
+        key=lambda rec: (rec[3], rec[1] == "data"))
+
+
+def copy_flow(recs, copy_idx):
+    """
+    Returns an iterator over a copy of a flow's records, with a distinct flow
+    ID and staggered timestamps.
+    """
+    offset_us = copy_idx * COPY_STAGGER_us
+    return (
+        (f"{flw}/{copy_idx}", direction, seq, time_us + offset_us, tsval,
+         tsecr)
+        for flw, direction, seq, time_us, tsval, tsecr in recs)
+
+
+def multiplex(sim_dirs, copies=1):
+    """
+    Returns an iterator over the records of every unfair flow of the
+    simulations in sim_dirs, repeated copies times, in timestamp order.
+    """
+    assert copies > 0, f"\"copies\" must be positive, but is: {copies}"
+    flws = [load_flow(sim_dir, unfair_idx)
+            for sim_dir in sim_dirs
+            for unfair_idx in range(utils.Sim(sim_dir).unfair_flws)]
+    if copies > 1:
+        flws = [copy_flow(recs, copy_idx)
+                for recs in flws for copy_idx in range(copies)]
+    return heapq.merge(*flws, key=lambda rec: rec[3])
+
+
+class Replayer:
+    """ Emits records at a controlled rate and counts them. """
+
+    def __init__(self, recs, speed=None):
+        """
+        recs: An iterable of records, in timestamp order.
+        speed: The multiple of real time at which to emit records (e.g., 1 for
+            real time, 10 for 10x), or None to emit them as fast as possible.
+        """
+        assert speed is None or speed > 0, \
+            f"\"speed\" must be positive, but is: {speed}"
+        self.recs = recs
+        self.speed = speed
+        # Statistics.
+        self.num_recs = 0
+        self.tim_srt_s = None
+        # The timestamp of the first record and of the latest record (us).
+        self.first_us = None
+        self.last_us = None
+
+    async def records(self):
+        """ Yields each record when it is due. """
+        self.tim_srt_s = time.perf_counter()
+        for rec in self.recs:
+            time_us = rec[3]
+            if self.first_us is None:
+                self.first_us = time_us
+            if self.speed is None:
+                if self.num_recs % CHUNK_RECS == 0:
+                    await asyncio.sleep(0)
+            else:
+                ahead_s = (
+                    (time_us - self.first_us) / 1e6 / self.speed -
+                    (time.perf_counter() - self.tim_srt_s))
+                if ahead_s > PACE_SLACK_S:
+                    await asyncio.sleep(ahead_s)
+            self.last_us = time_us
+            self.num_recs += 1
+            yield rec
+
+    def report(self):
+        """
+        Prints the achieved replay rate and, when pacing, the target rate.
+        """
+        if self.tim_srt_s is None:
+            return
+        dur_s = time.perf_counter() - self.tim_srt_s
+        msg = (f"Records: {self.num_recs}, achieved: "
+               f"{self.num_recs / dur_s:.2f} packets/s")
+        if self.speed is not None and self.num_recs > 1:
+            # The average rate of the replayed trace, sped up.
+            trace_s = (self.last_us - self.first_us) / 1e6 / self.speed
+            msg += (f", target: {self.num_recs / trace_s:.2f} packets/s"
+                    if trace_s > 0 else "")
+        print(msg)
+
+    async def run_reports(self, interval_s):
+        """ Prints statistics every interval_s seconds. """
+        while True:
+            await asyncio.sleep(interval_s)
+            self.report()
+
+
+async def replay(rpl, sock_flp, report_s):
+    """
+    Sends every record from a Replayer to the UNIX socket sock_flp, in the
+    format of service.parse_record(), or discards them if sock_flp is None.
+    """
+    writer = None
+    if sock_flp is not None:
+        _, writer = await asyncio.open_unix_connection(sock_flp)
+    reports = asyncio.ensure_future(rpl.run_reports(report_s))
+    try:
+        async for rec in rpl.records():
+            if writer is not None:
+                writer.write(f"{' '.join(str(val) for val in rec)}\n".encode())
+                if rpl.num_recs % CHUNK_RECS == 0:
+                    # Apply backpressure.
+                    await writer.drain()
+        if writer is not None:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+    finally:
+        reports.cancel()
+    print("Final statistics:")
+    rpl.report()
+
+
+def main():
+    """ This program's entrypoint. """
+    # Parse command line arguments.
+    psr = argparse.ArgumentParser(
+        description="Replays simulation packet traces as packet records.")
+    psr.add_argument(
+        "--simulations", nargs="+", required=True,
+        help="The simulation directories to replay.", type=str)
+    psr.add_argument(
+        "--copies", default=1,
+        help="The number of copies of each simulation to replay at once.",
+        type=int)
+    psr.add_argument(
+        "--speed", default=0,
+        help=("The multiple of real time at which to replay (e.g., 1 for real "
+              "time). 0 means as fast as possible."),
+        type=float)
+    psr.add_argument(
+        "--socket",
+        help=("The UNIX socket to which to send records (e.g., that of "
+              "service.py). By default, records are discarded."),
+        type=str)
+    psr.add_argument(
+        "--report-s", default=REPORT_S,
+        help="The interval between statistics reports.", type=float)
+    args = psr.parse_args()
+    assert args.copies > 0, \
+        f"\"copies\" must be positive, but is: {args.copies}"
+    assert args.speed >= 0, \
+        f"\"speed\" cannot be negative, but is: {args.speed}"
+
+    rpl = Replayer(
+        multiplex(args.simulations, args.copies),
+        speed=args.speed if args.speed > 0 else None)
+    asyncio.run(replay(rpl, args.socket, args.report_s))
+
+
+if __name__ == "__main__":
+    main()
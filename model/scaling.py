@@ -0,0 +1,260 @@
+""" Vectorized feature scaling for 2D float arrays. """
+
+import numpy as np
+
+
+# The number of rows to process at once. Large enough to amortize per-call
+# overhead, small enough for temporaries to stay in cache.
+CHUNK_ROWS = 2**14
+
+
+def fit(dat, scl_grps, standardize=False):
+    """
+    Computes scaling parameters for the 2D float array dat. scl_grps contains
+    one scaling group index for each column of dat. The groups must be numbered
+    0 to N - 1. All of the values in a scaling group are scaled together.
+
+    Returns an array of shape (dat.shape[1], 2) where row i contains the
+    scaling parameters of column i's scaling group. If standardize is True,
+    then these are the group's mean and standard deviation. Otherwise, they are
+    the group's min and max.
+    """
+    scl_grps = np.asarray(scl_grps, dtype=int)
+    num_rows, num_cols = dat.shape
+    assert scl_grps.shape == (num_cols,), \
+        f"Invalid scaling groups ({scl_grps}) for {num_cols} columns!"
+    num_grps = len(set(scl_grps.tolist()))
+    assert scl_grps.min() == 0 and scl_grps.max() == num_grps - 1, \
+        f"Scaling groups must be numbered 0 to {num_grps - 1}: {scl_grps}"
+
+    if standardize:
+        # Group means.
+        cnts = np.bincount(scl_grps, minlength=num_grps) * num_rows
+        means = np.bincount(
+            scl_grps, weights=dat.sum(axis=0), minlength=num_grps) / cnts
+        # Group standard deviations. Sum the squared deviations of each
+        # column in chunks, so that only one chunk's worth of deviations is
+        # materialized at a time.
+        col_means = means[scl_grps]
+        sqs = np.zeros((num_cols,), dtype=float)
+        for start_idx in range(0, num_rows, CHUNK_ROWS):
+            dev = dat[start_idx:start_idx + CHUNK_ROWS] - col_means
+            sqs += np.einsum("ij,ij->j", dev, dev)
+        stds = np.sqrt(
+            np.bincount(scl_grps, weights=sqs, minlength=num_grps) / cnts)
+        prms = np.stack((means, stds), axis=1)
+    else:
+        mins = np.full((num_grps,), np.inf)
+        np.minimum.at(mins, scl_grps, dat.min(axis=0))
+        maxs = np.full((num_grps,), -np.inf)
+        np.maximum.at(maxs, scl_grps, dat.max(axis=0))
+        prms = np.stack((mins, maxs), axis=1)
+    return prms[scl_grps]
+
+
+def transform(dat, prms, standardize=False, min_out=0, max_out=1):
+    """
+    Scales the columns of the 2D float array dat in place, using the per-column
+    scaling parameters prms (see fit()). If standardize is True, then each
+    column has its mean subtracted and is divided by its standard deviation.
+    Otherwise, each column is rescaled from [min, max] to [min_out, max_out].
+    Columns whose values are all the same (i.e., whose standard deviation is 0
+    or whose min and max are equal) are set to 0. Returns dat.
+    """
+    prms = np.asarray(prms, dtype=float)
+    num_cols = dat.shape[1]
+    assert prms.shape == (num_cols, 2), \
+        f"Expected scaling parameters of shape ({num_cols}, 2): {prms.shape}"
+    sub = prms[:, 0]
+    if standardize:
+        div = prms[:, 1].copy()
+        add = np.zeros((num_cols,), dtype=float)
+    else:
+        div = (prms[:, 1] - prms[:, 0]) / (max_out - min_out)
+        add = np.full((num_cols,), min_out, dtype=float)
+    # Dividing by infinity sends degenerate columns to 0.
+    degenerate = div == 0
+    div[degenerate] = np.inf
+    add[degenerate] = 0
+    for start_idx in range(0, dat.shape[0], CHUNK_ROWS):
+        chunk = dat[start_idx:start_idx + CHUNK_ROWS]
+        chunk -= sub
+        chunk /= div
+        chunk += add
+    return dat
+
+
+class OnlineStats:
+    """
+    Accumulates per-column statistics (mean, variance, min, and max) over a
+    stream of 2D float arrays, so that scaling parameters can be fitted to data
+    that does not fit in memory. Uses Chan et al.'s parallel variant of
+    Welford's algorithm to combine batches. If unknown is not None, then values
+    equal to unknown are counted but excluded from the statistics.
+    """
+
+    def __init__(self, num_cols, unknown=None):
+        self.unknown = unknown
+        # The total number of rows seen.
+        self.num_rows = 0
+        # Per-column statistics of the known values.
+        self.cnts = np.zeros((num_cols,), dtype=float)
+        self.means = np.zeros((num_cols,), dtype=float)
+        # Sum of squared deviations from the mean.
+        self.m2s = np.zeros((num_cols,), dtype=float)
+        self.mins = np.full((num_cols,), np.inf)
+        self.maxs = np.full((num_cols,), -np.inf)
+
+    def update(self, dat):
+        """ Adds the rows of the 2D float array dat to the statistics. """
+        num_rows, num_cols = dat.shape
+        assert num_cols == self.cnts.shape[0], \
+            f"Expected {self.cnts.shape[0]} columns, but found {num_cols}."
+        if self.unknown is None:
+            cnts = np.full((num_cols,), num_rows, dtype=float)
+            means = dat.mean(axis=0) if num_rows else np.zeros((num_cols,))
+            dev = dat - means
+            mins = dat.min(axis=0, initial=np.inf)
+            maxs = dat.max(axis=0, initial=-np.inf)
+        else:
+            known = dat != self.unknown
+            cnts = known.sum(axis=0).astype(float)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means = np.where(
+                    cnts > 0, np.where(known, dat, 0).sum(axis=0) / cnts, 0)
+            dev = np.where(known, dat - means, 0)
+            mins = np.where(known, dat, np.inf).min(axis=0, initial=np.inf)
+            maxs = np.where(known, dat, -np.inf).max(axis=0, initial=-np.inf)
+        self.num_rows += num_rows
+        self.__merge(
+            cnts, means, np.einsum("ij,ij->j", dev, dev), mins, maxs)
+
+    def merge(self, other):
+        """ Adds the statistics accumulated by another OnlineStats. """
+        assert self.unknown == other.unknown, \
+            "Cannot merge statistics with different unknown values!"
+        self.num_rows += other.num_rows
+        self.__merge(other.cnts, other.means, other.m2s, other.mins, other.maxs)
+
+    def moments(self):
+        """
+        Returns the statistics as a dictionary of arrays, which can be saved
+        with np.savez() and restored with from_moments().
+        """
+        return {
+            "num_rows": np.array(self.num_rows), "cnts": self.cnts,
+            "means": self.means, "m2s": self.m2s, "mins": self.mins,
+            "maxs": self.maxs}
+
+    @staticmethod
+    def from_moments(moments, unknown=None):
+        """ Creates an OnlineStats from the output of moments(). """
+        stats = OnlineStats(np.asarray(moments["cnts"]).shape[0], unknown)
+        stats.num_rows = int(moments["num_rows"])
+        for key in ["cnts", "means", "m2s", "mins", "maxs"]:
+            setattr(stats, key, np.array(moments[key], dtype=float))
+        return stats
+
+    def select(self, col_idxs):
+        """ Returns the statistics of the columns col_idxs, in that order. """
+        col_idxs = np.asarray(col_idxs, dtype=int)
+        return OnlineStats.from_moments(
+            {key: val if key == "num_rows" else val[col_idxs]
+             for key, val in self.moments().items()},
+            self.unknown)
+
+    def __merge(self, cnts, means, m2s, mins, maxs):
+        """ Combines a batch's statistics with the running statistics. """
+        tot_cnts = self.cnts + cnts
+        delta = means - self.means
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.means = np.where(
+                tot_cnts > 0, self.means + delta * cnts / tot_cnts, 0)
+            self.m2s = np.where(
+                tot_cnts > 0,
+                self.m2s + m2s + delta ** 2 * self.cnts * cnts / tot_cnts, 0)
+        self.cnts = tot_cnts
+        self.mins = np.minimum(self.mins, mins)
+        self.maxs = np.maximum(self.maxs, maxs)
+
+    def impute_params(self):
+        """
+        Returns the imputation value of each column, in the same format as
+        fit_impute().
+        """
+        return np.where(self.cnts > 0, self.means, np.nan)
+
+    def params(self, scl_grps, standardize=False):
+        """
+        Returns per-column scaling parameters in the same format as fit(). The
+        parameters are computed as if every unknown value had been replaced
+        with the mean of its column's known values. Scaling groups without any
+        known values receive parameters (0, 0), which scale to 0.
+        """
+        scl_grps = np.asarray(scl_grps, dtype=int)
+        num_grps = len(set(scl_grps.tolist()))
+        assert scl_grps.shape == self.cnts.shape, \
+            (f"Invalid scaling groups ({scl_grps}) for {self.cnts.shape[0]} "
+             "columns!")
+        assert scl_grps.min() == 0 and scl_grps.max() == num_grps - 1, \
+            f"Scaling groups must be numbered 0 to {num_grps - 1}: {scl_grps}"
+        if standardize:
+            # Imputing a column's unknown values with its mean changes its
+            # count, but not its mean or sum of squared deviations.
+            cnts = np.where(self.cnts > 0, self.num_rows, 0)
+            grp_cnts = np.bincount(scl_grps, weights=cnts, minlength=num_grps)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                grp_means = np.bincount(
+                    scl_grps, weights=cnts * self.means,
+                    minlength=num_grps) / grp_cnts
+                grp_m2s = np.bincount(
+                    scl_grps,
+                    weights=(self.m2s +
+                             cnts * (self.means - grp_means[scl_grps]) ** 2),
+                    minlength=num_grps)
+                grp_stds = np.sqrt(grp_m2s / grp_cnts)
+            prms = np.stack((grp_means, grp_stds), axis=1)
+        else:
+            # Imputed values lie between the min and the max.
+            mins = np.full((num_grps,), np.inf)
+            np.minimum.at(mins, scl_grps, self.mins)
+            maxs = np.full((num_grps,), -np.inf)
+            np.maximum.at(maxs, scl_grps, self.maxs)
+            prms = np.stack((mins, maxs), axis=1)
+        prms[~np.isfinite(prms).all(axis=1)] = 0
+        return prms[scl_grps]
+
+
+def fit_impute(dat, unknown=-1):
+    """
+    Computes the value with which to replace unknown values in each column of
+    the 2D float array dat: the mean of the column's known values (i.e., values
+    that are not equal to unknown). Columns without any known values receive
+    NaN.
+    """
+    num_rows, num_cols = dat.shape
+    cnts = np.zeros((num_cols,), dtype=float)
+    sums = np.zeros((num_cols,), dtype=float)
+    for start_idx in range(0, num_rows, CHUNK_ROWS):
+        chunk = dat[start_idx:start_idx + CHUNK_ROWS]
+        known = chunk != unknown
+        cnts += known.sum(axis=0)
+        sums += np.where(known, chunk, 0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(cnts > 0, sums / cnts, np.nan)
+
+
+def impute(dat, prms, unknown=-1):
+    """
+    Replaces, in place, the unknown values in each column of the 2D float array
+    dat with that column's imputation value from prms (see fit_impute()).
+    Columns whose imputation value is NaN are left unchanged. Returns dat.
+    """
+    prms = np.asarray(prms, dtype=float)
+    assert prms.shape == (dat.shape[1],), \
+        f"Expected {dat.shape[1]} imputation values, but found {prms.shape}."
+    valid = ~np.isnan(prms)
+    for start_idx in range(0, dat.shape[0], CHUNK_ROWS):
+        chunk = dat[start_idx:start_idx + CHUNK_ROWS]
+        np.copyto(chunk, prms, where=(chunk == unknown) & valid)
+    return dat
@@ -0,0 +1,481 @@
+#! /usr/bin/env python3
+"""
+A long-running service that classifies the flows arriving at a receiver as
+they run. Packet records are read from a source, each flow's features are
+computed online (see flow_features.py), and the features of packets from many
+flows are classified together in micro-batches. A batch is classified once it
+is full or once its oldest packet has waited for the batch deadline, whichever
+comes first. The latest class of each flow is its verdict.
+
+Packet records are tuples of the form:
+    (flow ID, direction, seq, timestamp us, TSval, TSecr)
+where direction is "data" for data packets that the receiver received and "ack"
+for ACKs that the receiver sent (see utils.parse_packets()).
+
+Three sources are available:
+    pcap: Replays the receiver packet traces of simulations, in real time, at
+        a multiple of real time, or as fast as possible (see replay.py).
+    socket: Reads records from clients of a UNIX socket. Each record is a line
+        containing the fields of a packet record, separated by whitespace.
+    generator: Generates synthetic flows locally. Used as a stand-in for a
+        real receiver.
+
+Supports sklearn models (e.g., trained with models.SvmSklearnWrapper or
+models.LrSklearnWrapper), linear models exported by export_linear.py, and
+per-packet Torch Script models, including LSTMs, whose hidden state is kept for
+each flow (see streaming.py).
+"""
+
+import argparse
+import asyncio
+import collections
+import heapq
+import json
+from os import path
+import pickle
+import random
+import time
+
+import numpy as np
+import torch
+
+import defaults
+import flow_features
+import linear_scorer
+import models
+import replay
+import scaling
+import streaming
+import utils
+
+
+# The default packet payload size (bytes).
+PAYLOAD_B = 1380
+# The default maximum number of packets in a batch.
+MAX_BATCH = 256
+# The default maximum time that a packet waits for its batch to fill up (ms).
+MAX_DELAY_MS = 1
+# The default interval between statistics reports (s).
+REPORT_S = 1
+# The number of records that the generator source emits before yielding to
+# the other tasks.
+SOURCE_CHUNK_RECS = 64
+# The maximum number of records that may be waiting in the socket source.
+SOCKET_QUEUE_RECS = 2**16
+# The number of recent packets over which the final latency percentiles are
+# computed.
+LATENCY_SAMPLES = 2**20
+# The synthetic flows of the generator source.
+#
+# Loss probability.
+GEN_LOSS_PRC = 1
+# Range of RTTs (us).
+GEN_RTT_us = (2_000, 100_000)
+# Range of mean interarrival times (us).
+GEN_INTERARR_us = (100, 2_000)
+
+
+def prepare(fets, scl_prms, imp_prms, standardize):
+    """
+    Imputes and scales, in place, the 2D float array fets, which contains one
+    row of input features for each packet. Returns fets.
+    """
+    if imp_prms is not None:
+        scaling.impute(fets, imp_prms)
+    return scaling.transform(fets, scl_prms, standardize)
+
+
+class SklearnClassifier:
+    """ Classifies packets using a trained sklearn model. """
+
+    def __init__(self, net, scl_prms, imp_prms, standardize):
+        self.net = net
+        self.scl_prms = scl_prms
+        self.imp_prms = imp_prms
+        self.standardize = standardize
+
+    def classify(self, flws, fets):
+        """
+        Classifies a batch of packets. flws contains the ID of the flow of each
+        packet, and fets is a 2D float array with one row of input features for
+        each packet. Returns the class of each packet, as a 1D array.
+        """
+        return self.net.predict(
+            prepare(fets, self.scl_prms, self.imp_prms, self.standardize))
+
+
+class TorchClassifier(SklearnClassifier):
+    """
+    Classifies packets using a Torch Script model that takes one packet at a
+    time (e.g., models.BinaryDnn) and outputs one score per class.
+    """
+
+    def __init__(self, net, scl_prms, imp_prms, standardize):
+        super(TorchClassifier, self).__init__(
+            net, scl_prms, imp_prms, standardize)
+        self.net.eval()
+
+    def classify(self, flws, fets):
+        ins = torch.from_numpy(
+            prepare(fets, self.scl_prms, self.imp_prms, self.standardize)
+        ).float()
+        with torch.no_grad():
+            return torch.argmax(self.net(ins), dim=1).numpy()
+
+
+def load_classifier(mdl_flp, scl_prms_flp, standardize):
+    """
+    Loads a trained model and its scaling parameters and imputation values,
+    which are loaded from alongside the scaling parameters, if they exist.
+    Models exported by export_linear.py include their scaling parameters and
+    imputation values, so scl_prms_flp is ignored for them. Returns an object
+    with a classify() method (see SklearnClassifier.classify()).
+    """
+    if mdl_flp.endswith("npz"):
+        return linear_scorer.load(mdl_flp)
+    with open(scl_prms_flp, "r") as fil:
+        scl_prms = np.array(json.load(fil), dtype=float)
+    imp_prms_flp = utils.get_impute_prms_flp(scl_prms_flp)
+    if path.exists(imp_prms_flp):
+        imp_prms = utils.load_impute_prms(imp_prms_flp)
+    else:
+        print(f"Warning: Imputation values not found: {imp_prms_flp}")
+        imp_prms = None
+
+    if mdl_flp.endswith("pickle"):
+        with open(mdl_flp, "rb") as fil:
+            return SklearnClassifier(
+                pickle.load(fil), scl_prms, imp_prms, standardize)
+    if mdl_flp.endswith("pth"):
+        net = torch.jit.load(mdl_flp)
+        if hasattr(net, "lstm"):
+            # Keep each flow's hidden state across batches.
+            return streaming.LstmFlowTable(streaming.LstmClassifier(
+                net, scl_prms, imp_prms, standardize))
+        return TorchClassifier(net, scl_prms, imp_prms, standardize)
+    raise Exception(f"Unknown model type: {mdl_flp}")
+
+
+class Service:
+    """
+    Computes the features of each flow and classifies packets in
+    micro-batches. Records are passed to ingest(), and run_deadlines() must be
+    running in order for batches to be classified on their deadlines.
+    """
+
+    def __init__(self, clf, fets, payload_B=PAYLOAD_B, max_batch=MAX_BATCH,
+                 max_delay_s=MAX_DELAY_MS / 1e3):
+        """
+        clf: The classifier to use (see load_classifier()).
+        fets: The names of the classifier's input features, in order.
+        payload_B: The packet payload size of every flow (bytes).
+        max_batch: The maximum number of packets in a batch.
+        max_delay_s: The maximum time that a packet waits for its batch to fill
+            up (s).
+        """
+        self.clf = clf
+        bad_fets = [fet for fet in fets if fet not in flow_features.NAMES]
+        assert not bad_fets, f"Unknown features: {bad_fets}"
+        sender_fets = [fet for fet in fets if fet in flow_features.SENDER_FETS]
+        if sender_fets:
+            print("Warning: These features are unknown at the receiver and "
+                  f"will always be -1: {sender_fets}")
+        self.fet_idxs = np.array(
+            [flow_features.NAMES.index(fet) for fet in fets], dtype=int)
+        self.payload_B = payload_B
+        self.max_batch = max_batch
+        self.max_delay_s = max_delay_s
+        # Maps flow ID to flow_features.FlowFeatureState.
+        self.flws = {}
+        # Maps flow ID to that flow's latest class.
+        self.verdicts = {}
+        # The packets in the current batch: the ID of each packet's flow, its
+        # features, and the time at which it was ingested.
+        self.bch_flws = []
+        self.bch_fets = []
+        self.bch_times = []
+        # Set when the current batch becomes nonempty.
+        self.bch_nonempty = asyncio.Event()
+        # Statistics.
+        self.num_pkts = 0
+        self.num_bchs = 0
+        self.lats_s = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.tim_srt_s = time.perf_counter()
+
+    def ingest(self, rec):
+        """ Processes one packet record. """
+        tim_s = time.perf_counter()
+        flw, direction, seq, time_us, tsval, tsecr = rec
+        state = self.flws.get(flw)
+        if state is None:
+            state = flow_features.FlowFeatureState(self.payload_B)
+            self.flws[flw] = state
+        if direction == "ack":
+            state.ack(tsval, time_us)
+            return
+        self.bch_flws.append(flw)
+        self.bch_fets.append(
+            state.update(seq, time_us, tsval, tsecr)[self.fet_idxs])
+        self.bch_times.append(tim_s)
+        # When records arrive faster than they are processed, the deadline
+        # task may not get a chance to run, so check the deadline here too.
+        if (len(self.bch_flws) >= self.max_batch or
+                tim_s - self.bch_times[0] >= self.max_delay_s):
+            self.flush()
+        elif len(self.bch_flws) == 1:
+            self.bch_nonempty.set()
+
+    def flush(self):
+        """ Classifies the current batch, if it is not empty. """
+        if not self.bch_flws:
+            return
+        clss = self.clf.classify(self.bch_flws, np.array(self.bch_fets))
+        self.verdicts.update(zip(self.bch_flws, clss.tolist()))
+        tim_s = time.perf_counter()
+        self.lats_s.extend(tim_s - bch_tim_s for bch_tim_s in self.bch_times)
+        self.num_pkts += len(self.bch_flws)
+        self.num_bchs += 1
+        self.bch_flws = []
+        self.bch_fets = []
+        self.bch_times = []
+
+    async def run_deadlines(self):
+        """ Classifies each batch once its oldest packet's deadline passes. """
+        while True:
+            if not self.bch_times:
+                self.bch_nonempty.clear()
+                await self.bch_nonempty.wait()
+                continue
+            delay_s = self.bch_times[0] + self.max_delay_s - time.perf_counter()
+            if delay_s > 0:
+                await asyncio.sleep(delay_s)
+            else:
+                self.flush()
+
+    def report(self, num_lats=None):
+        """
+        Prints statistics. The latency percentiles are computed over the most
+        recent num_lats packets, or over all recorded packets if num_lats is
+        None.
+        """
+        dur_s = time.perf_counter() - self.tim_srt_s
+        lats_s = np.array(self.lats_s, dtype=float)
+        if num_lats is not None:
+            lats_s = lats_s[len(lats_s) - min(num_lats, len(lats_s)):]
+        if lats_s.shape[0]:
+            p50_ms, p99_ms = np.percentile(lats_s, [50, 99]) * 1e3
+        else:
+            p50_ms = p99_ms = float("NaN")
+        clss, cnts = np.unique(
+            np.array(list(self.verdicts.values()), dtype=int),
+            return_counts=True)
+        print(
+            f"Packets: {self.num_pkts}, throughput: "
+            f"{self.num_pkts / dur_s:.2f} packets/s, batches: {self.num_bchs}, "
+            f"latency p50: {p50_ms:.3f} ms, p99: {p99_ms:.3f} ms, flows: "
+            f"{len(self.flws)}, verdicts (class: flows): "
+            f"{dict(zip(clss.tolist(), cnts.tolist()))}")
+
+    async def run_reports(self, interval_s):
+        """ Prints statistics every interval_s seconds. """
+        while True:
+            num_pkts = self.num_pkts
+            await asyncio.sleep(interval_s)
+            self.report(num_lats=self.num_pkts - num_pkts)
+
+    async def run(self, source, report_s=REPORT_S):
+        """
+        Processes every record from the asynchronous iterable source, then
+        classifies the last batch and prints final statistics.
+        """
+        tasks = [
+            asyncio.ensure_future(self.run_deadlines()),
+            asyncio.ensure_future(self.run_reports(report_s))]
+        try:
+            async for rec in source:
+                self.ingest(rec)
+            self.flush()
+        finally:
+            for task in tasks:
+                task.cancel()
+        print("Final statistics:")
+        self.report()
+
+
+async def socket_source(sock_flp):
+    """
+    Accepts any number of clients on the UNIX socket sock_flp and yields the
+    records that they send, forever. See parse_record() for the record format.
+    """
+    recs = asyncio.Queue(maxsize=SOCKET_QUEUE_RECS)
+
+    async def handle(reader, writer):
+        """ Reads records from one client until it disconnects. """
+        async for line in reader:
+            if line.strip():
+                await recs.put(parse_record(line))
+        writer.close()
+
+    server = await asyncio.start_unix_server(handle, path=sock_flp)
+    print(f"Listening on: {sock_flp}")
+    async with server:
+        while True:
+            yield await recs.get()
+
+
+def parse_record(line):
+    """
+    Parses a record of the form:
+        <flow ID> <direction> <seq> <timestamp us> <TSval> <TSecr>
+    """
+    flw, direction, seq, time_us, tsval, tsecr = line.decode().split()
+    assert direction in ["ack", "data"], f"Invalid direction: {direction}"
+    return flw, direction, int(seq), float(time_us), int(tsval), int(tsecr)
+
+
+async def generator_source(num_flws, num_pkts, payload_B=PAYLOAD_B, seed=0):
+    """
+    Generates num_pkts data packets from num_flws synthetic flows. Each flow
+    has a random RTT and packet rate and loses packets at random. The receiver
+    sends an ACK, whose TSval is its clock in milliseconds, for every data
+    packet. Each data packet echoes the newest ACK that was sent at least one
+    RTT before it arrived.
+    """
+    rng = random.Random(seed)
+    flws = [{
+        "rtt_us": rng.uniform(*GEN_RTT_us),
+        "interarr_us": rng.uniform(*GEN_INTERARR_us),
+        "seq": 0,
+        # The (time us, TSval) of each ACK that the sender might echo.
+        "acks": collections.deque([(0, 0)])
+    } for _ in range(num_flws)]
+    # The arrival time of each flow's next packet.
+    arrs = [(rng.uniform(*GEN_INTERARR_us), flw) for flw in range(num_flws)]
+    heapq.heapify(arrs)
+    for pkt_idx in range(num_pkts):
+        time_us, flw = heapq.heappop(arrs)
+        state = flws[flw]
+        acks = state["acks"]
+        while len(acks) > 1 and acks[1][0] <= time_us - state["rtt_us"]:
+            acks.popleft()
+        if rng.random() < GEN_LOSS_PRC / 100:
+            # Skip this packet.
+            state["seq"] += payload_B
+        yield (
+            flw, "data", state["seq"], time_us, int(time_us // 1e3),
+            acks[0][1])
+        state["seq"] += payload_B
+        # Acknowledge the packet immediately.
+        tsval = int(time_us // 1e3)
+        yield flw, "ack", 0, time_us, tsval, 0
+        acks.append((time_us, tsval))
+        heapq.heappush(
+            arrs, (time_us + rng.expovariate(1 / state["interarr_us"]), flw))
+        if pkt_idx % SOURCE_CHUNK_RECS == 0:
+            await asyncio.sleep(0)
+
+
+def main():
+    """ This program's entrypoint. """
+    # Parse command line arguments.
+    psr = argparse.ArgumentParser(
+        description="Classifies the flows arriving at a receiver.")
+    psr.add_argument(
+        "--model", help="The path to a trained model file.", required=True,
+        type=str)
+    psr.add_argument(
+        "--scale-params",
+        help=("The path to the input scaling parameters. Not required for "
+              "models exported by export_linear.py."),
+        type=str)
+    psr.add_argument(
+        "--standardize", action="store_true",
+        help="The model was trained on standardized data.")
+    psr.add_argument(
+        "--features", nargs="+",
+        help=("The model's input features, in order. By default, determined "
+              "by the model type encoded in the model filename."),
+        type=str)
+    psr.add_argument(
+        "--source", choices=["pcap", "socket", "generator"],
+        default="generator", help="The source of packet records.", type=str)
+    psr.add_argument(
+        "--simulations", nargs="+",
+        help="For the \"pcap\" source, the simulation directories to replay.",
+        type=str)
+    psr.add_argument(
+        "--copies", default=1,
+        help=("For the \"pcap\" source, the number of copies of each "
+              "simulation to replay at once."),
+        type=int)
+    psr.add_argument(
+        "--speed", default=0,
+        help=("For the \"pcap\" source, the multiple of real time at which to "
+              "replay. 0 means as fast as possible."),
+        type=float)
+    psr.add_argument(
+        "--socket", help="For the \"socket\" source, the UNIX socket path.",
+        type=str)
+    psr.add_argument(
+        "--flows", default=1000,
+        help="For the \"generator\" source, the number of flows.", type=int)
+    psr.add_argument(
+        "--packets", default=1_000_000,
+        help="For the \"generator\" source, the number of data packets.",
+        type=int)
+    psr.add_argument(
+        "--payload-B", default=PAYLOAD_B,
+        help="The packet payload size of every flow (bytes).", type=float)
+    psr.add_argument(
+        "--max-batch", default=MAX_BATCH,
+        help="The maximum number of packets in a batch.", type=int)
+    psr.add_argument(
+        "--max-delay-ms", default=MAX_DELAY_MS,
+        help="The maximum time that a packet waits for its batch to fill up.",
+        type=float)
+    psr.add_argument(
+        "--report-s", default=REPORT_S,
+        help="The interval between statistics reports.", type=float)
+    args = psr.parse_args()
+    assert path.exists(args.model), f"Model file does not exist: {args.model}"
+    assert args.model.endswith("npz") or (
+        args.scale_params is not None and path.exists(args.scale_params)), \
+        f"Scale parameters file does not exist: {args.scale_params}"
+    assert args.max_batch > 0, \
+        f"\"max-batch\" must be positive, but is: {args.max_batch}"
+    assert args.max_delay_ms >= 0, \
+        f"\"max-delay-ms\" cannot be negative, but is: {args.max_delay_ms}"
+
+    clf = load_classifier(args.model, args.scale_params, args.standardize)
+    fets = args.features
+    if fets is None and args.model.endswith("npz"):
+        fets = clf.fets
+    elif fets is None:
+        # Convert the model filename to an arguments dictionary, and extract
+        # the "model" key.
+        fets = models.MODELS[utils.str_to_args(
+            path.basename(args.model),
+            order=sorted(defaults.DEFAULTS.keys()))["model"]].in_spc
+    if args.source == "pcap":
+        assert args.simulations, "\"pcap\" source requires \"--simulations\"."
+        assert args.copies > 0, \
+            f"\"copies\" must be positive, but is: {args.copies}"
+        assert args.speed >= 0, \
+            f"\"speed\" cannot be negative, but is: {args.speed}"
+        source = replay.Replayer(
+            replay.multiplex(args.simulations, args.copies),
+            speed=args.speed if args.speed > 0 else None).records()
+    elif args.source == "socket":
+        assert args.socket is not None, \
+            "\"socket\" source requires \"--socket\"."
+        source = socket_source(args.socket)
+    else:
+        source = generator_source(args.flows, args.packets, args.payload_B)
+
+    srv = Service(
+        clf, fets, args.payload_B, args.max_batch, args.max_delay_ms / 1e3)
+    asyncio.run(srv.run(source, args.report_s))
+
+
+if __name__ == "__main__":
+    main()
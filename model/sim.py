@@ -1,14 +1,18 @@
 """Runs simulations. """
 
+import collections
+import functools
+import hashlib
 import json
 import logging
 import logging.handlers
-import multiprocessing
 import os
 from os import path
 import subprocess
 import time
-import traceback
+
+import executors
+import utils
 
 
 # Path to the ns-3 top-level directory.
@@ -17,67 +21,379 @@ import traceback
 NS3_DIR = path.join(path.dirname(path.realpath(__file__)), "..", "ns-3-unfair")
 # The name of the ns-3 application to run.
 APP = "dumbbell"
-# Used to synchronize writing to the error log.
-LOCK = multiprocessing.Lock()
-# Name of the error log file.
-ERR_FLN = "failed.json"
+# Paths, relative to NS3_DIR, whose contents determine whether ns-3 must be
+# rebuilt.
+BUILD_SRCS = ["contrib", "scratch", "src", "wscript", "wutils.py"]
+# Name of the file, inside the ns-3 build directory, that records the
+# fingerprint of the source tree as of the last successful build.
+BUILD_FINGERPRINT_FLN = ".unfair_fingerprint"
+# Name of the run ledger file. The ledger is append-only and contains one JSON
+# object per line, describing one run.
+LEDGER_FLN = "runs.jsonl"
+# Name of the resource profile report file.
+PROFILE_FLN = "profile.json"
+# The configuration parameters by which the resource profile report is broken
+# down.
+PROFILE_KEYS = [
+    "bottleneck_bandwidth_Mbps", "other_flows", "bottleneck_queue_p",
+    "capture_profile"]
+# Packet capture profiles, selected using the "capture_profile" configuration
+# parameter:
+#     full: Capture whole packets at every node.
+#     compact: Capture whole packets at every node, then, after the
+#         simulation, convert the traces of the nodes that parse_dumbbell.py
+#         reads into compact header-only traces (see utils.compact_pcap()) and
+#         delete the other traces. This reduces only the size of the stored
+#         traces. The simulation still writes the full traces, so it does not
+#         reduce the simulation's write I/O.
+CAPTURE_PROFILES = ["full", "compact"]
+# Configuration parameters that are handled by this module and are not passed
+# to the ns-3 application.
+LOCAL_ARGS = ["capture_profile"]
 # Name of the logger for this module.
 LOGGER = path.basename(__file__).split(".")[0]
 
 
-def check_output(cnf, logger):
-    """ Runs a configuration and returns its output. """
-    args = ([path.join(NS3_DIR, "build", "scratch", APP),] +
-            [f"--{arg}={val}" for arg, val in cnf.items()])
-    cmd = f"LD_LIBRARY_PATH={os.environ['LD_LIBRARY_PATH']} {' '.join(args)}"
-    log = logging.getLogger(logger)
-    log.info("Running: %s", cmd)
+class Ns3Env:
+    """
+    Describes how to run the ns-3 application binary directly. Create this
+    once and pass it to the workers so that they do not need to recompute
+    paths or environment variables.
+    """
+
+    def __init__(self, ns3_dir=NS3_DIR, app=APP):
+        self.ns3_dir = ns3_dir
+        # Path to the application binary.
+        self.app_flp = path.join(ns3_dir, "build", "scratch", app)
+        # Since we are running the application binary directly, we need to
+        # make sure the ns-3 library can be found.
+        self.ld_library_path = (
+            "/usr/lib/gcc/x86_64-linux-gnu/7:"
+            f"{path.join(ns3_dir, 'build', 'lib')}:/opt/libtorch/lib")
+        # The environment in which to run the application binary.
+        self.env = dict(os.environ, LD_LIBRARY_PATH=self.ld_library_path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_env(ns3_dir=NS3_DIR, app=APP):
+    """ Returns a (cached) Ns3Env for the provided ns-3 directory. """
+    return Ns3Env(ns3_dir, app)
+
+
+def build_fingerprint(ns3_dir):
+    """
+    Computes a fingerprint of the ns-3 source tree, based on the path,
+    modification time, and size of every file in BUILD_SRCS.
+    """
+    hsh = hashlib.sha1()
+    for src in BUILD_SRCS:
+        src_pth = path.join(ns3_dir, src)
+        flps = [src_pth] if path.isfile(src_pth) else []
+        for dir_pth, dir_nms, flns in os.walk(src_pth):
+            # Skip hidden directories (e.g., ".git"). Modify dir_nms in
+            # place so that os.walk() visits the remaining directories in a
+            # deterministic order.
+            dir_nms[:] = sorted(
+                dir_nm for dir_nm in dir_nms if not dir_nm.startswith("."))
+            flps.extend(path.join(dir_pth, fln) for fln in sorted(flns))
+        for flp in flps:
+            stat = os.stat(flp)
+            hsh.update(
+                f"{path.relpath(flp, ns3_dir)}:{stat.st_mtime_ns}:"
+                f"{stat.st_size}\n".encode())
+    return hsh.hexdigest()
+
+
+def build(env, log):
+    """
+    Compiles ns-3, unless the source tree has not changed since the last
+    successful build. Returns True if waf was invoked.
+    """
+    fpt_flp = path.join(env.ns3_dir, "build", BUILD_FINGERPRINT_FLN)
+    fpt = build_fingerprint(env.ns3_dir)
+    if path.exists(env.app_flp) and path.exists(fpt_flp):
+        with open(fpt_flp, "r") as fil:
+            if fil.read() == fpt:
+                log.info("ns-3 is up to date. Skipping build.")
+                return False
+    subprocess.check_call(["./waf"], cwd=env.ns3_dir)
+    # Only record the fingerprint after a successful build.
+    with open(fpt_flp, "w") as fil:
+        fil.write(fpt)
+    return True
+
+
+def append_ledger(flp, entry):
+    """
+    Appends an entry to the run ledger at flp. The entry is written using a
+    single write() to a file opened in append mode, so concurrent writers
+    (even from separate processes) do not need to synchronize.
+    """
+    line = (json.dumps(entry) + "\n").encode()
+    fd = os.open(flp, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def load_ledger(flp):
+    """ Loads a run ledger. Returns a list of entries, one for each run. """
+    with open(flp, "r") as fil:
+        return [json.loads(line) for line in fil if line.strip()]
+
+
+def sim_name(cnf):
+    """
+    Returns the name that the ns-3 application gives to a configuration's
+    output. This is the inverse of utils.Sim.
+    """
+    def expand(dlys_us, num_flws):
+        """
+        Converts a list of edge delays to a list with one entry per flow. A
+        single delay applies to all flows.
+        """
+        dlys_us = json.loads(dlys_us) if isinstance(dlys_us, str) else dlys_us
+        return dlys_us * num_flws if len(dlys_us) == 1 else dlys_us
+
+    unfair_flws = int(cnf["unfair_flows"])
+    other_flws = int(cnf["other_flows"])
+    edge_dlys_us = ",".join(
+        str(dly_us)
+        for dly_us in (expand(cnf["unfair_edge_delays_us"], unfair_flws) +
+                       expand(cnf["other_edge_delays_us"], other_flws)))
+    return (f"{cnf['bottleneck_bandwidth_Mbps']}Mbps-"
+            f"{cnf['bottleneck_delay_us']}us-{cnf['bottleneck_queue_p']}p-"
+            f"{unfair_flws}unfair-{other_flws}fair-{edge_dlys_us}us-"
+            f"{cnf['payload_B']}B-{cnf['duration_s']}s")
+
+
+def parse_nodes(cnf):
+    """
+    Returns the IDs of the nodes whose packet traces parse_dumbbell.py reads:
+    the bottleneck router and the unfair flows' senders and receivers.
+    """
+    unfair_flws = int(cnf["unfair_flows"])
+    other_flws = int(cnf["other_flows"])
+    # Node 1 is the bottleneck router. Nodes 2 onwards are the senders
+    # (unfair flows first), followed by the receivers in the same order.
+    return ([1] + [2 + idx for idx in range(unfair_flws)] +
+            [2 + unfair_flws + other_flws + idx
+             for idx in range(unfair_flws)])
+
+
+def sim_traces(cnf, nodes=None):
+    """
+    Returns the paths of the packet traces (pcap files or compact traces)
+    written by a configuration, or None if the configuration's output cannot be
+    located. If nodes is not None, then only the traces of those nodes are
+    returned. Lists only the configuration's own simulation directory, not the
+    whole output directory.
+    """
     try:
-        res = subprocess.check_output(
-            args, stderr=subprocess.STDOUT, env=os.environ).decode().split("\n")
-    except subprocess.CalledProcessError:
-        traceback.print_exc()
-        log.exception("Exception while running:\n%s\n\n", cmd)
-        # Only one worker should access the error log at a time.
-        LOCK.acquire()
-        err_flp = path.join(cnf["out_dir"], ERR_FLN)
-        # If the error log already exists, then read the existing log and append
-        # to it. Otherwise, start a new log.
-        if path.exists(err_flp):
-            with open(err_flp, "r") as fil:
-                err_log = json.load(fil)
+        name = sim_name(cnf)
+    except (KeyError, TypeError, ValueError):
+        return None
+    sim_dir = path.join(cnf["out_dir"], name)
+    if not path.isdir(sim_dir):
+        return None
+    flps = [
+        path.join(sim_dir, fln) for fln in os.listdir(sim_dir)
+        if fln.endswith(".pcap") or fln.endswith(utils.COMPACT_SUFFIX)]
+    if nodes is not None:
+        # Trace filenames are of the form: <name>-<node>-<device>.<extension>
+        nodes = {str(node) for node in nodes}
+        flps = [
+            flp for flp in flps
+            if path.basename(flp)[len(name) + 1:].split("-")[0] in nodes]
+    return flps
+
+
+def pcap_bytes(cnf):
+    """
+    Returns the total size of the packet traces that parse_dumbbell.py reads
+    (see parse_nodes()), whether full pcap files or compact traces, or None if
+    the configuration's output cannot be located. The paths of the traces are
+    derived from the configuration, so this does not list any directories.
+    """
+    try:
+        name = sim_name(cnf)
+    except (KeyError, TypeError, ValueError):
+        return None
+    sim_dir = path.join(cnf["out_dir"], name)
+    if not path.isdir(sim_dir):
+        return None
+    tot_B = 0
+    for node in parse_nodes(cnf):
+        # parse_dumbbell.py reads each node's first device.
+        pcap_flp = path.join(sim_dir, f"{name}-{node}-0.pcap")
+        for flp in [pcap_flp, utils.compact_flp(pcap_flp)]:
+            if path.exists(flp):
+                tot_B += path.getsize(flp)
+    return tot_B
+
+
+def check_capture_profile(prf):
+    """ Verifies that a capture profile exists. """
+    assert prf in CAPTURE_PROFILES, \
+        f"\"capture_profile\" must be one of {CAPTURE_PROFILES}, but is: {prf}"
+
+
+def compact_traces(cnf):
+    """
+    Converts the pcap files of the nodes that parse_dumbbell.py reads into
+    compact header-only traces, and deletes the other pcap files.
+    """
+    keep = set(sim_traces(cnf, parse_nodes(cnf)) or [])
+    for flp in sim_traces(cnf) or []:
+        if not flp.endswith(".pcap"):
+            continue
+        if flp in keep:
+            utils.compact_pcap(flp)
         else:
-            err_log = []
-        # Record the full command (including LD_LIBRARY_PATH) in the error log
-        # for ease of debugging. Do not do "cnf['cmd'] = ..." to maintain the
-        # invariant that cnf contains only command line arguments.
-        err_log.append(dict(cnf, cmd=cmd))
-        with open(err_flp, "w") as fil:
-            json.dump(err_log, fil, indent=4)
-        LOCK.release()
+            os.remove(flp)
+
+
+def profile_report(prfs, keys=PROFILE_KEYS):
+    """
+    Summarizes the resource profiles of many runs (i.e., run ledger entries).
+    Returns a dictionary mapping each key in keys to a dictionary mapping each
+    value of that configuration parameter to resource statistics for the runs
+    with that value.
+    """
+    def stats(grp):
+        """ Computes resource statistics for a group of runs. """
+        num = len(grp)
+        wall_s = [prf["end_s"] - prf["start_s"] for prf in grp]
+        pcap_B = [prf["pcap_B"] for prf in grp if prf["pcap_B"] is not None]
+        return {
+            "num_runs": num,
+            "num_failed": sum(prf["exit_status"] != 0 for prf in grp),
+            "wall_s_mean": sum(wall_s) / num,
+            "wall_s_max": max(wall_s),
+            "wall_s_total": sum(wall_s),
+            "user_s_mean": sum(prf["user_s"] for prf in grp) / num,
+            "sys_s_mean": sum(prf["sys_s"] for prf in grp) / num,
+            "max_rss_KiB_mean": sum(prf["max_rss_KiB"] for prf in grp) / num,
+            "max_rss_KiB_max": max(prf["max_rss_KiB"] for prf in grp),
+            "pcap_B_mean": sum(pcap_B) / len(pcap_B) if pcap_B else None,
+            "pcap_B_total": sum(pcap_B)
+        }
+
+    rpt = {}
+    for key in keys:
+        grps = collections.defaultdict(list)
+        for prf in prfs:
+            grps[prf["cnf"].get(key)].append(prf)
+        rpt[key] = {
+            str(val): stats(grp)
+            for val, grp in sorted(
+                grps.items(), key=lambda p: (str(type(p[0])), p[0]))}
+    return rpt
+
+
+def format_profile_report(rpt):
+    """ Converts a report from profile_report() into a human-readable table. """
+    lines = []
+    for key, grps in rpt.items():
+        lines.append(
+            f"{key:>26} | {'runs':>5} | {'wall s':>9} | {'user s':>9} | "
+            f"{'sys s':>8} | {'max RSS MiB':>11} | {'pcap MiB':>9}")
+        for val, sts in grps.items():
+            pcap_MiB = (
+                "?" if sts["pcap_B_mean"] is None
+                else f"{sts['pcap_B_mean'] / 2**20:.1f}")
+            lines.append(
+                f"{val:>26} | {sts['num_runs']:>5} | "
+                f"{sts['wall_s_mean']:>9.2f} | {sts['user_s_mean']:>9.2f} | "
+                f"{sts['sys_s_mean']:>8.2f} | "
+                f"{sts['max_rss_KiB_max'] / 2**10:>11.1f} | {pcap_MiB:>9}")
+    return "\n".join(lines)
+
+
+def check_output(cnf, logger, env=None, ledger_flp=None):
+    """
+    Runs a configuration. If ledger_flp is not None, then records the run,
+    including its resource usage, in the run ledger at ledger_flp. env is an
+    Ns3Env. If env is None, then the default Ns3Env is used. Returns a tuple of
+    the form:
+        (output lines, ledger entry)
+    """
+    if env is None:
+        env = get_env()
+    cap_prf = cnf.get("capture_profile", "full")
+    check_capture_profile(cap_prf)
+    args = ([env.app_flp,] +
+            [f"--{arg}={val}" for arg, val in cnf.items()
+             if arg not in LOCAL_ARGS])
+    cmd = f"LD_LIBRARY_PATH={env.ld_library_path} {' '.join(args)}"
+    log = logging.getLogger(logger)
+    log.info("Running: %s", cmd)
+    tim_srt_s = time.time()
+    proc = subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env.env)
+    out = proc.stdout.read()
+    proc.stdout.close()
+    # Reap the process ourselves (instead of using proc.wait()) so that we
+    # can collect the resource usage of this specific child.
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    tim_end_s = time.time()
+
+    if proc.returncode == 0:
+        res = out.decode().split("\n")
+    else:
+        log.error(
+            "Exception while running (exit status: %s):\n%s\n\n%s",
+            proc.returncode, cmd, out.decode(errors="replace"))
         # The output is empty.
         res = []
-    return res
+    if proc.returncode == 0 and cap_prf == "compact":
+        compact_traces(cnf)
+    # Record the full command (including LD_LIBRARY_PATH) in the ledger for
+    # ease of debugging. Do not do "cnf['cmd'] = ..." to maintain the
+    # invariant that cnf contains only command line arguments.
+    prf = {
+        "cnf": cnf,
+        "cmd": cmd,
+        "start_s": tim_srt_s,
+        "end_s": tim_end_s,
+        "exit_status": proc.returncode,
+        "user_s": rusage.ru_utime,
+        "sys_s": rusage.ru_stime,
+        # On Linux, ru_maxrss is in kilobytes.
+        "max_rss_KiB": rusage.ru_maxrss,
+        "out_B": len(out),
+        "pcap_B": pcap_bytes(cnf)
+    }
+    if ledger_flp is not None:
+        append_ledger(ledger_flp, prf)
+    return res, prf
 
 
-def run(cnf, res_fnc, logger):
+def run(cnf, res_fnc, logger, env=None, ledger_flp=None):
     """
-    Runs a configuration. If res_fnc is not None, then returns the result of
-    parsing the configuration's output using res_fnc, otherwise returns None.
+    Runs a configuration. Returns a tuple of the form:
+        (result, resource profile)
+    If res_fnc is not None, then the result is the output of parsing the
+    configuration's output using res_fnc, otherwise the result is None. See
+    check_output() for the format of the resource profile and the meaning of
+    ledger_flp.
     """
     # Build the arguments array, run the simulation, and iterate over each line
     # in its output.
-    out = check_output(cnf, logger)
-    if res_fnc is None:
-        return None
-    return res_fnc(out)
+    out, prf = check_output(cnf, logger, env, ledger_flp)
+    return None if res_fnc is None else res_fnc(out), prf
 
 
 def sim(eid, cnfs, out_dir, res_fnc=None, log_par=None, log_dst=None,
-        dry_run=False, sync=False):
+        dry_run=False, sync=False, executor=None):
     """
     Simulates a set of configurations. Returns a list of pairs of the form:
         (configuration, result)
+    executor is an executors.Executor that decides where the simulations run.
+    If executor is None, then the simulations run on this machine (serially if
+    sync is True).
     """
     # Set up logging.
     logger = LOGGER if log_par is None else f"{log_par}.{LOGGER}"
@@ -94,14 +410,10 @@ def sim(eid, cnfs, out_dir, res_fnc=None, log_par=None, log_dst=None,
         hdl.setLevel("ERROR")
         log.addHandler(hdl)
 
-    # Compile ns-3.
-    log.info("ns-3 dir: %s", NS3_DIR)
-    subprocess.check_call(["./waf"], cwd=NS3_DIR)
-    # Since we are running the application binary directly, we need to make sure
-    # the ns-3 library can be found.
-    os.environ["LD_LIBRARY_PATH"] = (
-        f"/usr/lib/gcc/x86_64-linux-gnu/7:{path.join(NS3_DIR, 'build', 'lib')}:"
-        "/opt/libtorch/lib")
+    # Compile ns-3, if necessary.
+    env = get_env()
+    log.info("ns-3 dir: %s", env.ns3_dir)
+    build(env, log)
 
     # Record the configurations.
     with open(path.join(out_dir, "configurations.json"), "w") as fil:
@@ -111,12 +423,24 @@ def sim(eid, cnfs, out_dir, res_fnc=None, log_par=None, log_dst=None,
     log.info("Num simulations: %s", len(cnfs))
     if dry_run:
         return []
+    if executor is None:
+        executor = executors.LocalExecutor(sync)
+    # Remote workers must discover their own ns-3 environment.
+    wrk_env = None if executor.remote else env
+    # The ledger is stored in out_dir, next to the resource profile report,
+    # rather than in the configurations' output directory, which must contain
+    # only simulations (see parse_dumbbell.py).
+    ledger_flp = path.join(out_dir, LEDGER_FLN)
     tim_srt_s = time.time()
-    if sync:
-        data = [run(cnf, res_fnc, logger) for cnf in cnfs]
-    else:
-        with multiprocessing.Pool() as pool:
-            data = pool.starmap(run, ((cnf, res_fnc, logger) for cnf in cnfs))
+    data = executor.starmap(
+        run, [(cnf, res_fnc, logger, wrk_env, ledger_flp) for cnf in cnfs])
     log.critical(
         "Done with simulations - time: %.2f seconds", time.time() - tim_srt_s)
+    data, prfs = zip(*data) if data else ((), ())
+
+    # Summarize the simulations' resource usage.
+    rpt = profile_report(prfs)
+    with open(path.join(out_dir, PROFILE_FLN), "w") as fil:
+        json.dump(rpt, fil, indent=4)
+    log.info("Resource profile:\n%s", format_profile_report(rpt))
     return list(zip(cnfs, data))
@@ -0,0 +1,203 @@
+"""
+Stateful, per-packet inference using a trained LSTM (see models.Lstm). Instead
+of rerunning the LSTM over a flow's entire history whenever a packet arrives,
+each flow's hidden state is kept between calls.
+
+    LstmClassifier: A TorchScript LSTM and the scaling parameters and
+        imputation values of its input features.
+    LstmFlow: The state of a single flow. Classifies one packet, or a few
+        consecutive packets, at a time.
+    LstmFlowTable: The states of many concurrent flows. Classifies packets from
+        any number of flows together, using one forward pass for all flows.
+"""
+
+import json
+
+import numpy as np
+import torch
+
+import scaling
+import utils
+
+
+class LstmClassifier:
+    """ A trained LSTM and the parameters needed to prepare its inputs. """
+
+    def __init__(self, net, scl_prms, imp_prms, standardize):
+        """
+        net: A models.Lstm, compiled to Torch Script (e.g., as saved by
+            train.py).
+        scl_prms: The scaling parameters of the input features (see
+            scaling.fit()).
+        imp_prms: The imputation values of the input features (see
+            scaling.fit_impute()), or None to skip imputation.
+        standardize: Whether scl_prms are for standardization.
+        """
+        self.net = net
+        self.net.eval()
+        self.scl_prms = np.asarray(scl_prms, dtype=float)
+        self.imp_prms = (
+            None if imp_prms is None else np.asarray(imp_prms, dtype=float))
+        self.standardize = standardize
+        self.num_fets = self.net.lstm.input_size
+        assert self.scl_prms.shape == (self.num_fets, 2), \
+            (f"Expected scaling parameters for {self.num_fets} features, but "
+             f"found: {self.scl_prms.shape}")
+        # The shape of a single flow's hidden state.
+        self.hid_shp = (self.net.lstm.num_layers, 1, self.net.lstm.hidden_size)
+
+    def init_hidden(self, num_flws=1):
+        """ Returns a new hidden state for num_flws flows. """
+        shp = (self.hid_shp[0], num_flws, self.hid_shp[2])
+        return torch.zeros(shp), torch.zeros(shp)
+
+    def prepare(self, fets):
+        """
+        Imputes and scales the 2D float array fets, which contains one row of
+        input features for each packet. Returns a tensor.
+        """
+        fets = np.array(fets, dtype=float, ndmin=2)
+        assert fets.shape[1] == self.num_fets, \
+            f"Expected {self.num_fets} features, but found: {fets.shape[1]}"
+        if self.imp_prms is not None:
+            scaling.impute(fets, self.imp_prms)
+        scaling.transform(fets, self.scl_prms, self.standardize)
+        return torch.from_numpy(fets).float()
+
+    def step(self, ins, hidden):
+        """
+        Runs the LSTM on the tensor ins, of shape
+        (sequence length, number of flows, number of features), starting from
+        hidden. Returns the class of each packet, of shape
+        (sequence length, number of flows), and the new hidden state.
+        """
+        with torch.no_grad():
+            out, hidden = self.net(ins, hidden)
+        return torch.argmax(out, dim=1).view(ins.shape[:2]), hidden
+
+
+def load(mdl_flp, scl_prms_flp, standardize):
+    """
+    Loads an LstmClassifier from a TorchScript model file and its scaling
+    parameters file. The imputation values, if they exist, are loaded from
+    alongside the scaling parameters.
+    """
+    with open(scl_prms_flp, "r") as fil:
+        scl_prms = json.load(fil)
+    imp_prms_flp = utils.get_impute_prms_flp(scl_prms_flp)
+    try:
+        imp_prms = utils.load_impute_prms(imp_prms_flp)
+    except FileNotFoundError:
+        print(f"Warning: Imputation values not found: {imp_prms_flp}")
+        imp_prms = None
+    return LstmClassifier(
+        torch.jit.load(mdl_flp), scl_prms, imp_prms, standardize)
+
+
+class LstmFlow:
+    """ Classifies the packets of a single flow as they arrive. """
+
+    def __init__(self, clf):
+        """ clf: The LstmClassifier to use. """
+        self.clf = clf
+        self.hidden = clf.init_hidden()
+
+    def classify(self, fets):
+        """
+        Classifies the next packet of this flow, or the next few packets, in
+        order. fets is a 1D array containing one packet's input features, or a
+        2D array with one row for each packet. Returns the class of each
+        packet, as a 1D array.
+        """
+        ins = self.clf.prepare(fets)
+        clss, self.hidden = self.clf.step(ins.unsqueeze(1), self.hidden)
+        return clss.view(-1).numpy()
+
+    def reset(self):
+        """ Forgets this flow's history. """
+        self.hidden = self.clf.init_hidden()
+
+
+class LstmFlowTable:
+    """
+    Classifies the packets of many concurrent flows as they arrive. Each flow
+    is identified by an arbitrary hashable ID and is assigned a slot in a
+    table of hidden states. Packets from many flows are classified together:
+    the hidden states of their flows are gathered from the table, advanced by
+    one forward pass, and scattered back.
+    """
+
+    def __init__(self, clf, capacity=1024):
+        """
+        clf: The LstmClassifier to use.
+        capacity: The initial number of slots. The table grows as needed.
+        """
+        self.clf = clf
+        self.hidden = clf.init_hidden(capacity)
+        # Maps flow ID to slot.
+        self.slots = {}
+        # Slots that have been released by remove().
+        self.free = []
+
+    def __len__(self):
+        """ Returns the number of flows in this table. """
+        return len(self.slots)
+
+    def __slot(self, flw):
+        """ Returns the slot of a flow, assigning one if necessary. """
+        slot = self.slots.get(flw)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = len(self.slots)
+                capacity = self.hidden[0].shape[1]
+                if slot >= capacity:
+                    # Double the capacity. New slots are initialized.
+                    self.hidden = tuple(
+                        torch.cat((hid, torch.zeros_like(hid)), dim=1)
+                        for hid in self.hidden)
+            self.slots[flw] = slot
+        return slot
+
+    def classify(self, flws, fets):
+        """
+        Classifies a batch of packets from any number of flows. flws contains
+        the ID of the flow of each packet, and fets is a 2D array with one row
+        of input features for each packet. Packets of the same flow must be in
+        order. Returns the class of each packet, as a 1D array.
+        """
+        ins = self.clf.prepare(fets)
+        num_pkts = ins.shape[0]
+        assert len(flws) == num_pkts, \
+            f"Expected {num_pkts} flow IDs, but found: {len(flws)}"
+        slots = np.array([self.__slot(flw) for flw in flws], dtype=int)
+        # Determine each packet's position among the packets of its flow in
+        # this batch. Usually, each flow has at most one packet per batch, in
+        # which case a single forward pass suffices. Otherwise, every flow's
+        # first packet is classified first, then every flow's second packet,
+        # and so on.
+        order = np.argsort(slots, kind="stable")
+        srt = slots[order]
+        starts = np.concatenate(([True], srt[1:] != srt[:-1]))
+        poss = np.empty((num_pkts,), dtype=int)
+        poss[order] = np.arange(num_pkts) - np.maximum.accumulate(
+            np.where(starts, np.arange(num_pkts), 0))
+        clss = np.empty((num_pkts,), dtype=int)
+        for pos in range(poss.max() + 1 if num_pkts else 0):
+            rows = np.flatnonzero(poss == pos)
+            slt = torch.from_numpy(slots[rows])
+            clss_cur, hidden = self.clf.step(
+                ins[rows].unsqueeze(0),
+                tuple(hid[:, slt] for hid in self.hidden))
+            for hid, hid_new in zip(self.hidden, hidden):
+                hid[:, slt] = hid_new
+            clss[rows] = clss_cur.view(-1).numpy()
+        return clss
+
+    def remove(self, flw):
+        """ Forgets a flow, e.g., because it has ended, and frees its slot. """
+        slot = self.slots.pop(flw)
+        for hid in self.hidden:
+            hid[:, slot] = 0
+        self.free.append(slot)
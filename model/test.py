@@ -49,6 +49,14 @@ def process_one(idx, total, sim_flp, out_dir, net, warmup_prc, scl_prms_flp,
     (dat_in, dat_out, dat_out_raw, dat_out_oracle, _) = (
         utils.load_tmp_file(temp_path))
 
+    # Load and apply the imputation values, if they exist. Models trained
+    # before imputation values were saved did not impute at test time.
+    imp_prms_flp = utils.get_impute_prms_flp(scl_prms_flp)
+    if path.exists(imp_prms_flp):
+        dat_in = utils.impute_all(dat_in, utils.load_impute_prms(imp_prms_flp))
+    else:
+        print(f"Warning: Imputation values not found: {imp_prms_flp}")
+
     # Load and apply the scaling parameters.
     with open(scl_prms_flp, "r") as fil:
         scl_prms = json.load(fil)
@@ -17,14 +17,15 @@ import pickle
 import random
 import sys
 import time
+import zipfile
 
 import numpy as np
-from numpy.lib import recfunctions
 import torch
 
 import cl_args
 import defaults
 import models
+import scaling
 import utils
 
 
@@ -39,9 +40,11 @@ SHUFFLE = True
 LOGS_PER_EPC = 5
 # The number of validation passes per epoch.
 VALS_PER_EPC = 15
+# The feature that contains the oracle's labels.
+ORACLE_FET = "mathis model label-ewma-alpha0.01"
 
 
-def scale_fets(dat, scl_grps, standardize=False):
+def scale_fets(dat, scl_grps, standardize=False, in_place=False):
     """
     Returns a copy of dat with the columns normalized. If standardize
     is True, then the scaling groups are normalized to a mean of 0 and
@@ -52,6 +55,9 @@ def scale_fets(dat, scl_grps, standardize=False):
     scaling parameters are the mean and standard deviation of that
     column's scaling group. If standardize is False, then the scaling
     parameters are the min and max of that column's scaling group.
+
+    If in_place is True and dat's columns are all float64, then dat is scaled
+    in place and returned instead of a copy.
     """
     fets = dat.dtype.names
     assert fets is not None, \
@@ -59,68 +65,16 @@ def scale_fets(dat, scl_grps, standardize=False):
     assert len(scl_grps) == len(fets), \
         f"Invalid scaling groups ({scl_grps}) for dtype ({dat.dtype.descr})!"
 
-    # Determine the unique scaling groups.
-    scl_grps_unique = set(scl_grps)
-    # Create an empty array to hold the min and max values (i.e.,
-    # scaling parameters) for each scaling group.
-    scl_grps_prms = np.empty((len(scl_grps_unique), 2), dtype="float64")
-    # Function to reduce a structured array.
-    rdc = (lambda fnc, arr:
-           fnc(np.array(
-               [fnc(arr[fet]) for fet in arr.dtype.names if fet != ""])))
-    # Determine the min and the max of each scaling group.
-    for scl_grp in scl_grps_unique:
-        # Determine the features in this scaling group.
-        scl_grp_fets = [fet for fet_idx, fet in enumerate(fets)
-                        if scl_grps[fet_idx] == scl_grp]
-        # Extract the columns corresponding to this scaling group.
-        fet_values = dat[scl_grp_fets]
-        # Record the min and max of these columns.
-        scl_grps_prms[scl_grp] = [
-            np.mean(utils.clean(fet_values))
-            if standardize else rdc(np.min, fet_values),
-            np.std(utils.clean(fet_values))
-            if standardize else rdc(np.max, fet_values)
-        ]
-
-    # Create an empty array to hold the min and max values (i.e.,
-    # scaling parameters) for each column (i.e., feature).
-    scl_prms = np.empty((len(fets), 2), dtype="float64")
-    # Create an empty array to hold the rescaled features.
-    new = np.empty(dat.shape, dtype=dat.dtype)
-    # Rescale each feature based on its scaling group's min and max.
-    for fet_idx, fet in enumerate(fets):
-        # Look up the parameters for this feature's scaling group.
-        prm_1, prm_2 = scl_grps_prms[scl_grps[fet_idx]]
-        # Store this min and max in the list of per-column scaling parameters.
-        scl_prms[fet_idx] = np.array([prm_1, prm_2])
-        fet_values = dat[fet]
-        if standardize:
-            # prm_1 is the mean and prm_2 is the standard deviation.
-            scaled = (
-                # Handle the rare case where the standard deviation is
-                # 0 (meaning that all of the feature values are the
-                # same), in which case return an array of zeros.
-                np.zeros(
-                    fet_values.shape, dtype=fet_values.dtype) if prm_2 == 0
-                else (fet_values - prm_1) / prm_2)
-        else:
-            # prm_1 is the min and prm_2 is the max.
-            scaled = (
-                # Handle the rare case where the min and the max are
-                # the same (meaning that all of the feature values are
-                # the same.
-                np.zeros(
-                    fet_values.shape, dtype=fet_values.dtype) if prm_1 == prm_2
-                else utils.scale(
-                    fet_values, prm_1, prm_2, min_out=0, max_out=1))
-        new[fet] = scaled
-
-    return new, scl_prms
+    new = utils.unstructured_view(dat) if in_place else None
+    if new is None:
+        new = utils.clean(dat)
+    scl_prms = scaling.fit(new, scl_grps, standardize)
+    scaling.transform(new, scl_prms, standardize)
+    return utils.as_structured(new, fets), scl_prms
 
 
 def process_sim(idx, total, net, sim_flp, tmp_dir, warmup_prc, keep_prc,
-                sequential=False):
+                sequential=False, buf=None):
     """
     Loads and processes data from a single simulation.
 
@@ -132,21 +86,117 @@ def process_sim(idx, total, net, sim_flp, tmp_dir, warmup_prc, keep_prc,
     utils.save_tmp_file() for the format of the results file.
 
     Returns the path to the results file and a descriptive utils.Sim object.
+
+    If "buf" is not None, then the results are written directly into a shared
+    output buffer instead of to a temporary file. "buf" is a tuple of the form:
+        (buffer path, utils.map_regions() layout, first row, number of rows)
+    In this case, returns a tuple of the form:
+        (column names of each result array, scaling groups, utils.Sim object)
     """
-    sim, dat = utils.load_sim(
-        sim_flp, msg=f"{idx + 1:{f'0{len(str(total))}'}}/{total}")
+    dat = load_sim_data(idx, total, net, sim_flp, warmup_prc)
     if dat is None:
         return None
+    sim, dat_in, dat_out, dat_out_raw, dat_out_oracle = dat
+
+    # Transform the data as required by this specific model.
+    dat_in, dat_out, dat_out_raw, dat_out_oracle, scl_grps = net.modify_data(
+        sim, dat_in, dat_out, dat_out_raw, dat_out_oracle,
+        sequential=sequential)
 
-    # Drop the first few packets so that we consider steady-state behavior only.
-    dat = dat[math.floor(dat.shape[0] * warmup_prc / 100):]
-    # Split each data matrix into two separate matrices: one with the input
-    # features only and one with the output features only. The names of the
-    # columns correspond to the feature names in in_spc and out_spc.
+    # Select a fraction of the data.
+    idxs = select_rows(dat_in.shape[0], keep_prc)
+    dat_in = dat_in[idxs]
+    dat_out = dat_out[idxs]
+    dat_out_raw = dat_out_raw[idxs]
+    dat_out_oracle = dat_out_oracle[idxs]
+
+    if buf is None:
+        # To avoid errors with sending large matrices between processes,
+        # store the results in a temporary file.
+        dat_flp = path.join(
+            tmp_dir, f"{path.basename(sim_flp)[:-4]}_tmp.npz")
+        utils.save_tmp_file(
+            dat_flp, dat_in, dat_out, dat_out_raw, dat_out_oracle, scl_grps)
+        return dat_flp, sim
+
+    # Write the results into this simulation's rows of the shared buffer.
+    buf_flp, layout, start_idx, num_rows = buf
+    assert dat_in.shape[0] == num_rows, \
+        (f"{sim_flp}: Expected {num_rows} rows, but found "
+         f"{dat_in.shape[0]}.")
+    dats = (dat_in, dat_out, dat_out_raw, dat_out_oracle)
+    for dat, region in zip(dats, utils.map_regions(buf_flp, layout)):
+        fets = dat.dtype.names
+        assert len(fets) == region.shape[1], \
+            f"{sim_flp}: Expected {region.shape[1]} features: {fets}"
+        for col, fet in enumerate(fets):
+            region[start_idx:start_idx + num_rows, col] = dat[fet]
+    return [dat.dtype.names for dat in dats], np.array(scl_grps), sim
+
+
+def process_sim_lazy(idx, total, net, sim_flp, warmup_prc, keep_prc):
+    """
+    Like process_sim(), but for models that divide each simulation into windows
+    (see models.BinaryModelWrapper.select_windows()). Instead of creating the
+    windows, selects them. Returns a tuple of the form:
+        (utils.Sim object, 2D array of the input features of each packet,
+         index of the last packet in each window, duration of the windows (us)
+         or None, class label of each window)
+    or None if the simulation is invalid.
+    """
+    dat = load_sim_data(idx, total, net, sim_flp, warmup_prc)
+    if dat is None:
+        return None
+    sim, dat_in, dat_out, _, _ = dat
+    end_idxs, dur_us = net.select_windows(sim, dat_in)
+    # Select a fraction of the windows.
+    end_idxs = end_idxs[select_rows(end_idxs.shape[0], keep_prc)]
+    return (
+        sim, utils.clean(dat_in), end_idxs, dur_us,
+        dat_out["class"][end_idxs])
+
+
+def process_sim_seq(idx, total, net, sim_flp, warmup_prc, keep_prc):
+    """
+    Like process_sim(), but for recurrent models, which require each
+    simulation's packets in order. To keep the packets consecutive, selects the
+    first "keep_prc" percent of the packets instead of a random subset.
+    Returns a tuple of the form:
+        (utils.Sim object, 2D array of the input features of each packet,
+         class label of each packet)
+    or None if the simulation is invalid.
+    """
+    dat = load_sim_data(idx, total, net, sim_flp, warmup_prc)
+    if dat is None:
+        return None
+    sim, dat_in, dat_out, _, _ = dat
+    num_pkts = math.ceil(dat_in.shape[0] * keep_prc / 100)
+    return sim, utils.clean(dat_in[:num_pkts]), dat_out["class"][:num_pkts]
+
+
+def load_sim_data(idx, total, net, sim_flp, warmup_prc):
+    """
+    Loads and validates the input features, output features, and oracle's
+    labels of a single simulation. See process_sim() for the arguments. Returns
+    a tuple of the form:
+        (utils.Sim object, input, output classes, raw output, oracle output)
+    or None if the simulation is invalid.
+    """
+    # Load only the input features, the output features, and the oracle's
+    # labels. Drop the first few packets so that we consider steady-state
+    # behavior only. The names of the columns correspond to the feature names
+    # in in_spc and out_spc.
     assert net.in_spc, "{sim_flp}: Empty in spec."
     assert net.out_spc, "{sim_flp}: Empty out spec."
-    dat_in = recfunctions.repack_fields(dat[net.in_spc])
-    dat_out = recfunctions.repack_fields(dat[net.out_spc])
+    fets_grps = [net.in_spc, net.out_spc, [ORACLE_FET]]
+    sim, dats = utils.load_sim_cols(
+        sim_flp, fets_grps, warmup_prc,
+        msg=f"{idx + 1:{f'0{len(str(total))}'}}/{total}")
+    if dats is None:
+        return None
+    # Give each matrix named columns, without copying.
+    dat_in, dat_out, dat_out_oracle = [
+        utils.as_structured(dat, fets) for dat, fets in zip(dats, fets_grps)]
     # Convert output features to class labels.
     dat_out_raw = dat_out
     dat_out = net.convert_to_class(sim, dat_out)
@@ -172,96 +222,42 @@ def process_sim(idx, total, net, sim_flp, tmp_dir, warmup_prc, keep_prc,
     # structured numpy array containing a column named "class".
     for cls in set(dat_out["class"].tolist()):
         assert 0 <= cls < net.num_clss, f"Invalid class: {cls}"
+    return sim, dat_in, dat_out, dat_out_raw, dat_out_oracle
 
-    # Transform the data as required by this specific model.
-    dat_in, dat_out, dat_out_raw, dat_out_oracle, scl_grps = net.modify_data(
-        sim, dat_in, dat_out, dat_out_raw,
-        # Must put the column name in a list for the result to be
-        # a structured array.
-        dat_out_oracle=dat[["mathis model label-ewma-alpha0.01"]],
-        sequential=sequential)
 
-    # Select a fraction of the data.
-    num_rows = dat_in.shape[0]
+def select_rows(num_rows, keep_prc):
+    """
+    Randomly selects, with replacement, keep_prc percent of num_rows rows.
+    Returns their indices.
+    """
     num_to_pick = math.ceil(num_rows * keep_prc / 100)
-    idxs = np.random.random_integers(0, num_rows - 1, num_to_pick)
-    dat_in = dat_in[idxs]
-    dat_out = dat_out[idxs]
-    dat_out_raw = dat_out_raw[idxs]
-    dat_out_oracle = dat_out_oracle[idxs]
+    return np.random.random_integers(0, num_rows - 1, num_to_pick)
 
-    # To avoid errors with sending large matrices between processes,
-    # store the results in a temporary file.
-    dat_flp = path.join(tmp_dir, f"{path.basename(sim_flp)[:-4]}_tmp.npz")
-    utils.save_tmp_file(
-        dat_flp, dat_in, dat_out, dat_out_raw, dat_out_oracle, scl_grps)
-    return dat_flp, sim
 
-
-def make_datasets(net, args, dat=None):
+def sim_num_rows(net, sim_flp, warmup_prc, keep_prc):
     """
-    Parses the simulation files in data_dir and transforms them (e.g., by
-    scaling) into the correct format for the network.
-
-    If num_sims is not None, then this function selects the first num_sims
-    simulations only. If shuffle is True, then the simulations will be parsed in
-    sorted order. Use num_sims and shuffle=True together to simplify debugging.
+    Returns the number of rows that process_sim() produces for a simulation,
+    without parsing the simulation, or 0 if the simulation file is invalid.
     """
-    if dat is None:
-        # Find simulations.
-        sims = args["sims"]
-        if not sims:
-            dat_dir = args["data_dir"]
-            sims = [
-                path.join(dat_dir, sim) for sim in sorted(os.listdir(dat_dir))]
-        if SHUFFLE:
-            # Set the random seed so that multiple parallel instances of
-            # this script see the same random order.
-            utils.set_rand_seed()
-            random.shuffle(sims)
-        num_sims = args["num_sims"]
-        if num_sims is not None:
-            num_sims_actual = len(sims)
-            assert num_sims_actual >= num_sims, \
-                (f"Insufficient simulations. Requested {num_sims}, but only "
-                 f"{num_sims_actual} available.")
-            sims = sims[:num_sims]
-        tot_sims = len(sims)
-        print(f"Found {tot_sims} simulations.")
-
-        # Prepare temporary output directory. The output of parsing each
-        # simulation it written to disk instead of being transfered
-        # between processes because sometimes the data is too large for
-        # Python to send between processes.
-        tmp_dir = args["tmp_dir"]
-        if tmp_dir is None:
-            tmp_dir = args["out_dir"]
-        if not path.isdir(tmp_dir):
-            print(f"Temporary directory does not exist. Creating it: {tmp_dir}")
-            os.makedirs(tmp_dir)
-
-        # Parse simulations.
-        sims_args = [
-            (idx, tot_sims, net, sim, tmp_dir, args["warmup_percent"],
-             args["keep_percent"])
-            for idx, sim in enumerate(sims)]
-        if defaults.SYNC or args["sync"]:
-            dat_all = [process_sim(*sim_args) for sim_args in sims_args]
-        else:
-            with multiprocessing.Pool() as pol:
-                # Each element of dat_all corresponds to a single simulation.
-                dat_all = pol.starmap(process_sim, sims_args)
-        # Throw away results from simulations that could not be parsed.
-        dat_all = [dat for dat in dat_all if dat is not None]
-        print(f"Discarded {tot_sims - len(dat_all)} simulations!")
-        assert dat_all, "No valid simulations found!"
-        dat_all, sims = zip(*dat_all)
+    try:
+        num_pkts = utils.get_npz_headers(sim_flp)[0][1][0]
+    except zipfile.BadZipFile:
+        return 0
+    num_pkts -= math.floor(num_pkts * warmup_prc / 100)
+    return math.ceil(
+        net.num_modified_rows(utils.Sim(sim_flp), num_pkts) * keep_prc / 100)
 
-        dat_all = [utils.load_tmp_file(flp) for flp in dat_all]
-    else:
-        dat_all, sims = dat
 
-    # Validate data.
+def combine(dat_all):
+    """
+    Validates and stacks the results of many simulations, where dat_all is a
+    list of the results of process_sim(), as loaded by utils.load_tmp_file().
+    Makes two passes: the first validates the simulations and sizes the output,
+    and the second copies each simulation into place.
+    Returns a tuple of the form:
+        (input, output, raw output, oracle output, scaling groups,
+         number of rows from each simulation)
+    """
     dim_in = None
     dtype_in = None
     dim_out = None
@@ -298,38 +294,163 @@ def make_datasets(net, args, dat=None):
     assert dtype_out is not None, "Unable to compute output dtype!"
     assert scl_grps is not None, "Unable to compte scaling groups!"
 
-    # Build combined feature lists.
-    dat_in_all, dat_out_all, dat_out_all_raw, dat_out_all_oracle, _ = zip(
-        *dat_all)
+    # Preallocate the combined arrays and fill them in place, instead of
+    # concatenating, so that peak memory is the size of the inputs plus the
+    # size of the output.
+    num_rows = [dat[0].shape[0] for dat in dat_all]
+    tot_rows = sum(num_rows)
+    combined = [
+        np.empty((tot_rows,), dtype=dat.dtype) for dat in dat_all[0][:4]]
+    start_idx = 0
+    for dat, num_rows_ in zip(dat_all, num_rows):
+        for dst, src in zip(combined, dat[:4]):
+            dst[start_idx:start_idx + num_rows_] = src
+        start_idx += num_rows_
+    return (*combined, scl_grps, num_rows)
+
+
+def find_sims(args):
+    """
+    Returns the paths to the simulations to parse. See make_datasets() for the
+    meaning of args["num_sims"] and SHUFFLE.
+    """
+    sims = args["sims"]
+    if not sims:
+        dat_dir = args["data_dir"]
+        sims = [path.join(dat_dir, sim) for sim in sorted(os.listdir(dat_dir))]
+    if SHUFFLE:
+        # Set the random seed so that multiple parallel instances of this
+        # script see the same random order.
+        utils.set_rand_seed()
+        random.shuffle(sims)
+    num_sims = args["num_sims"]
+    if num_sims is not None:
+        num_sims_actual = len(sims)
+        assert num_sims_actual >= num_sims, \
+            (f"Insufficient simulations. Requested {num_sims}, but only "
+             f"{num_sims_actual} available.")
+        sims = sims[:num_sims]
+    print(f"Found {len(sims)} simulations.")
+    return sims
+
+
+def make_datasets(net, args, dat=None):
+    """
+    Parses the simulation files in data_dir and transforms them (e.g., by
+    scaling) into the correct format for the network.
+
+    If num_sims is not None, then this function selects the first num_sims
+    simulations only. If shuffle is True, then the simulations will be parsed in
+    sorted order. Use num_sims and shuffle=True together to simplify debugging.
+    """
+    if dat is None:
+        sims = find_sims(args)
+        tot_sims = len(sims)
+
+        # Prepare temporary output directory. The output of parsing each
+        # simulation is written to a buffer on disk instead of being
+        # transfered between processes because sometimes the data is too
+        # large for Python to send between processes.
+        tmp_dir = args["tmp_dir"]
+        if tmp_dir is None:
+            tmp_dir = args["out_dir"]
+        if not path.isdir(tmp_dir):
+            print(f"Temporary directory does not exist. Creating it: {tmp_dir}")
+            os.makedirs(tmp_dir)
+
+        # Size a buffer that will hold the results of all simulations. Each
+        # simulation is assigned a range of rows, which its worker fills in
+        # directly. This avoids sending results between processes.
+        warmup_prc = args["warmup_percent"]
+        keep_prc = args["keep_percent"]
+        num_rows = [
+            sim_num_rows(net, sim, warmup_prc, keep_prc) for sim in sims]
+        start_idxs = np.cumsum([0] + num_rows[:-1]).tolist()
+        tot_rows = sum(num_rows)
+        layout = [
+            ((tot_rows, net.num_modified_fets()), "float64"),
+            ((tot_rows, 1), "int64"),
+            ((tot_rows, len(net.out_spc)), "float64"),
+            ((tot_rows, 1), "float64")]
+        buf_flp = path.join(tmp_dir, f"buffer_{os.getpid()}.bin")
+        print(f"Allocating buffer for {tot_rows} rows: {buf_flp}")
+        regions = utils.map_regions(buf_flp, layout, create=True)
+
+        # Parse simulations.
+        sims_args = [
+            (idx, tot_sims, net, sim, tmp_dir, warmup_prc, keep_prc, False,
+             (buf_flp, layout, start_idx, num_rows_))
+            for idx, (sim, start_idx, num_rows_) in enumerate(
+                zip(sims, start_idxs, num_rows))]
+        if defaults.SYNC or args["sync"]:
+            dat_all = [process_sim(*sim_args) for sim_args in sims_args]
+        else:
+            with multiprocessing.Pool() as pol:
+                # Each element of dat_all corresponds to a single simulation.
+                dat_all = pol.starmap(process_sim, sims_args)
+        # Our mappings of the buffer remain valid after the file is removed.
+        os.remove(buf_flp)
+        # Throw away results from simulations that could not be parsed.
+        dat_all = [
+            (dat, start_idx, num_rows_)
+            for dat, start_idx, num_rows_ in zip(dat_all, start_idxs, num_rows)
+            if dat is not None]
+        print(f"Discarded {tot_sims - len(dat_all)} simulations!")
+        assert dat_all, "No valid simulations found!"
+        # Move rows forward to fill the gaps left by discarded simulations.
+        tot_rows = 0
+        for _, start_idx, num_rows_ in dat_all:
+            if start_idx != tot_rows:
+                for region in regions:
+                    region[tot_rows:tot_rows + num_rows_] = (
+                        region[start_idx:start_idx + num_rows_])
+            tot_rows += num_rows_
+        dat_all, _, num_rows = zip(*dat_all)
+        fets_all, scl_grps_all, sims = zip(*dat_all)
+
+        # Validate data.
+        fets = fets_all[0]
+        scl_grps = scl_grps_all[0]
+        for fets_cur, scl_grps_cur in zip(fets_all, scl_grps_all):
+            assert fets_cur == fets, f"Invalid features: {fets_cur} != {fets}"
+            assert (scl_grps_cur == scl_grps).all(), \
+                f"Invalid scaling groups: {scl_grps_cur} != {scl_grps}"
+        # Name the columns of the combined results, without copying.
+        dat_in_all, dat_out_all, dat_out_all_raw, dat_out_all_oracle = [
+            utils.as_structured(region[:tot_rows], fets_)
+            for region, fets_ in zip(regions, fets)]
+    else:
+        dat_all, sims = dat
+        dat_in_all, dat_out_all, dat_out_all_raw, dat_out_all_oracle, \
+            scl_grps, num_rows = combine(dat_all)
+
     # Determine the number of flows in each example.
-    num_flws = [sim.unfair_flws + sim.fair_flws for sim in sims]
-    num_flws = [
-        np.array([num_flws_] * dat_in.shape[0], dtype=[("num_flws", "int")])
-        for num_flws_, dat_in in zip(num_flws, dat_in_all)]
-    num_flws = np.concatenate(num_flws, axis=0)
-    # Stack the arrays.
-    dat_in_all = np.concatenate(dat_in_all, axis=0)
-    dat_out_all = np.concatenate(dat_out_all, axis=0)
-    dat_out_all_raw = np.concatenate(dat_out_all_raw, axis=0)
-    dat_out_all_oracle = np.concatenate(dat_out_all_oracle, axis=0)
-
-    # Convert all instances of -1 (feature value unknown) to the mean
-    # for that feature.
-    bad_fets = []
-    for fet in dat_in_all.dtype.names:
-        fet_values = dat_in_all[fet]
-        if (fet_values == -1).all():
-            bad_fets.append(fet)
-            continue
-        dat_in_all[fet] = np.where(
-            fet_values == -1, np.mean(fet_values), fet_values)
-        assert (dat_in_all[fet] != -1).all(), f"Found \"-1\" in feature: {fet}"
+    num_flws = np.empty((sum(num_rows),), dtype=[("num_flws", "int8")])
+    start_idx = 0
+    for sim, num_rows_ in zip(sims, num_rows):
+        num_flws_ = sim.unfair_flws + sim.fair_flws
+        assert num_flws_ <= np.iinfo("int8").max, \
+            f"Too many flows: {num_flws_}"
+        num_flws["num_flws"][start_idx:start_idx + num_rows_] = num_flws_
+        start_idx += num_rows_
+
+    # Replace all instances of -1 (feature value unknown) with the mean of
+    # that feature's known values. Impute in place if possible.
+    fets = dat_in_all.dtype.names
+    dat_in_all_2d = utils.unstructured_view(dat_in_all)
+    if dat_in_all_2d is None:
+        dat_in_all_2d = utils.clean(dat_in_all)
+        dat_in_all = utils.as_structured(dat_in_all_2d, fets)
+    prms_imp = scaling.fit_impute(dat_in_all_2d)
+    bad_fets = [fet for fet, prm in zip(fets, prms_imp) if np.isnan(prm)]
     assert not bad_fets, f"Features contain only \"-1\": {bad_fets}"
+    scaling.impute(dat_in_all_2d, prms_imp)
 
     # Scale input features. Do this here instead of in process_sim()
     # because all of the features must be scaled using the same
     # parameters.
-    dat_in_all, prms_in = scale_fets(dat_in_all, scl_grps, args["standardize"])
+    dat_in_all, prms_in = scale_fets(
+        dat_in_all, scl_grps, args["standardize"], in_place=True)
 
     # # Check if any of the data is malformed and discard features if
     # # necessary.
@@ -345,29 +466,127 @@ def make_datasets(net, args, dat=None):
 
     return (
         dat_in_all, dat_out_all, dat_out_all_raw, dat_out_all_oracle, num_flws,
-        prms_in)
+        prms_in, prms_imp)
+
+
+def check_lazy_model(net):
+    """
+    Verifies that net supports creating windows lazily (see
+    make_lazy_dataset()).
+    """
+    assert (isinstance(net, models.BinaryModelWrapper) and
+            not isinstance(net, models.SvmSklearnWrapper) and
+            (net.rtt_buckets or net.windows)), \
+        ("Creating windows lazily (\"lazy-windows\") supports only PyTorch "
+         f"models that divide simulations into windows, not: {net.name}")
+
+
+def make_lazy_dataset(net, args):
+    """
+    Like make_datasets(), but for models that divide simulations into windows.
+    Instead of creating every window up front, returns a
+    utils.LazyWindowDataset that creates windows as they are used, so that the
+    training data need only be as large as the simulations' packets. Also
+    returns the scaling parameters and the imputation values.
+    """
+    check_lazy_model(net)
+    dat_all = map_sims(process_sim_lazy, net, args)
+    _, pkts_all, end_idxs_all, durs_us, dat_out_all = zip(*dat_all)
+
+    dataset = utils.LazyWindowDataset(
+        net.in_spc, pkts_all, end_idxs_all, dat_out_all, net.win,
+        durs_us if net.rtt_buckets else None)
+    print(f"Selected {len(dataset)} windows from {sum(map(len, pkts_all))} "
+          "packets.")
+    print("Fitting imputation values and scaling parameters...")
+    prms_in, prms_imp = dataset.fit(args["standardize"])
+    bad_fets = [
+        fet for fet, prm in zip(dataset.fets, prms_imp) if np.isnan(prm)]
+    assert not bad_fets, f"Features contain only \"-1\": {bad_fets}"
+    return dataset, prms_in, prms_imp
+
+
+def make_sequence_dataset(net, args):
+    """
+    Like make_datasets(), but for recurrent models. Returns a
+    utils.SequenceDataset that preserves the order of each simulation's
+    packets and divides them into chunks of args["seq_len"] packets. Also
+    returns the scaling parameters and the imputation values.
+    """
+    dat_all = map_sims(process_sim_seq, net, args)
+    _, pkts_all, dat_out_all = zip(*dat_all)
+    dataset = utils.SequenceDataset(
+        net.in_spc, pkts_all, dat_out_all, args["seq_len"])
+    print(f"Found {dataset.dat_in.shape[0]} packets.")
+    # Impute and scale the packets in place. Each feature is part of its own
+    # scaling group.
+    prms_imp = scaling.fit_impute(dataset.dat_in)
+    bad_fets = [fet for fet, prm in zip(net.in_spc, prms_imp) if np.isnan(prm)]
+    assert not bad_fets, f"Features contain only \"-1\": {bad_fets}"
+    scaling.impute(dataset.dat_in, prms_imp)
+    prms_in = scaling.fit(
+        dataset.dat_in, list(range(len(net.in_spc))), args["standardize"])
+    scaling.transform(dataset.dat_in, prms_in, args["standardize"])
+    return dataset, prms_in, prms_imp
+
+
+def map_sims(fnc, net, args):
+    """
+    Finds the simulations to parse (see find_sims()) and calls
+    fnc(idx, total, net, sim_flp, warmup_prc, keep_prc) for each of them,
+    in parallel unless args["sync"] is True. Returns the results of the
+    simulations that are valid, i.e., for which fnc() does not return None.
+    """
+    sims = find_sims(args)
+    tot_sims = len(sims)
+    sims_args = [
+        (idx, tot_sims, net, sim, args["warmup_percent"],
+         args["keep_percent"])
+        for idx, sim in enumerate(sims)]
+    if defaults.SYNC or args["sync"]:
+        dat_all = [fnc(*sim_args) for sim_args in sims_args]
+    else:
+        with multiprocessing.Pool() as pol:
+            dat_all = pol.starmap(fnc, sims_args)
+    # Throw away results from simulations that could not be parsed.
+    dat_all = [dat for dat in dat_all if dat is not None]
+    print(f"Discarded {tot_sims - len(dat_all)} simulations!")
+    assert dat_all, "No valid simulations found!"
+    return dat_all
+
+
+def save_prms(scl_prms_flp, scl_prms, imp_prms):
+    """
+    Saves the scaling parameters and, alongside them, the imputation values.
+    """
+    print(f"Saving scaling parameters: {scl_prms_flp}")
+    with open(scl_prms_flp, "w") as fil:
+        json.dump(scl_prms.tolist(), fil)
+    utils.save_impute_prms(utils.get_impute_prms_flp(scl_prms_flp), imp_prms)
 
 
 def gen_data(net, args, dat_flp, scl_prms_flp, dat=None, save_data=True):
-    """ Generates training data and optionally saves it. """
-    dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws, scl_prms = (
-        make_datasets(net, args, dat))
+    """
+    Generates training data and optionally saves it. Also saves the scaling
+    parameters and, alongside them, the imputation values.
+    """
+    dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws, scl_prms, \
+        imp_prms = make_datasets(net, args, dat)
     # Save the processed data so that we do not need to process it again.
     if save_data:
         utils.save(
             dat_flp, dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws)
-    # Save scaling parameters.
-    print(f"Saving scaling parameters: {scl_prms_flp}")
-    with open(scl_prms_flp, "w") as fil:
-        json.dump(scl_prms.tolist(), fil)
+    save_prms(scl_prms_flp, scl_prms, imp_prms)
     return dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws
 
 
 def split_data(net, dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws,
-               bch_trn, bch_tst, use_val=False):
+               bch_trn, bch_tst, use_val=False, num_workers=0,
+               pin_memory=False):
     """
     Divides the input and output data into training, validation, and
-    testing sets and constructs data loaders.
+    testing sets and constructs data loaders. See utils.batch_loader() for
+    num_workers and pin_memory.
     """
     print("Creating train/val/test data...")
     #assert len(dat_out.shape) == 1
@@ -376,68 +595,133 @@ def split_data(net, dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws,
     #assert len(num_flws.shape) == 1
 
     fets = dat_in.dtype.names
-    # Destroy columns names to make merging the matrices easier. I.e.,
-    # convert from structured to regular numpy arrays.
-    dat_in = utils.clean(dat_in)
-    dat_out = utils.clean(dat_out)
-    dat_out_raw = utils.clean(dat_out_raw)
-    dat_out_oracle = utils.clean(dat_out_oracle)
-    num_flws = utils.clean(num_flws)
+    # Destroy columns names, i.e., convert from structured to regular numpy
+    # arrays. Avoid copying the input data if possible.
+    dat_in_2d = utils.unstructured_view(dat_in)
+    return split_dataset(
+        net,
+        utils.Dataset(
+            fets, utils.clean(dat_in) if dat_in_2d is None else dat_in_2d,
+            utils.clean(dat_out), utils.clean(dat_out_raw),
+            utils.clean(dat_out_oracle), utils.clean(num_flws)),
+        bch_trn, bch_tst, use_val, num_workers, pin_memory)
+
+
+def split_dataset(net, dat_all, bch_trn, bch_tst, use_val=False,
+                  num_workers=0, pin_memory=False):
+    """
+    Divides a utils.Dataset, utils.LazyWindowDataset, or utils.SequenceDataset
+    into training, validation, and testing sets and constructs data loaders.
+    See split_data(). A utils.SequenceDataset is divided by simulation, and
+    bch_trn and bch_tst are the number of simulations in each batch.
+    """
     # Shuffle the data to ensure that the training, validation, and
-    # test sets are uniformly sampled. To shuffle all of the arrays
-    # together, we must first merge them into a combined matrix.
-    num_cols_in = dat_in.shape[1]
-    merged = np.concatenate(
-        (dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws), axis=1)
-    np.random.shuffle(merged)
-    dat_in = merged[:, :num_cols_in]
-    dat_out = merged[:, num_cols_in]
-    dat_out_raw = merged[:, num_cols_in + 1]
-    dat_out_oracle = merged[:, num_cols_in + 2]
-    num_flws = merged[:, num_cols_in + 3]
+    # test sets are uniformly sampled. Instead of shuffling the data
+    # itself, shuffle the row indices. Each set is a view of dat_all that
+    # selects a range of the shuffled indices.
+    num_exps = len(dat_all)
+    prm = np.random.permutation(num_exps)
 
     # 50% for training, 20% for validation, 30% for testing.
-    num_exps = dat_in.shape[0]
     num_val = int(round(num_exps * 0.2)) if use_val else 0
     num_tst = int(round(num_exps * 0.3))
     print((f"    Data - train: {num_exps - num_val - num_tst}, val: {num_val}, "
            f"test: {num_tst}"))
     # Validation.
-    dat_val_in = dat_in[:num_val]
-    dat_val_out = dat_out[:num_val]
+    dataset_val = dat_all.subset(prm[:num_val])
     # Testing.
-    dat_tst_in = dat_in[num_val:num_val + num_tst]
-    dat_tst_out = dat_out[num_val:num_val + num_tst]
-    dat_tst_out_raw = dat_out_raw[num_val:num_val + num_tst]
-    dat_tst_out_oracle = dat_out_oracle[num_val:num_val + num_tst]
-    num_flws_tst = num_flws[num_val:num_val + num_tst]
+    dataset_tst = dat_all.subset(prm[num_val:num_val + num_tst])
     # Training.
-    dat_trn_in = dat_in[num_val + num_tst:]
-    dat_trn_out = dat_out[num_val + num_tst:]
-
-    # Create the dataloaders.
-    dataset_trn = utils.Dataset(fets, dat_trn_in, dat_trn_out)
-    ldr_trn = (
-        torch.utils.data.DataLoader(
-            dataset_trn, batch_size=bch_tst, shuffle=True, drop_last=False)
+    dataset_trn = dat_all.subset(prm[num_val + num_tst:])
+
+    # Create the dataloaders. Each loads whole batches at once.
+    def make_ldr(dataset, sampler):
+        """ Constructs a data loader. """
+        return utils.batch_loader(dataset, sampler, num_workers, pin_memory)
+
+    def make_tst_sampler(dataset):
+        """ Constructs a sampler for validation or testing. """
+        return (
+            utils.SequenceSampler(dataset, bch_tst, shuffle=False)
+            if isinstance(dataset, utils.SequenceDataset)
+            else torch.utils.data.BatchSampler(
+                torch.utils.data.SequentialSampler(dataset), bch_tst,
+                drop_last=False))
+
+    ldr_trn = make_ldr(
+        dataset_trn,
+        utils.SequenceSampler(dataset_trn, bch_trn, shuffle=True)
+        if isinstance(dataset_trn, utils.SequenceDataset)
+        else torch.utils.data.BatchSampler(
+            torch.utils.data.RandomSampler(dataset_trn), bch_tst,
+            drop_last=False)
         if isinstance(net, models.SvmSklearnWrapper)
-        else torch.utils.data.DataLoader(
-            dataset_trn,
-            batch_sampler=utils.BalancedSampler(
-                dataset_trn, bch_trn, drop_last=False)))
+        else utils.BalancedSampler(dataset_trn, bch_trn, drop_last=False))
     ldr_val = (
-        torch.utils.data.DataLoader(
-            utils.Dataset(fets, dat_val_in, dat_val_out), batch_size=bch_tst,
-            shuffle=False, drop_last=False)
+        make_ldr(dataset_val, make_tst_sampler(dataset_val))
         if use_val else None)
-    ldr_tst = torch.utils.data.DataLoader(
-        utils.Dataset(
-            fets, dat_tst_in, dat_tst_out, dat_tst_out_raw, dat_tst_out_oracle,
-            num_flws_tst),
-        batch_size=bch_tst, shuffle=False, drop_last=False)
+    ldr_tst = make_ldr(dataset_tst, make_tst_sampler(dataset_tst))
     return ldr_trn, ldr_val, ldr_tst
 
 
+def check_split_model(net):
+    """
+    Verifies that net supports training from split files (see load_splits()).
+    """
+    assert (isinstance(net, models.BinaryModelWrapper) and
+            not isinstance(net, models.SvmSklearnWrapper) and
+            not net.rtt_buckets and not net.windows), \
+        ("Training from split files (\"split-dir\") supports only PyTorch "
+         f"models that use one packet per example, not: {net.name}")
+
+
+def load_splits(net, args, use_val=False, pin_memory=False):
+    """
+    Constructs data loaders for the training, validation, and test split files
+    that prepare_data.py created in args["split_dir"]. The split files are read
+    from disk in chunks as they are needed, so they need not fit in memory.
+    Also saves the scaling parameters and imputation values of the input
+    features in args["out_dir"], in the same format as gen_data(). Batches
+    are loaded by args["num_workers"] worker processes, if any (see
+    utils.batch_loader()).
+    """
+    check_split_model(net)
+    print("Loading split files...")
+    split_dir = args["split_dir"]
+    fets = list(args["features"])
+    assert len(net.out_spc) == 1, f"Expecting one output feature: {net.out_spc}"
+    # prepare_data.py stores the statistics of each column of the training
+    # split. Select those of the input features, and derive the scaling
+    # parameters of the model's scaling groups from them.
+    stats, split_standardize = utils.load_split_stats(split_dir)
+    assert split_standardize == args["standardize"], \
+        (f"The split files in {split_dir} were prepared with standardize="
+         f"{split_standardize}, but training uses standardize="
+         f"{args['standardize']}.")
+    names = utils.load_split_dtype(split_dir).names
+    stats = stats.select([names.index(fet) for fet in fets])
+    scl_prms = stats.params(net.get_scl_grps(fets), args["standardize"])
+    imp_prms = stats.impute_params()
+    bad_fets = [fet for fet, prm in zip(fets, imp_prms) if np.isnan(prm)]
+    assert not bad_fets, f"Features contain only \"-1\": {bad_fets}"
+    save_prms(
+        path.join(args["out_dir"], "scale_params.json"), scl_prms, imp_prms)
+
+    def make_ldr(name, bch, shuffle):
+        """ Constructs a data loader for one split. """
+        dataset = utils.MemmapDataset(
+            split_dir, name, fets, net.out_spc[0], net.convert_to_class,
+            scl_prms, imp_prms, args["standardize"])
+        return utils.batch_loader(
+            dataset, utils.ChunkSampler(len(dataset), bch, shuffle),
+            args["num_workers"], pin_memory)
+
+    return (make_ldr("train", args["train_batch"], shuffle=True),
+            make_ldr("val", args["test_batch"], shuffle=False)
+            if use_val else None,
+            make_ldr("test", args["test_batch"], shuffle=False))
+
+
 def init_hidden(net, bch, dev):
     """
     Initialize the hidden state. The hidden state is what gets built
@@ -451,6 +735,30 @@ def init_hidden(net, bch, dev):
     return hidden
 
 
+def next_hidden(net, hidden, ins, first, dev):
+    """
+    Returns the hidden state to use for a batch. first is empty, or contains
+    whether the batch is the first chunk of its sequences (see
+    utils.SequenceDataset). For later chunks, the hidden state is carried over
+    from the previous chunk, but gradients do not flow into the previous chunk
+    (i.e., truncated backpropagation through time). Otherwise, the hidden state
+    is initialized.
+    """
+    if first and not first[0]:
+        return tuple(hid.detach() for hid in hidden)
+    return init_hidden(net, bch=ins.size()[0], dev=dev)
+
+
+def is_lstm(net_raw):
+    """
+    Returns whether net_raw is a models.Lstm, including one that has been
+    compiled to Torch Script.
+    """
+    return isinstance(net_raw, models.Lstm) or (
+        isinstance(net_raw, torch.jit.ScriptModule) and
+        net_raw.original_name == models.Lstm.__name__)
+
+
 def inference(ins, labs, net_raw, dev,
               hidden=(torch.zeros(()), torch.zeros(())), los_fnc=None):
     """
@@ -461,7 +769,7 @@ def inference(ins, labs, net_raw, dev,
     ins = ins.to(dev)
     labs = labs.to(dev)
 
-    if isinstance(net_raw, models.Lstm):
+    if is_lstm(net_raw):
         # LSTMs want the sequence length to be first and the batch
         # size to be second, so we need to flip the first and
         # second dimensions:
@@ -470,7 +778,7 @@ def inference(ins, labs, net_raw, dev,
         ins = ins.transpose(0, 1)
         # Reduce the labels to a 1D tensor.
         # TODO: Explain this better.
-        labs = labs.transpose(0, 1).view(-1)
+        labs = labs.transpose(0, 1).reshape(-1)
         # The forward pass.
         out, hidden = net_raw(ins, hidden)
     else:
@@ -520,15 +828,17 @@ def train(net, num_epochs, ldr_trn, ldr_val, dev, ely_stp, val_pat_max, out_flp,
                    f"({tim_del_s:.2f} seconds)."))
             break
 
+        # The hidden state carried over from the previous batch.
+        hidden = None
         # For each batch...
-        for bch_idx_trn, (ins, labs) in enumerate(ldr_trn, 0):
+        for bch_idx_trn, (ins, labs, *first) in enumerate(ldr_trn, 0):
             if bch_idx_trn % bchs_per_log == 0:
                 print(f"Epoch: {epoch_idx + 1:{f'0{len(str(num_epochs))}'}}/"
                       f"{'?' if ely_stp else num_epochs}, batch: "
                       f"{bch_idx_trn + 1:{f'0{len(str(num_bchs_trn))}'}}/"
                       f"{num_bchs_trn}", end=" ")
             # Initialize the hidden state for every new sequence.
-            hidden = init_hidden(net, bch=ins.size()[0], dev=dev)
+            hidden = next_hidden(net, hidden, ins, first, dev)
             # Zero out the parameter gradients.
             opt.zero_grad()
             loss, hidden = inference(ins, labs, net.net, dev, hidden, los_fnc)
@@ -546,15 +856,19 @@ def train(net, num_epochs, ldr_trn, ldr_val, dev, ely_stp, val_pat_max, out_flp,
                 net.net.eval()
                 with torch.no_grad():
                     los_val = 0
-                    for bch_idx_val, (ins_val, labs_val) in enumerate(ldr_val):
+                    hidden_val = None
+                    for bch_idx_val, (ins_val, labs_val, *first_val) in (
+                            enumerate(ldr_val)):
                         print(
                             "    Validation batch: "
                             f"{bch_idx_val + 1}/{len(ldr_val)}")
                         # Initialize the hidden state for every new sequence.
-                        hidden = init_hidden(net, bch=ins.size()[0], dev=dev)
-                        los_val += inference(
-                            ins_val, labs_val, net.net, dev, hidden,
-                            los_fnc)[0].item()
+                        hidden_val = next_hidden(
+                            net, hidden_val, ins_val, first_val, dev)
+                        los_val_bch, hidden_val = inference(
+                            ins_val, labs_val, net.net, dev, hidden_val,
+                            los_fnc)
+                        los_val += los_val_bch.item()
                 # Convert the model back to training mode.
                 net.net.train()
 
@@ -602,22 +916,20 @@ def test(net, ldr_tst, dev):
     num_bchs_tst = len(ldr_tst)
     # For efficiency, convert the model to evaluation mode.
     net.net.eval()
+    hidden = None
     with torch.no_grad():
-        for bch_idx, (ins, labs) in enumerate(ldr_tst):
+        for bch_idx, (ins, labs, *first) in enumerate(ldr_tst):
             print(f"Test batch: {bch_idx + 1:{f'0{len(str(num_bchs_tst))}'}}/"
                   f"{num_bchs_tst}")
-            if isinstance(net, models.LstmWrapper):
-                bch_tst, seq_len, _ = ins.size()
-            else:
-                bch_tst, _ = ins.size()
-                seq_len = 1
             # Initialize the hidden state for every new sequence.
-            hidden = init_hidden(net, bch=bch_tst, dev=dev)
+            hidden = next_hidden(net, hidden, ins, first, dev)
             # Run inference. The first element of the output is the
             # number of correct predictions.
-            num_correct += inference(
-                ins, labs, net.net, dev, hidden, los_fnc=net.check_output)[0]
-            total += bch_tst * seq_len
+            num_correct_bch, hidden = inference(
+                ins, labs, net.net, dev, hidden, los_fnc=net.check_output)
+            num_correct += num_correct_bch
+            # Do not count padding (see utils.SequenceDataset).
+            total += (labs != utils.SEQ_PAD_LABEL).sum().item()
     # Convert the model back to training mode.
     net.net.train()
     acc_tst = num_correct / total
@@ -671,6 +983,9 @@ def run_torch(args, dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws,
     """
     # Instantiate and configure the network. Move it to the proper device.
     net = models.MODELS[args["model"]]()
+    if isinstance(net, models.LstmWrapper):
+        # The LSTM's input dimension depends on the features.
+        net.in_spc = args["features"]
     net.new()
     num_gpus = torch.cuda.device_count()
     num_gpus_to_use = args["num_gpus"]
@@ -679,17 +994,37 @@ def run_torch(args, dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws,
     dev = torch.device("cuda:0" if num_gpus >= num_gpus_to_use > 0 else "cpu")
     net.net.to(dev)
 
-    # Split the data into training, validation, and test loaders.
-    ldr_trn, ldr_val, ldr_tst = split_data(
-        net, dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws,
-        args["train_batch"], args["test_batch"])
+    # Split the data into training, validation, and test loaders, or read
+    # them from split files. When using worker processes, prefetch batches
+    # into pinned memory, from which they can be copied to a GPU faster.
+    num_workers = args["num_workers"]
+    pin_memory = num_workers > 0 and dev.type == "cuda"
+    if args["split_dir"] is not None:
+        ldr_trn, ldr_val, ldr_tst = load_splits(
+            net, args, use_val=args["early_stop"], pin_memory=pin_memory)
+    elif args["lazy_windows"] or isinstance(net, models.LstmWrapper):
+        dataset, scl_prms, imp_prms = (
+            make_sequence_dataset if isinstance(net, models.LstmWrapper)
+            else make_lazy_dataset)(net, args)
+        save_prms(
+            path.join(out_dir, "scale_params.json"), scl_prms, imp_prms)
+        ldr_trn, ldr_val, ldr_tst = split_dataset(
+            net, dataset, args["train_batch"], args["test_batch"],
+            use_val=args["early_stop"], num_workers=num_workers,
+            pin_memory=pin_memory)
+    else:
+        ldr_trn, ldr_val, ldr_tst = split_data(
+            net, dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws,
+            args["train_batch"], args["test_batch"], num_workers=num_workers,
+            pin_memory=pin_memory)
 
     # Explicitly move the training (and maybe validation) data to the target
-    # device.
-    ldr_trn.dataset.to(dev)
+    # device. Worker processes load batches in main memory instead.
     ely_stp = args["early_stop"]
-    if ely_stp:
-        ldr_val.dataset.to(dev)
+    if not num_workers:
+        ldr_trn.dataset.to(dev)
+        if ely_stp:
+            ldr_val.dataset.to(dev)
 
     # Training.
     tim_srt_s = time.time()
@@ -713,7 +1048,8 @@ def run_torch(args, dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws,
     net.net.to(dev)
 
     # Testing.
-    ldr_tst.dataset.to(dev)
+    if not num_workers:
+        ldr_tst.dataset.to(dev)
     tim_srt_s = time.time()
     acc_tst = test(net, ldr_tst, dev)
     print(f"Finished testing - time: {time.time() - tim_srt_s:.2f} seconds")
@@ -751,6 +1087,12 @@ def run_trials(args):
     # Verify that the necessary supplemental parameters are present.
     for param in net_tmp.params:
         assert param in args, f"\"{param}\" not in args: {args}"
+    # Verify that the model supports the requested data loading mode before
+    # doing any work. The sklearn models need all of the data up front.
+    if args["split_dir"] is not None:
+        check_split_model(net_tmp)
+    if args["lazy_windows"]:
+        check_lazy_model(net_tmp)
     # Assemble the output filepath.
     out_flp = path.join(
         args["out_dir"],
@@ -775,11 +1117,22 @@ def run_trials(args):
     # Load or geenrate training data.
     dat_flp = path.join(out_dir, "data.npz")
     scl_prms_flp = path.join(out_dir, "scale_params.json")
-    # Check for the presence of both the data and the scaling
-    # parameters because the resulting model is useless without the
-    # proper scaling parameters.
-    if (not args["regen_data"] and path.exists(dat_flp) and
-            path.exists(scl_prms_flp)):
+    # Check for the presence of the data, the scaling parameters, and the
+    # imputation values because the resulting model is useless without the
+    # proper scaling parameters and imputation values.
+    if args["split_dir"] is not None:
+        # The training data is read from the split files by run_torch().
+        print(f"Training from split files: {args['split_dir']}")
+        dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws = (
+            None, None, None, None, None)
+    elif args["lazy_windows"] or isinstance(net_tmp, models.LstmWrapper):
+        # run_torch() creates the windows lazily or creates the sequences.
+        print("Generating data during training...")
+        dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws = (
+            None, None, None, None, None)
+    elif (not args["regen_data"] and path.exists(dat_flp) and
+            path.exists(scl_prms_flp) and
+            path.exists(utils.get_impute_prms_flp(scl_prms_flp))):
         print("Found existing data!")
         dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws = utils.load(
             dat_flp)
@@ -791,10 +1144,10 @@ def run_trials(args):
         print("Regenerating data...")
         dat_in, dat_out, dat_out_raw, dat_out_oracle, num_flws = (
             gen_data(net_tmp, args, dat_flp, scl_prms_flp))
-    print(f"Number of input features: {len(dat_in.dtype.names)}")
-
-    # Visualaize the ground truth data.
-    utils.visualize_classes(net_tmp, dat_out)
+    if dat_in is not None:
+        print(f"Number of input features: {len(dat_in.dtype.names)}")
+        # Visualaize the ground truth data.
+        utils.visualize_classes(net_tmp, dat_out)
 
     # TODO: Parallelize attempts.
     trls = args["conf_trials"]
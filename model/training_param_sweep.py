@@ -391,6 +391,9 @@ def main():
         for (dat_src, dat_dst), (scl_prms_src, scl_prms_dst)  in src_dst:
             shutil.copyfile(dat_src, dat_dst)
             shutil.copyfile(scl_prms_src, scl_prms_dst)
+            shutil.copyfile(
+                utils.get_impute_prms_flp(scl_prms_src),
+                utils.get_impute_prms_flp(scl_prms_dst))
 
         # Remove temporary data files.
         for num_sims, prc in itertools.product(NUMS_SIMS, all_prcs):
@@ -1,9 +1,12 @@
 """ Utility functions. """
 
+import copy
+import json
 import math
 import os
 from os import path
 import random
+import types
 import zipfile
 
 import numpy as np
@@ -13,21 +16,77 @@ import scapy.layers.inet
 import scapy.layers.ppp
 import torch
 
+import scaling
+
 
 # Arguments to ignore when converting an arguments dictionary to a
 # string.
-ARGS_TO_IGNORE = ["data_dir", "out_dir", "tmp_dir", "sims", "features"]
+ARGS_TO_IGNORE = [
+    "data_dir", "out_dir", "tmp_dir", "sims", "features", "split_dir",
+    "num_workers", "lazy_windows", "seq_len"]
 # The random seed.
 SEED = 1337
 # Name to use for lock files.
 LOCK_FLN = "lock"
+# Name of the file that stores the imputation values of the input features.
+# It is stored alongside the scaling parameters.
+IMPUTE_PRMS_FLN = "impute_params.json"
+# The number of rows to decompress at once when loading selected columns from
+# a simulation file.
+LOAD_CHUNK_ROWS = 4096
+# The maximum size of the header of an NPY file (bytes). The results files
+# generated by parse_dumbbell.py store many named columns, so their headers
+# exceed NumPy's default limit.
+NPY_MAX_HEADER_B = 10**6
+# Name of the file that stores the dtype of the training, validation, and test
+# split files created by prepare_data.py.
+SPLIT_DTYPE_FLN = "dtype.json"
+# Name of the file that stores the statistics of the training split created by
+# prepare_data.py (see save_split_stats()).
+SPLIT_STATS_FLN = "stats.npz"
+# The dtype of the files, one for each split, that store the total number of
+# flows in each packet's simulation. 0 denotes an unused row.
+SPLIT_NUM_FLWS_DTYPE = "int32"
+# When training from split files, the number of consecutive rows that are
+# shuffled together. Larger values make batches more random, but make reading
+# them from disk less sequential.
+SPLIT_CHUNK_ROWS = 2**16
+# The number of windows to create at once when fitting the imputation values and
+# scaling parameters of a LazyWindowDataset.
+LAZY_CHUNK_WINS = 2**12
+# The class label of the padding at the end of packet sequences. This is the
+# value that torch.nn.CrossEntropyLoss ignores by default.
+SEQ_PAD_LABEL = -100
+# The number of array elements to process at once when bucketizing windows of
+# packets. See bucketize().
+BUCKETIZE_CHUNK_ELEMS = 2**20
+# Suffix of compact header-only packet traces. See compact_pcap().
+COMPACT_SUFFIX = ".hdr.npy"
+# The format of compact header-only packet traces, with one entry per packet.
+HDR_DTYPE = [
+    ("seq", "uint32"),
+    # Source IP address.
+    ("src", "uint8", (4,)),
+    ("time_us", "int64"),
+    # TCP timestamp option.
+    ("tsval", "uint32"),
+    ("tsecr", "uint32"),
+    # The packet's original length on the wire.
+    ("wirelen", "uint32")
+]
 
 
 class Dataset(torch.utils.data.Dataset):
-    """ A simple Dataset that wraps arrays of input and output features. """
+    """
+    A simple Dataset that wraps arrays of input and output features.
+    __getitem__() accepts either a single index or a sequence of indices, in
+    which case it returns a whole batch using a single indexing operation. To
+    use the latter, pass a BatchSampler as a DataLoader's sampler and set its
+    batch_size to None (see batch_loader()).
+    """
 
     def __init__(self, fets, dat_in, dat_out, dat_out_raw=None,
-                 dat_out_oracle=None, num_flws=None):
+                 dat_out_oracle=None, num_flws=None, idxs=None):
         """
         fets: List of input feature names, corresponding to the columns of
             dat_in.
@@ -40,6 +99,13 @@ class Dataset(torch.utils.data.Dataset):
             shape as dat_out.
         num_flws: Numpy array of the total number of flows in each datapoint's
             experiment. Same shape as dat_out.
+        idxs: Optional 1D array of row indices. If specified, then this Dataset
+            contains only these rows, in this order. The other arrays are not
+            copied, so many Datasets can share the same backing arrays (see
+            subset()).
+
+        The arrays may also be Torch tensors, in which case they are not copied
+        if they already have the proper dtype.
         """
         super(Dataset).__init__()
         shp_in = dat_in.shape
@@ -51,28 +117,61 @@ class Dataset(torch.utils.data.Dataset):
             f"Mismatched dat_in ({shp_in}) and fets (len: {num_fets})"
 
         # Convert the numpy arrays to Torch tensors.
-        self.dat_in = torch.tensor(dat_in, dtype=torch.float)
+        self.dat_in = torch.as_tensor(dat_in, dtype=torch.float)
         # Reshape the output into a 1D array first, because
         # CrossEntropyLoss expects a single value. The dtype must be
         # long because the loss functions expect longs.
-        self.dat_out = torch.tensor(
+        self.dat_out = torch.as_tensor(
             dat_out.reshape(shp_out[0]), dtype=torch.long)
 
         self.fets = fets
         self.dat_out_raw = (
             None if dat_out_raw is None
-            else torch.tensor(
+            else torch.as_tensor(
                 dat_out_raw.reshape(shp_out[0]), dtype=torch.float))
         self.dat_out_oracle = (
             None if dat_out_oracle is None
-            else torch.tensor(
+            else torch.as_tensor(
                 dat_out_oracle.reshape(shp_out[0]), dtype=torch.int))
         self.num_flws = (
             None if num_flws is None
-            else torch.tensor(num_flws.reshape(shp_out[0]), dtype=torch.int))
+            else torch.as_tensor(
+                num_flws.reshape(shp_out[0]), dtype=torch.int))
+        self.idxs = (
+            None if idxs is None else torch.as_tensor(idxs, dtype=torch.long))
+
+    def subset(self, idxs):
+        """
+        Returns a new Dataset that contains the specified rows of this Dataset
+        and shares its backing arrays.
+        """
+        idxs = torch.as_tensor(idxs, dtype=torch.long)
+        return Dataset(
+            self.fets, self.dat_in, self.dat_out, self.dat_out_raw,
+            self.dat_out_oracle, self.num_flws,
+            idxs=(idxs if self.idxs is None else self.idxs[idxs]))
+
+    def __materialize(self):
+        """
+        Replaces the backing arrays with copies of only this Dataset's rows, so
+        that this Dataset no longer shares memory with other Datasets.
+        """
+        if self.idxs is None:
+            return
+        self.dat_in, self.dat_out, self.dat_out_raw, self.dat_out_oracle, \
+            self.num_flws = self.__gather()
+        self.idxs = None
+
+    def __gather(self):
+        """ Returns this Dataset's rows of each backing array. """
+        return tuple(
+            dat if dat is None or self.idxs is None else dat[self.idxs]
+            for dat in [self.dat_in, self.dat_out, self.dat_out_raw,
+                        self.dat_out_oracle, self.num_flws])
 
     def to(self, dev):
         """ Move the entire dataset to the target device. """
+        self.__materialize()
         try:
             # This will fail if there is insufficient memory.
             self.dat_in = self.dat_in.to(dev)
@@ -84,61 +183,545 @@ class Dataset(torch.utils.data.Dataset):
             # the input data back to main memory.
             self.dat_in = self.dat_in.to(torch.device("cpu"))
 
+    def labels(self):
+        """ Returns the output data (i.e., class labels) of this Dataset. """
+        return self.dat_out if self.idxs is None else self.dat_out[self.idxs]
+
+    def share_memory(self):
+        """
+        Moves the backing arrays to shared memory, so that DataLoader workers
+        can read them without receiving copies. Datasets created by subset()
+        share the backing arrays, so this applies to them as well.
+        """
+        for dat in [self.dat_in, self.dat_out, self.dat_out_raw,
+                    self.dat_out_oracle, self.num_flws, self.idxs]:
+            if dat is not None:
+                dat.share_memory_()
+
     def __len__(self):
         """ Returns the number of items in this Dataset. """
-        return len(self.dat_in)
+        return len(self.dat_in if self.idxs is None else self.idxs)
 
     def __getitem__(self, idx):
-        """ Returns a specific (input, output) pair from this Dataset. """
-        assert torch.utils.data.get_worker_info() is None, \
-            "This Dataset does not support being loaded by multiple workers!"
+        """
+        Returns a specific (input, output) pair from this Dataset, or a batch
+        of pairs if idx is a sequence of indices.
+        """
+        if self.idxs is not None:
+            idx = self.idxs[idx]
         return self.dat_in[idx], self.dat_out[idx]
 
     def raw(self):
-        """ Returns the raw data underlying this dataset. """
-        return (self.fets, self.dat_in, self.dat_out, self.dat_out_raw,
-                self.dat_out_oracle, self.num_flws)
+        """
+        Returns the raw data underlying this dataset. If this Dataset contains
+        a subset of its backing arrays, then only that subset is returned.
+        """
+        return (self.fets, *self.__gather())
+
+
+class MemmapDataset(torch.utils.data.Dataset):
+    """
+    A Dataset that reads one of the training, validation, or test split files
+    created by prepare_data.py, without loading it into memory. Items are whole
+    batches: __getitem__() accepts an array of indices and reads, imputes, and
+    scales those rows together. Use with ChunkSampler and a DataLoader whose
+    batch_size is None.
+    """
+
+    def __init__(self, split_dir, name, fets, fet_out, convert_to_class,
+                 scl_prms, imp_prms, standardize):
+        """
+        split_dir: The directory containing the split files.
+        name: The name of the split (e.g., "train").
+        fets: List of input feature names.
+        fet_out: The name of the output feature.
+        convert_to_class: Function that converts output features to class
+            labels (see models.PytorchModelWrapper.convert_to_class()).
+        scl_prms: The scaling parameters of the input features, in the same
+            order as fets (see scaling.fit()).
+        imp_prms: The imputation values of the input features, in the same
+            order as fets (see scaling.fit_impute()).
+        standardize: Whether scl_prms are for standardization.
+        """
+        super(MemmapDataset).__init__()
+        self.split_dir = split_dir
+        self.name = name
+        self.dat, self.num_flws = load_split(split_dir, name)
+        names = self.dat.dtype.names
+        for fet in fets + [fet_out]:
+            assert fet in names, \
+                f"Feature \"{fet}\" not in split \"{name}\": {split_dir}"
+        self.fets = fets
+        self.fet_out = fet_out
+        self.convert_to_class = convert_to_class
+        self.scl_prms = np.asarray(scl_prms, dtype=float)
+        self.imp_prms = np.asarray(imp_prms, dtype=float)
+        self.standardize = standardize
+        # The split files may contain unused rows. Find the used rows.
+        self.idxs = np.concatenate(
+            [start_idx + np.flatnonzero(
+                self.num_flws[start_idx:start_idx + SPLIT_CHUNK_ROWS])
+             for start_idx in range(0, self.num_flws.shape[0],
+                                    SPLIT_CHUNK_ROWS)] +
+            [np.empty((0,), dtype=int)])
+        print(f"Split \"{name}\" has {len(self.idxs)} rows: {split_dir}")
+
+    def __getstate__(self):
+        """
+        Do not pickle the memory-mapped split files, which would copy their
+        contents. DataLoader workers reopen them instead (see __setstate__()).
+        """
+        state = self.__dict__.copy()
+        del state["dat"]
+        del state["num_flws"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.dat, self.num_flws = load_split(self.split_dir, self.name)
+
+    def to(self, dev):
+        """
+        Does nothing. The data remains on disk, and each batch is moved to the
+        target device when it is used.
+        """
+
+    def __len__(self):
+        """ Returns the number of items in this Dataset. """
+        return len(self.idxs)
+
+    def __getitem__(self, idxs):
+        """
+        Returns the (input, output) pair for the specified indices, as tensors
+        whose first dimension is the index.
+        """
+        idxs = self.idxs[idxs]
+        dat = self.dat[idxs]
+        dat_in = np.empty((len(idxs), len(self.fets)), dtype=float)
+        for col, fet in enumerate(self.fets):
+            dat_in[:, col] = dat[fet]
+        scaling.impute(dat_in, self.imp_prms)
+        scaling.transform(dat_in, self.scl_prms, self.standardize)
+
+        # Convert the output feature to classes separately for each number of
+        # flows, since that determines the fair share.
+        dat_out = as_structured(
+            dat[self.fet_out].astype(float).reshape((len(idxs), 1)),
+            [self.fet_out])
+        num_flws = self.num_flws[idxs]
+        dat_out_clss = np.empty((len(idxs),), dtype=int)
+        for num_flws_cur in np.unique(num_flws):
+            msk = num_flws == num_flws_cur
+            # convert_to_class() uses only the total number of flows.
+            dat_out_clss[msk] = self.convert_to_class(
+                types.SimpleNamespace(
+                    unfair_flws=int(num_flws_cur), fair_flws=0),
+                dat_out[msk])["class"]
+        return (torch.tensor(dat_in, dtype=torch.float),
+                torch.tensor(dat_out_clss, dtype=torch.long))
+
+
+class ChunkSampler:
+    """
+    Yields batches of indices into a MemmapDataset. Divides the dataset into
+    chunks of consecutive rows. If shuffle is True, then shuffles the order of
+    the chunks and the order of the rows within each chunk, so that each batch
+    is drawn from only a few chunks and can be read from disk efficiently. This
+    assumes that the rows have already been shuffled, as prepare_data.py does
+    for the training split. The indices in each batch are sorted.
+    """
+
+    def __init__(self, num_rows, batch_size, shuffle=True,
+                 chunk_rows=SPLIT_CHUNK_ROWS):
+        self.num_rows = num_rows
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.chunk_rows = chunk_rows
+
+    def __iter__(self):
+        if self.shuffle:
+            order = np.concatenate(
+                [start_idx + np.random.permutation(
+                    min(self.chunk_rows, self.num_rows - start_idx))
+                 for start_idx in np.random.permutation(
+                     range(0, self.num_rows, self.chunk_rows))] +
+                [np.empty((0,), dtype=int)])
+        else:
+            order = np.arange(self.num_rows)
+        for start_idx in range(0, self.num_rows, self.batch_size):
+            yield np.sort(order[start_idx:start_idx + self.batch_size])
+
+    def __len__(self):
+        return math.ceil(self.num_rows / self.batch_size)
+
+
+class LazyWindowDataset(torch.utils.data.Dataset):
+    """
+    A Dataset of windows of packets (see models.BinaryModelWrapper) that
+    creates each window only when it is used. Stores the packets of every
+    simulation and the index of the last packet of each window, so memory
+    scales with the number of packets instead of with the number of windows
+    times the size of each window. Items are whole batches: __getitem__()
+    accepts an array of indices and creates, imputes, and scales those windows
+    together. Use with a BatchSampler or BalancedSampler and a DataLoader
+    whose batch_size is None (see batch_loader()).
+    """
+
+    def __init__(self, fets, pkts_all, end_idxs_all, dat_out_all, win,
+                 durs_us=None):
+        """
+        fets: List of the names of the per-packet input features.
+        pkts_all: List of 2D float arrays, one for each simulation, containing
+            the values of the features in fets for each packet.
+        end_idxs_all: List of 1D arrays, one for each simulation, containing
+            the index of the last packet in each window.
+        dat_out_all: List of 1D arrays, one for each simulation, containing the
+            class label of each window.
+        win: The number of packets in each window or, if durs_us is not None,
+            the number of arrival time buckets in each window.
+        durs_us: If not None, then the windows are bucketized (see
+            bucketize()). A list containing the duration of the windows of
+            each simulation (us). fets must include "arrival time us".
+        """
+        super(LazyWindowDataset).__init__()
+        self.win = win
+        self.bucketize = durs_us is not None
+        self.pkt_fets = list(fets)
+        self.fets, self.scl_grps = (
+            bucket_fets(fets, win) if self.bucketize
+            else window_fets(fets, win))
+        # Offset the indices of each simulation's windows by the number of
+        # packets in the preceding simulations.
+        offsets = np.cumsum([0] + [pkts.shape[0] for pkts in pkts_all[:-1]])
+        self.end_idxs = np.concatenate(
+            [offset + np.asarray(end_idxs, dtype=int)
+             for offset, end_idxs in zip(offsets, end_idxs_all)])
+        nums_wins = [len(end_idxs) for end_idxs in end_idxs_all]
+        self.dat_out = np.concatenate(dat_out_all).astype(int)
+        if self.bucketize:
+            arr_col = self.pkt_fets.index("arrival time us")
+            # Shift each simulation's arrival times to begin after the last
+            # arrival time of the previous simulation, so that the arrival
+            # times of all packets are sorted and can be searched at once.
+            # Windows never span simulations, so this does not affect the
+            # buckets.
+            arr_times_all = []
+            prev_us = 0
+            for pkts in pkts_all:
+                arr_times = pkts[:, arr_col]
+                if arr_times.shape[0]:
+                    arr_times = arr_times - arr_times[0] + prev_us + 1
+                    prev_us = arr_times[-1]
+                arr_times_all.append(arr_times)
+            self.arr_times = np.concatenate(arr_times_all)
+            self.durs_us = np.repeat(durs_us, nums_wins)
+            # Only the other features of the last packet in each window are
+            # needed.
+            self.pkts = np.delete(np.concatenate(pkts_all), arr_col, axis=1)
+        else:
+            self.pkts = np.concatenate(pkts_all)
+        self.idxs = np.arange(self.end_idxs.shape[0])
+        self.scl_prms = None
+        self.imp_prms = None
+        self.standardize = False
+
+    def subset(self, idxs):
+        """
+        Returns a new LazyWindowDataset that contains the specified windows of
+        this LazyWindowDataset and shares its packets.
+        """
+        sub = copy.copy(self)
+        sub.idxs = self.idxs[np.asarray(idxs, dtype=int)]
+        return sub
+
+    def windows(self, idxs):
+        """
+        Creates the specified windows, without imputing or scaling them.
+        Returns a 2D float array with one row for each window and one column
+        for each feature in self.fets.
+        """
+        end_idxs = self.end_idxs[self.idxs[idxs]]
+        if not self.bucketize:
+            return windows_view(self.pkts, self.win)[
+                end_idxs - self.win + 1].reshape(
+                    (end_idxs.shape[0], len(self.fets)))
+        dat = np.empty((end_idxs.shape[0], len(self.fets)), dtype=float)
+        durs_us = self.durs_us[self.idxs[idxs]]
+        # Bucketize together all windows with the same duration.
+        for dur_us in np.unique(durs_us):
+            msk = durs_us == dur_us
+            ends = end_idxs[msk]
+            dat[msk, :self.win] = bucketize(
+                self.arr_times, win_start_idxs(self.arr_times, ends, dur_us),
+                ends, dur_us, self.win)
+        dat[:, self.win:] = self.pkts[end_idxs]
+        return dat
+
+    def fit(self, standardize=False):
+        """
+        Computes the imputation values and the scaling parameters of all of
+        the windows, as if they had been created, in the same format as
+        scaling.fit_impute() and scaling.fit(). Creates the windows in chunks.
+        Future batches are imputed and scaled using these parameters. Returns
+        the scaling parameters and the imputation values.
+        """
+        stats = scaling.OnlineStats(len(self.fets), unknown=-1)
+        num_wins = len(self)
+        for start_idx in range(0, num_wins, LAZY_CHUNK_WINS):
+            stats.update(self.windows(np.arange(
+                start_idx, min(start_idx + LAZY_CHUNK_WINS, num_wins))))
+        self.imp_prms = stats.impute_params()
+        self.scl_prms = stats.params(self.scl_grps, standardize)
+        self.standardize = standardize
+        return self.scl_prms, self.imp_prms
+
+    def to(self, dev):
+        """
+        Does nothing. Each batch is created in main memory and moved to the
+        target device when it is used.
+        """
+
+    def labels(self):
+        """ Returns the class labels of this LazyWindowDataset. """
+        return torch.as_tensor(self.dat_out[self.idxs])
+
+    def __len__(self):
+        """ Returns the number of items in this Dataset. """
+        return self.idxs.shape[0]
+
+    def __getitem__(self, idxs):
+        """
+        Returns the (input, output) pair for the specified indices, as tensors
+        whose first dimension is the index.
+        """
+        assert self.scl_prms is not None, \
+            "Call fit() before creating batches."
+        dat_in = self.windows(idxs)
+        scaling.impute(dat_in, self.imp_prms)
+        scaling.transform(dat_in, self.scl_prms, self.standardize)
+        return (torch.tensor(dat_in, dtype=torch.float),
+                torch.tensor(self.dat_out[self.idxs[idxs]], dtype=torch.long))
+
+
+class SequenceDataset(torch.utils.data.Dataset):
+    """
+    A Dataset of the packet sequences of whole simulations, for recurrent
+    models that are trained using truncated backpropagation through time. Each
+    simulation's packets are divided into consecutive chunks of seq_len
+    packets. Items are batches of the same chunk of several simulations:
+    __getitem__() accepts a pair of the form:
+        (array of simulation indices, chunk index)
+    and returns a tuple of the form:
+        (input of shape (number of simulations, seq_len, number of features),
+         labels of shape (number of simulations, seq_len),
+         whether this is the first chunk)
+    Chunks that extend beyond the end of a simulation are padded with zeros
+    and labelled SEQ_PAD_LABEL. A recurrent model should carry its hidden
+    state over from one chunk to the next. Use with SequenceSampler and a
+    DataLoader whose batch_size is None (see batch_loader()).
+    """
+
+    def __init__(self, fets, pkts_all, dat_out_all, seq_len):
+        """
+        fets: List of input feature names.
+        pkts_all: List of 2D float arrays, one for each simulation, containing
+            the values of the features in fets for each packet, in order.
+        dat_out_all: List of 1D arrays, one for each simulation, containing the
+            class label of each packet.
+        seq_len: The number of packets in each chunk.
+        """
+        super(SequenceDataset).__init__()
+        self.fets = fets
+        self.seq_len = seq_len
+        self.lens = np.array([pkts.shape[0] for pkts in pkts_all], dtype=int)
+        self.offsets = np.cumsum(np.concatenate(([0], self.lens[:-1])))
+        self.dat_in = np.concatenate(pkts_all).astype(float)
+        self.dat_out = np.concatenate(dat_out_all).astype(int)
+        # The simulations in this SequenceDataset.
+        self.sims = np.arange(len(pkts_all))
+
+    def subset(self, idxs):
+        """
+        Returns a new SequenceDataset that contains the specified simulations
+        of this SequenceDataset and shares its packets.
+        """
+        sub = copy.copy(self)
+        sub.sims = self.sims[np.asarray(idxs, dtype=int)]
+        return sub
+
+    def sim_lens(self):
+        """ Returns the number of packets in each simulation. """
+        return self.lens[self.sims]
+
+    def to(self, dev):
+        """
+        Does nothing. Each batch is assembled in main memory and moved to the
+        target device when it is used.
+        """
+
+    def __len__(self):
+        """ Returns the number of simulations in this SequenceDataset. """
+        return self.sims.shape[0]
+
+    def __getitem__(self, key):
+        """
+        Returns the batch for a pair of the form:
+            (array of simulation indices, chunk index)
+        """
+        sims, chunk = key
+        sims = self.sims[np.asarray(sims, dtype=int)]
+        # The position of each of the chunk's packets in its simulation.
+        poss = chunk * self.seq_len + np.arange(self.seq_len)
+        valid = poss < self.lens[sims, np.newaxis]
+        idxs = np.where(valid, self.offsets[sims, np.newaxis] + poss, 0)
+        dat_in = self.dat_in[idxs]
+        dat_in[~valid] = 0
+        return (torch.tensor(dat_in, dtype=torch.float),
+                torch.tensor(
+                    np.where(valid, self.dat_out[idxs], SEQ_PAD_LABEL),
+                    dtype=torch.long),
+                chunk == 0)
+
+
+class SequenceSampler:
+    """
+    Yields the items of a SequenceDataset: Divides its simulations into batches
+    of batch_size simulations, then yields every chunk of each batch, in order.
+    Simulations of similar length are batched together to minimize padding. If
+    shuffle is True, then the batches are processed in random order, and
+    simulations of equal length are batched randomly.
+    """
+
+    def __init__(self, dataset, batch_size, shuffle=True):
+        self.lens = dataset.sim_lens()
+        self.seq_len = dataset.seq_len
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __batches(self):
+        """ Returns a list of the simulation indices of each batch. """
+        num_sims = self.lens.shape[0]
+        order = (
+            np.random.permutation(num_sims) if self.shuffle
+            else np.arange(num_sims))
+        order = order[np.argsort(self.lens[order], kind="stable")]
+        bchs = [order[start_idx:start_idx + self.batch_size]
+                for start_idx in range(0, num_sims, self.batch_size)]
+        if self.shuffle:
+            bchs = [bchs[idx] for idx in np.random.permutation(len(bchs))]
+        return bchs
+
+    def __iter__(self):
+        for sims in self.__batches():
+            for chunk in range(
+                    math.ceil(self.lens[sims].max() / self.seq_len)):
+                yield sims, chunk
+
+    def __len__(self):
+        # The longest simulation in each batch determines its number of
+        # chunks. Since the simulations are sorted by length, the longest
+        # simulations in the batches do not depend on the order.
+        lens = np.sort(self.lens)
+        num_sims = lens.shape[0]
+        return sum(
+            math.ceil(
+                lens[min(start_idx + self.batch_size, num_sims) - 1] /
+                self.seq_len)
+            for start_idx in range(0, num_sims, self.batch_size))
+
+
+def batch_loader(dataset, sampler, num_workers=0, pin_memory=False):
+    """
+    Creates a DataLoader for a Dataset, MemmapDataset, LazyWindowDataset, or
+    SequenceDataset that loads whole batches at once. sampler must yield
+    batches of indices (or, for a SequenceDataset, its keys). If num_workers is
+    greater than 0, then batches are loaded by that many worker processes, and
+    are optionally copied into pinned memory to speed up transfers to a GPU.
+    """
+    if num_workers > 0 and isinstance(dataset, Dataset):
+        dataset.share_memory()
+    return torch.utils.data.DataLoader(
+        dataset, sampler=sampler,
+        # Each item is a whole batch, so disable automatic batching.
+        batch_size=None, num_workers=num_workers, pin_memory=pin_memory,
+        # Do not restart the workers every epoch.
+        persistent_workers=num_workers > 0)
 
 
 class BalancedSampler:
     """
-    A batching sampler that creates balanced batches. The batch size
-    must be evenly divided by the number of classes. This does not
-    inherit from any of the existing Torch Samplers because it does
-    not require any of their functionalty. Instead, this is a wrapper
-    for many other Samplers, one for each class.
+    A batching sampler that creates balanced batches. Every batch contains a
+    fixed number of examples from each class, in proportion to the class's
+    ratio. By default, all classes are represented equally. Under-represented
+    classes are oversampled. This does not inherit from any of the existing
+    Torch Samplers because it does not require any of their functionalty.
+
+    Each epoch's batches are precomputed as a single tensor of shape
+    (number of batches, batch size), so that each batch is a slice of it.
+    Between epochs, the batches are reshuffled using one random permutation
+    per class.
     """
 
-    def __init__(self, dataset, batch_size, drop_last):
-        assert isinstance(dataset, Dataset), \
-            "Dataset must be an instance of utils.Dataset."
+    def __init__(self, dataset, batch_size, drop_last, ratios=None):
+        """
+        dataset: The utils.Dataset or utils.LazyWindowDataset to sample
+            from.
+        batch_size: The number of examples in each batch.
+        drop_last: If True, then the number of batches is determined by
+            the class that is least over-represented, and some examples of the
+            other classes are left out of each epoch. Otherwise, the number of
+            batches is determined by the class that is most over-represented,
+            and every example appears in every epoch.
+        ratios: Optional dictionary mapping each class to an integer weight.
+            Each class's share of a batch is its weight divided by the total
+            weight, and must be a whole number of examples.
+        """
+        assert isinstance(dataset, (Dataset, LazyWindowDataset)), \
+            ("Dataset must be an instance of utils.Dataset or "
+             "utils.LazyWindowDataset.")
         # Determine the unique classes.
-        _, dat_out = dataset.raw()
-        clss = set(dat_out.tolist())
+        dat_out = dataset.labels()
+        clss = sorted(set(dat_out.tolist()))
         num_clss = len(clss)
+        if ratios is None:
+            ratios = {cls: 1 for cls in clss}
+        for cls in clss:
+            assert cls in ratios, f"Missing ratio for class {cls}: {ratios}"
+        tot = sum(ratios[cls] for cls in clss)
         assert batch_size >= num_clss, \
             (f"The batch size ({batch_size}) must be at least as large as the "
              f"number of classes ({num_clss})!")
-        assert batch_size % num_clss == 0, \
-            (f"The number of classes ({num_clss}) must evenly divide the batch "
-             f"size ({batch_size})!")
+        assert all(batch_size * ratios[cls] % tot == 0 and ratios[cls] > 0
+                   for cls in clss), \
+            (f"The class ratios ({ratios}) must divide the batch size "
+             f"({batch_size}) into whole numbers of examples per class!")
 
         print("Balancing classes...")
+        # The number of examples from each class in every batch.
+        self.examples_per_cls = {
+            cls: batch_size * ratios[cls] // tot for cls in clss}
         # Find the indices for each class.
         clss_idxs = {cls: torch.where(dat_out == cls)[0] for cls in clss}
-        # Determine the number of examples in the most populous class.
-        max_examples = max(len(cls_idxs) for cls_idxs in clss_idxs.values())
-        # Generate new samples to fill in under-represented classes.
+        bchs_per_cls = [
+            (len(clss_idxs[cls]) // self.examples_per_cls[cls]) if drop_last
+            else -(-len(clss_idxs[cls]) // self.examples_per_cls[cls])
+            for cls in clss]
+        self.num_batches = max(
+            1, min(bchs_per_cls) if drop_last else max(bchs_per_cls))
+        # For each class, the pool of examples from which each epoch's batches
+        # are drawn.
+        self.pools = {}
         for cls, cls_idxs in clss_idxs.items():
             num_examples = len(cls_idxs)
+            new_examples = (
+                self.num_batches * self.examples_per_cls[cls] - num_examples)
             # If this class has insufficient examples...
-            if num_examples < max_examples:
-                new_examples = max_examples - num_examples
+            if new_examples > 0:
                 # Duplicate existing examples to make this class balanced.
                 # Append the duplicated examples to the true examples.
-                clss_idxs[cls] = torch.cat(
+                cls_idxs = torch.cat(
                     (cls_idxs,
-                     torch.multinomial(
+                     cls_idxs[torch.multinomial(
                          # Sample from the existing examples using a uniform
                          # distribution.
                          torch.ones((num_examples,)),
@@ -146,34 +729,29 @@ class BalancedSampler:
                          # Sample with replacement in case the number of new
                          # examples is greater than the number of existing
                          # examples.
-                         replacement=True)),
+                         replacement=True)]),
                     dim=0)
                 print(f"    Added {new_examples} examples to class {cls}.")
-        # Create a BatchSampler iterator for each class.
-        examples_per_cls = batch_size // num_clss
-        self.samplers = {
-            cls: torch.utils.data.BatchSampler(
-                torch.utils.data.RandomSampler(cls_idxs, replacement=False),
-                examples_per_cls, drop_last)
-            for cls, cls_idxs in clss_idxs.items()}
-        # After __iter__() is called, this will contain an iterator for each
-        # class.
-        self.iters = {}
-        self.num_batches = max_examples // examples_per_cls
+            self.pools[cls] = cls_idxs
+
+    def __plan(self):
+        """
+        Returns a new epoch's batches as a tensor of shape
+        (number of batches, batch size).
+        """
+        return torch.cat(
+            [pool[torch.randperm(len(pool))[
+                :self.num_batches * self.examples_per_cls[cls]]].view(
+                    self.num_batches, self.examples_per_cls[cls])
+             for cls, pool in self.pools.items()],
+            dim=1)
 
     def __iter__(self):
-        # Create an iterator for each class.
-        self.iters = {
-            cls: iter(sampler) for cls, sampler in self.samplers.items()}
-        return self
+        return iter(self.__plan())
 
     def __len__(self):
         return self.num_batches
 
-    def __next__(self):
-        # Pull examples from each class and merge them into a single list.
-        return [idx for it in self.iters.values() for idx in next(it)]
-
 
 class Sim():
     """ Describes the parameters of a simulation. """
@@ -248,34 +826,95 @@ def str_to_args(args_str, order):
     return parsed
 
 
+def compact_flp(flp):
+    """ Returns the path of the compact version of the PCAP file flp. """
+    return f"{flp[:-5] if flp.endswith('.pcap') else flp}{COMPACT_SUFFIX}"
+
+
+def compact_pcap(flp):
+    """
+    Converts a PCAP file into a compact header-only trace (see HDR_DTYPE)
+    containing only the fields that parse_packets() needs. Non-TCP packets are
+    dropped. Deletes the PCAP file and returns the path to the compact trace.
+    """
+    hdrs = []
+    for pkt_dat, pkt_mdat in scapy.utils.RawPcapReader(flp):
+        ppp = scapy.layers.ppp.PPP(pkt_dat)
+        if scapy.layers.inet.TCP not in ppp:
+            continue
+        tcp = ppp[scapy.layers.inet.TCP]
+        # Assume that the timestamp option is first, like parse_packets().
+        tso = tcp.options[0][1] if tcp.options else None
+        tsval, tsecr = tso if isinstance(tso, tuple) else (0, 0)
+        hdrs.append((
+            tcp.seq,
+            [int(part) for part in ppp[scapy.layers.inet.IP].src.split(".")],
+            pkt_mdat.sec * 1000000 + pkt_mdat.usec, tsval, tsecr,
+            pkt_mdat.wirelen))
+    out_flp = compact_flp(flp)
+    # Write to a temporary file first so that a partial trace is never
+    # mistaken for a complete one.
+    tmp_flp = f"{out_flp}.tmp"
+    with open(tmp_flp, "wb") as fil:
+        np.save(fil, np.array(hdrs, dtype=HDR_DTYPE))
+    os.replace(tmp_flp, out_flp)
+    os.remove(flp)
+    return out_flp
+
+
 def parse_packets(flp, packet_size_B, direction="data"):
     """
     Parses a PCAP file. Returns a list of tuples of the form:
         (seq, sender, timestamp us, timestamp option)
     with one entry for every packet. Considers only packets in either the "ack"
-    or "data" direction.
+    or "data" direction. If flp does not exist but a compact version of it does
+    (see compact_pcap()), then the compact version is parsed instead. To parse
+    both directions, use parse_packets_all() to read the file only once.
     """
     dir_opts = ["ack", "data"]
     assert direction in dir_opts, \
         f"\"direction\" must be one of {dir_opts}, but is: {direction}"
+    return parse_packets_all(flp, packet_size_B)[direction]
+
 
-    pkts = []
+def parse_packets_all(flp, packet_size_B):
+    """
+    Parses a PCAP file in a single pass. Returns a dictionary mapping each
+    direction ("ack" and "data") to a list of the packets in that direction,
+    in the format of parse_packets().
+    """
+    if not path.exists(flp) and path.exists(compact_flp(flp)):
+        hdrs = np.load(compact_flp(flp))
+        return {
+            direction: list(zip(
+                dir_hdrs["seq"].tolist(), dir_hdrs["src"][:, 2].tolist(),
+                dir_hdrs["time_us"].astype(float).tolist(),
+                zip(dir_hdrs["tsval"].tolist(), dir_hdrs["tsecr"].tolist())))
+            for direction, dir_hdrs in [
+                ("ack", hdrs[hdrs["src"][:, 0] == 20]),
+                ("data", hdrs[(hdrs["src"][:, 0] == 10) &
+                              (hdrs["wirelen"] >= packet_size_B)])]}
+
+    pkts = {"ack": [], "data": []}
     for pkt_dat, pkt_mdat in scapy.utils.RawPcapReader(flp):
         ppp = scapy.layers.ppp.PPP(pkt_dat)
         src = [int(part) for part in ppp[scapy.layers.inet.IP].src.split(".")]
-        if ((direction == "data" and src[0] == 10 and
-             pkt_mdat.wirelen >= packet_size_B) or
-                (direction == "ack" and src[0] == 20)):
-            tcp = ppp[scapy.layers.inet.TCP]
-            pkts.append((
-                # Sequence number.
-                tcp.seq,
-                # Sender.
-                src[2],
-                # Timestamp. Not using parse_time_us for efficiency purpose.
-                pkt_mdat.sec * 1e6 + pkt_mdat.usec,
-                # Timestamp option.
-                tcp.options[0][1]))
+        if src[0] == 10 and pkt_mdat.wirelen >= packet_size_B:
+            direction = "data"
+        elif src[0] == 20:
+            direction = "ack"
+        else:
+            continue
+        tcp = ppp[scapy.layers.inet.TCP]
+        pkts[direction].append((
+            # Sequence number.
+            tcp.seq,
+            # Sender.
+            src[2],
+            # Timestamp. Not using parse_time_us for efficiency purpose.
+            pkt_mdat.sec * 1e6 + pkt_mdat.usec,
+            # Timestamp option.
+            tcp.options[0][1]))
     return pkts
 
 
@@ -292,23 +931,133 @@ def scale_all(dat, scl_prms, min_out, max_out, standardize):
     """
     Uses the provided scaling parameters to scale the columns of
     dat. If standardize is False, then the values are rescaled to the
-    range [min_out, max_out].
+    range [min_out, max_out]. See scaling.transform().
     """
-    dat_dtype = dat.dtype
-    fets = dat_dtype.names
+    fets = dat.dtype.names
     num_scl_prms = len(scl_prms)
     assert len(fets) == num_scl_prms, \
         (f"Mismatching dtype ({fets}) and number of scale parameters "
          f"({num_scl_prms})!")
-    new = np.empty(dat.shape, dtype=dat_dtype)
-    for idx, fet in enumerate(fets):
-        prm_1, prm_2 = scl_prms[idx]
-        new[fet] = (
-            (dat[fet] - prm_1) / prm_2 if standardize else
-            scale(
-                dat[fet], min_in=prm_1, max_in=prm_2, min_out=min_out,
-                max_out=max_out))
-    return new
+    new = clean(dat)
+    scaling.transform(new, scl_prms, standardize, min_out, max_out)
+    return as_structured(new, fets)
+
+
+def impute_all(dat, imp_prms):
+    """
+    Replaces the unknown values (-1) in the columns of dat with the provided
+    imputation values. See scaling.impute().
+    """
+    fets = dat.dtype.names
+    new = clean(dat)
+    scaling.impute(new, imp_prms)
+    return as_structured(new, fets)
+
+
+def get_recv_pcap_flp(sim_dir, unfair_idx):
+    """
+    Returns the path to the packet trace captured at the receiver of an unfair
+    flow of the simulation in sim_dir. unfair_idx is the index of the unfair
+    flow, starting from 0.
+    """
+    sim = Sim(sim_dir)
+    # Node 1 is the bottleneck router, followed by the senders of the unfair
+    # flows, the senders of the fair flows, and the receivers in the same
+    # order.
+    return path.join(
+        sim_dir,
+        f"{sim.name}-{unfair_idx + 2 + sim.unfair_flws + sim.fair_flws}-0.pcap")
+
+
+def get_impute_prms_flp(scl_prms_flp):
+    """
+    Returns the path to the imputation values file that corresponds to a
+    scaling parameters file.
+    """
+    return path.join(path.dirname(scl_prms_flp), IMPUTE_PRMS_FLN)
+
+
+def save_impute_prms(flp, imp_prms):
+    """
+    Saves imputation values. NaNs (which denote features without any known
+    values) are stored as nulls.
+    """
+    print(f"Saving imputation values: {flp}")
+    with open(flp, "w") as fil:
+        json.dump(
+            [None if math.isnan(prm) else prm for prm in imp_prms.tolist()],
+            fil)
+
+
+def load_impute_prms(flp):
+    """ Loads imputation values saved by save_impute_prms(). """
+    with open(flp, "r") as fil:
+        return np.array(json.load(fil), dtype=float)
+
+
+def get_split_flps(split_dir, name):
+    """
+    Returns the paths to a split's data file and number of flows file. See
+    prepare_data.py.
+    """
+    return (path.join(split_dir, f"{name}.npy"),
+            path.join(split_dir, f"{name}_num_flws.npy"))
+
+
+def save_split_dtype(split_dir, dtype):
+    """ Saves the dtype of the split files in split_dir. """
+    with open(path.join(split_dir, SPLIT_DTYPE_FLN), "w") as fil:
+        json.dump(dtype.descr, fil)
+
+
+def load_split_dtype(split_dir):
+    """ Loads the dtype of the split files in split_dir. """
+    with open(path.join(split_dir, SPLIT_DTYPE_FLN), "r") as fil:
+        return np.dtype([tuple(fet) for fet in json.load(fil)])
+
+
+def save_split_stats(split_dir, stats, standardize):
+    """
+    Saves the per-column statistics (a scaling.OnlineStats) of the training
+    split in split_dir, as well as whether the split's scaling parameters are
+    for standardization.
+    """
+    flp = path.join(split_dir, SPLIT_STATS_FLN)
+    print(f"Saving training split statistics: {flp}")
+    np.savez(
+        flp, standardize=standardize,
+        unknown=np.nan if stats.unknown is None else stats.unknown,
+        **stats.moments())
+
+
+def load_split_stats(split_dir):
+    """
+    Loads the statistics saved by save_split_stats(). Returns a tuple of the
+    form: (scaling.OnlineStats, standardize).
+    """
+    flp = path.join(split_dir, SPLIT_STATS_FLN)
+    assert path.exists(flp), \
+        (f"Training split statistics not found: {flp} Recreate the splits "
+         "using prepare_data.py.")
+    with np.load(flp) as fil:
+        unknown = float(fil["unknown"])
+        return (scaling.OnlineStats.from_moments(
+                    fil, None if math.isnan(unknown) else unknown),
+                bool(fil["standardize"]))
+
+
+def load_split(split_dir, name):
+    """
+    Opens a split created by prepare_data.py as read-only memory-mapped arrays.
+    Returns a tuple of the form: (data, total number of flows).
+    """
+    dtype = load_split_dtype(split_dir)
+    dat_flp, num_flws_flp = get_split_flps(split_dir, name)
+    num_rows = path.getsize(dat_flp) // dtype.itemsize
+    return (np.memmap(dat_flp, dtype, mode="r", shape=(num_rows,)),
+            np.memmap(
+                num_flws_flp, SPLIT_NUM_FLWS_DTYPE, mode="r",
+                shape=(num_rows,)))
 
 
 def load_sim(flp, msg=None):
@@ -328,6 +1077,65 @@ def load_sim(flp, msg=None):
     return Sim(flp), dat
 
 
+def load_sim_cols(flp, fets_grps, warmup_prc=0, msg=None):
+    """
+    Loads selected columns from one simulation results file (generated by
+    parse_dumbbell.py) without materializing the full results matrix.
+    fets_grps is a list of lists of column names. Drops the first warmup_prc
+    percent of rows. Returns a tuple of the form:
+        (utils.Sim, list of 2D float arrays)
+    where the list contains one array for each entry in fets_grps, whose
+    columns are in the order given by that entry. The list is None if the file
+    is invalid.
+    """
+    print(f"{'' if msg is None else f'{msg} - '}Parsing: {flp}")
+    try:
+        with zipfile.ZipFile(flp) as archive:
+            assert archive.namelist() == ["1.npy"], \
+                "More than one unfair flow detected!"
+            with archive.open("1.npy") as npy:
+                shape, fortran, dtype = read_npy_header(npy)
+                assert len(shape) == 1 and not fortran, \
+                    f"Results must be a 1D structured array: {flp}"
+                num_rows = shape[0]
+                start_idx = math.floor(num_rows * warmup_prc / 100)
+                dats = [
+                    np.empty((num_rows - start_idx, len(fets)), dtype=float)
+                    for fets in fets_grps]
+                # Skip the warmup rows without parsing them.
+                npy.seek(npy.tell() + start_idx * dtype.itemsize)
+                for chunk_start_idx in range(
+                        start_idx, num_rows, LOAD_CHUNK_ROWS):
+                    num_chunk_rows = min(
+                        LOAD_CHUNK_ROWS, num_rows - chunk_start_idx)
+                    buf = npy.read(num_chunk_rows * dtype.itemsize)
+                    assert len(buf) == num_chunk_rows * dtype.itemsize, \
+                        f"Truncated results: {flp}"
+                    chunk = np.frombuffer(buf, dtype=dtype)
+                    dst_idx = chunk_start_idx - start_idx
+                    for dat, fets in zip(dats, fets_grps):
+                        for col, fet in enumerate(fets):
+                            dat[dst_idx:dst_idx + num_chunk_rows, col] = (
+                                chunk[fet])
+    except zipfile.BadZipFile:
+        print(f"Bad simulation file: {flp}")
+        dats = None
+    return Sim(flp), dats
+
+
+def as_structured(arr, names):
+    """
+    Returns a structured view of the C-contiguous 2D array arr whose columns
+    are named using names. No data is copied.
+    """
+    assert arr.ndim == 2 and arr.flags.c_contiguous, \
+        "Only C-contiguous 2D arrays are supported!"
+    assert arr.shape[1] == len(names), \
+        f"Mismatched columns ({arr.shape[1]}) and names ({len(names)})!"
+    return arr.view(
+        dtype=[(name, arr.dtype) for name in names]).reshape(arr.shape[0])
+
+
 def clean(arr):
     """
     "Cleans" the provided numpy array by removing its column names. I.e., this
@@ -341,6 +1149,9 @@ def clean(arr):
         ("Only 1D structured arrays are supported, but this one has "
          f"{num_dims} dims!")
 
+    view = unstructured_view(arr)
+    if view is not None:
+        return view.copy()
     num_cols = len(arr.dtype.names)
     new = np.empty((arr.shape[0], num_cols), dtype=float)
     for col in range(num_cols):
@@ -348,6 +1159,22 @@ def clean(arr):
     return new
 
 
+def unstructured_view(arr):
+    """
+    Returns a 2D float view of the 1D structured array arr, with one column per
+    field. This is the inverse of as_structured(). Returns None if arr's fields
+    are not all packed float64 values, in which case a view is impossible.
+    """
+    fets = arr.dtype.names
+    if (arr.ndim != 1 or
+            arr.strides != (arr.dtype.itemsize,) or
+            arr.dtype.itemsize != 8 * len(fets) or
+            any(arr.dtype.fields[fet][:2] != (np.dtype("float64"), 8 * idx)
+                for idx, fet in enumerate(fets))):
+        return None
+    return arr.view(np.float64).reshape((arr.shape[0], len(fets)))
+
+
 def visualize_classes(net, dat):
     """ Prints statistics about the classes in dat. """
     # Visualaize the ground truth data.
@@ -367,6 +1194,113 @@ def visualize_classes(net, dat):
         f"Error visualizing ground truth! {tot} != {tot_actual}"
 
 
+def win_start_idxs(arr_times, end_idxs, dur_us):
+    """
+    For windows of packets that end with the packets at end_idxs, returns the
+    index of each window's first packet. A window contains the packets that
+    arrived at most dur_us before its last packet. arr_times must be sorted. A
+    window whose first packet is also the first packet overall (index 0) might
+    have been truncated.
+    """
+    return np.searchsorted(
+        arr_times, arr_times[np.asarray(end_idxs)] - dur_us, side="left")
+
+
+def bucketize(arr_times, start_idxs, end_idxs, dur_us, num_buckets):
+    """
+    Divides each window of packets, from start_idxs[i] to end_idxs[i]
+    (inclusive), into num_buckets intervals that each have duration
+    dur_us / num_buckets, beginning with the arrival time of the window's first
+    packet. Returns a 2D array of shape (number of windows, num_buckets) that
+    contains the number of packets that arrived during each interval. Packets
+    that arrive exactly at the end of the last interval are counted in the last
+    interval. arr_times must be sorted and have integer values.
+
+    Instead of assigning each packet to a bucket, this finds the bucket
+    boundaries using binary search, so the running time does not depend on
+    the number of packets in each window.
+    """
+    start_idxs = np.asarray(start_idxs)
+    end_idxs = np.asarray(end_idxs)
+    interval_us = dur_us / num_buckets
+    # For each bucket index k, the smallest integer offset from the beginning
+    # of a window whose bucket index, floor(offset / interval_us), is at least
+    # k. Fix up the result of ceil() so that this matches the rounding of the
+    # division exactly. Includes two extra indices to detect packets beyond the
+    # end of the last interval.
+    bkt_idxs = np.arange(num_buckets + 2)
+    tshs = np.ceil(bkt_idxs * interval_us)
+    tshs -= np.floor((tshs - 1) / interval_us) >= bkt_idxs
+    tshs += np.floor(tshs / interval_us) < bkt_idxs
+
+    num_wins = start_idxs.shape[0]
+    cnts = np.empty((num_wins, num_buckets), dtype=int)
+    num_extra = 0
+    chunk_wins = max(1, BUCKETIZE_CHUNK_ELEMS // (num_buckets + 2))
+    for chunk_start in range(0, num_wins, chunk_wins):
+        starts = start_idxs[chunk_start:chunk_start + chunk_wins, np.newaxis]
+        ends = end_idxs[chunk_start:chunk_start + chunk_wins, np.newaxis] + 1
+        # For each window and bucket index k, the number of the window's
+        # packets whose bucket index is at least k.
+        cnts_ge = ends - np.clip(
+            np.searchsorted(
+                arr_times, arr_times[starts] + tshs, side="left"),
+            starts, ends)
+        assert not cnts_ge[:, -1].any(), \
+            (f"Found packets beyond the end of the last of {num_buckets} "
+             "buckets!")
+        cnts_chunk = cnts[chunk_start:chunk_start + chunk_wins]
+        cnts_chunk[:] = cnts_ge[:, :-2] - cnts_ge[:, 1:-1]
+        # Count packets that arrive exactly at the end of the last interval in
+        # the last interval.
+        cnts_chunk[:, -1] += cnts_ge[:, -2]
+        num_extra += cnts_ge[:, -2].sum()
+    if num_extra:
+        print(f"Warning: {num_extra} packets arrived at the end of the last "
+              "interval. Counting them in the last interval.")
+    return cnts
+
+
+def windows_view(dat, win):
+    """
+    Returns a read-only view of the 2D array dat with shape
+    (dat.shape[0] - win + 1, win, dat.shape[1]), where entry i is the window of
+    win consecutive rows that begins with row i. Does not copy dat.
+    """
+    return np.lib.stride_tricks.sliding_window_view(
+        dat, win, axis=0).transpose(0, 2, 1)
+
+
+def bucket_fets(fets, num_buckets):
+    """
+    Returns the names and scaling groups of the features of windows that are
+    divided into num_buckets arrival time buckets (see bucketize()), where fets
+    are the names of the per-packet features. There is one feature for each
+    bucket, followed by the features in fets other than "arrival time us",
+    which are taken from the last packet in each window. The buckets all share
+    a scaling group. Each other feature is part of its own group.
+    """
+    other_fets = [fet for fet in fets if fet != "arrival time us"]
+    return (
+        [f"bucket_{bkt}" for bkt in range(num_buckets)] + other_fets,
+        np.array([0] * num_buckets + list(range(1, len(other_fets) + 1))))
+
+
+def window_fets(fets, win):
+    """
+    Returns the names and scaling groups of the features of flattened windows
+    of win packets (see windows_view()), where fets are the names of the
+    per-packet features. The packets are in order, and each packet's features
+    are in order. All copies of a particular feature share the same scaling
+    group.
+    """
+    scl_grps, names = zip(
+        *[(scl_grp, f"{name}_{idx}")
+          for idx in range(win)
+          for scl_grp, name in enumerate(fets)])
+    return list(names), np.array(scl_grps)
+
+
 def safe_mathis_label(tput_true, tput_mathis):
     """
     Returns the Mathis model label based on the true throughput and
@@ -514,6 +1448,32 @@ def load_tmp_file(flp):
     return dat_in, dat_out, dat_out_raw, dat_out_oracle, scl_grps
 
 
+def map_regions(flp, shapes_dtypes, create=False):
+    """
+    Maps consecutive regions of the file flp as arrays. shapes_dtypes is a list
+    of tuples of the form (shape, dtype), one for each region. If create is
+    True, then the file is created (or truncated) to fit all of the regions.
+    Returns a list of arrays, one for each region. Writes to an array are
+    visible to every process that has mapped the same file.
+    """
+    szs_B = [
+        math.prod(shape) * np.dtype(dtype).itemsize
+        for shape, dtype in shapes_dtypes]
+    if create:
+        with open(flp, "wb") as fil:
+            fil.truncate(sum(szs_B))
+    regions = []
+    offset_B = 0
+    for (shape, dtype), sz_B in zip(shapes_dtypes, szs_B):
+        # Empty regions cannot be mapped.
+        regions.append(
+            np.memmap(
+                flp, dtype=dtype, mode="r+", offset=offset_B, shape=shape)
+            if sz_B else np.empty(shape, dtype=dtype))
+        offset_B += sz_B
+    return regions
+
+
 def get_lock_flp(out_dir):
     """ Returns the path to a lock file in out_dir. """
     return path.join(out_dir, LOCK_FLN)
@@ -540,6 +1500,22 @@ def remove_lock_file(out_dir):
         pass
 
 
+def read_npy_header(npy):
+    """
+    Reads the header of the NPY file object npy, leaving npy positioned at the
+    start of the array data. Returns a tuple of the form:
+        (shape, whether the array is in Fortran order, np.dtype)
+    """
+    version = np.lib.format.read_magic(npy)
+    if version == (1, 0):
+        read_header = np.lib.format.read_array_header_1_0
+    elif version == (2, 0):
+        read_header = np.lib.format.read_array_header_2_0
+    else:
+        raise Exception(f"Unsupported NPY format version: {version}")
+    return read_header(npy, max_header_size=NPY_MAX_HEADER_B)
+
+
 def get_npz_headers(flp):
     """
     Takes a path to an .npz file, which is a Zip archive of .npy files, and
@@ -550,9 +1526,8 @@ def get_npz_headers(flp):
     """
     def decode_header(archive, name):
         """ Decodes the header information of a single NPY file. """
-        npy = archive.open(name)
-        version = np.lib.format.read_magic(npy)
-        shape, fortran, dtype = np.lib.format._read_array_header(npy, version)
+        with archive.open(name) as npy:
+            shape, _, dtype = read_npy_header(npy)
         return name[:-4], shape, dtype
 
     with zipfile.ZipFile(flp) as archive: